@@ -9,8 +9,11 @@
 import os
 import datetime
 import time
+import sys
 import pandas as pd
 import matplotlib.pyplot as plt
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+from growControl.data_access import Data_Store
 #%matplotlib inline
 
 # In[2]:
@@ -35,34 +38,13 @@ else:
 # In[3]:
 
 
-data_files = {}
-for d in os.listdir(data_path):
-    if not os.path.isfile(os.path.join(data_path,d)):
-        continue
-    root = d[:d.rfind("_")]
-    full_path = os.path.join(data_path,d)
-    if root not in data_files:
-        data_files[root] = [full_path]
-    else:
-        data_files[root].append(full_path)
-
-print("Found all files after {:.1f} s".format(time.time()-start_time))
-
-# In[4]:
-
+store = Data_Store(data_path)
+end_time = time.time()
+start_time_data = end_time - 10*24*60*60 # last 10 days
 
 def load_df(root_name):
-    li = []
-    for fname in sorted(data_files[root_name])[-10:]:
-        df_temp = pd.read_csv(fname,index_col=None,header=0,skiprows=lambda x: (x!=0) and not x%10)
-        li.append(df_temp)
-    df = pd.concat(li,axis=0,ignore_index=True)
-
-
-    df["datetime_timezone"] = pd.to_datetime(df["datetime_timezone"])
-    df.sort_values("datetime_timezone",inplace=True)
-    df.reset_index(inplace=True,drop=True)
-    return df
+    # Only the byte ranges of the daily files covering the last 10 days are read, using the index next to the data
+    return store.load(root_name,start_time_data,end_time,every=10)
 df_ph = load_df("sensor_ph_bin1")
 df_control_ph = load_df("controller_ph_pump")
 
@@ -0,0 +1,319 @@
+'''
+Benchmark the cost of one tick of each device, and of the main loop body, in csv/mock mode
+
+Every device reads from a generated mock input that loops forever, and runs on a Virtual_Clock that is advanced
+    between calls so read_every/control_every never gate a call. For each device the latency of every call is
+    recorded with time.perf_counter, along with the time spent in append_to_file (the file I/O of the tick).
+    The main loop body is the Scheduler.run_pending() of main.py with the same devices and read_every values,
+    ticking the clock by one second, without drawing the screen.
+
+The devices are run with the rows written straight to the files ("direct") and queued on an Output_Writer
+    ("output_writer"). --existing-days fills the output directory with that many days of old files first,
+    to see how the cost changes as the output directory grows.
+
+    python benchmarks/bench_devices.py --calls 2000 --existing-days 365
+    python benchmarks/bench_devices.py --compare benchmarks/results/old.json benchmarks/results/new.json
+
+Results are saved as json in benchmarks/results/ unless --output is given
+'''
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+import growControl
+from growControl import Sensor_ph, Sensor_volume, Sensor_humidity_temp, Controllable_Pump, Controller_ph_Pump, \
+                        Controller_Volume_Pump, Output_Writer, Output_Rotation, Scheduler, Virtual_Clock, Csv_Input
+
+repo_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),"..")
+ph_calibration_file = os.path.join(repo_path,"test","test_inputs","sensor_ph_calibration_mock.json")
+volume_calibration_file = os.path.join(repo_path,"test","test_inputs","sensor_volume_calibration_mock.json")
+
+# modules that import append_to_file, patched to time the file I/O
+device_modules = ["sensor_ph","sensor_volume","sensor_humidity_temp","control_ph_pump","control_volume_pump","rollups"]
+
+def latency_stats(latencies):
+    '''
+    Summarize a list of per call latencies in seconds
+    Returns a dict of the number of calls, total/mean/min/percentiles/max in microseconds, and calls per second
+    '''
+    latencies = sorted(latencies)
+    n = len(latencies)
+    total = sum(latencies)
+    def percentile(p):
+        return latencies[min(int(p/100.*n),n-1)] * 1e6
+    return {"calls":n,
+            "total_s":total,
+            "mean_us":total/n*1e6,
+            "min_us":latencies[0]*1e6,
+            "p50_us":percentile(50),
+            "p90_us":percentile(90),
+            "p99_us":percentile(99),
+            "max_us":latencies[-1]*1e6,
+            "per_second":n/total if total > 0 else None}
+
+class Io_Timer:
+    '''
+    Replaces append_to_file in the device modules with a version that adds up the time spent in it
+    '''
+    def __init__(self):
+        self.total = 0.
+        self.calls = 0
+        self._original = growControl.output_writer.append_to_file
+
+    def __enter__(self):
+        for name in device_modules:
+            setattr(sys.modules["growControl." + name],"append_to_file",self._timed)
+        return self
+
+    def __exit__(self,*args):
+        for name in device_modules:
+            setattr(sys.modules["growControl." + name],"append_to_file",self._original)
+
+    def reset(self):
+        self.total = 0.
+        self.calls = 0
+
+    def _timed(self,path,data,output_writer=None):
+        start = time.perf_counter()
+        self._original(path,data,output_writer)
+        self.total += time.perf_counter() - start
+        self.calls += 1
+
+def make_mock_inputs(path,rows=10000,seed=0):
+    '''
+    Write mock inputs for the sensors to path
+    Returns a dict of sensor -> file
+    '''
+    rng = random.Random(seed)
+    files = {"ph":os.path.join(path,"mock_ph.csv"),
+            "volume":os.path.join(path,"mock_volume.csv"),
+            "humidity_temp":os.path.join(path,"mock_humidity_temp.csv")}
+    with open(files["ph"],'w') as fp:
+        for _ in range(rows):
+            fp.write("{:.6f}\n".format(rng.gauss(0.,0.02)))
+    with open(files["volume"],'w') as fp:
+        for _ in range(rows):
+            fp.write("{:.8f}\n".format(rng.gauss(0.0012,0.00005)))
+    with open(files["humidity_temp"],'w') as fp:
+        for _ in range(rows):
+            fp.write("{:.1f},{:.1f}\n".format(rng.gauss(50.,2.),rng.gauss(22.,0.5)))
+    return files
+
+def populate_output_dir(path,output_file_bases,days,rows_per_day=100):
+    '''
+    Fill path with days of old daily files for each of output_file_bases
+    '''
+    today = datetime.date.today()
+    row = "0.0,1970-01-01 00:00:00+00:00,0.0,0.0,0.0,0.0\n" * rows_per_day
+    for base in output_file_bases:
+        for ii in range(1,days+1):
+            day = today - datetime.timedelta(days=ii)
+            with open(os.path.join(path,"{}_{}.csv".format(base,day.isoformat())),'w') as fp:
+                fp.write("time,datetime_timezone,a,b,c,d\n")
+                fp.write(row)
+
+def make_devices(output_path,mock_files,clock,output_writer,rollups=False):
+    '''
+    Create the devices of main.py reading from the mock inputs
+    Returns a dict of name -> device
+    '''
+    kwargs = {"clock":clock,"output_writer":output_writer,"output_rotation":Output_Rotation(clock=clock)}
+    devices = {}
+    devices["Sensor_ph"] = Sensor_ph(output_path,"sensor_ph_bin1",
+                                        average_factor=0.99,
+                                        read_every=10.,
+                                        csv=Csv_Input(mock_files["ph"],end_of_file="loop"),
+                                        calibration_file=ph_calibration_file,
+                                        calibrate_on_startup=False,
+                                        rollups=rollups,
+                                        **kwargs)
+    devices["Sensor_humidity_temp"] = Sensor_humidity_temp(None,output_path,"humidity_temp_grow",
+                                        read_every=30.,
+                                        average_factor_temp=0.8,
+                                        average_factor_humidity=0.8,
+                                        csv=Csv_Input(mock_files["humidity_temp"],end_of_file="loop"),
+                                        rollups=rollups,
+                                        **kwargs)
+    devices["Sensor_volume"] = Sensor_volume(output_path,"sensor_volume",
+                                        iterations_per_reading=5,
+                                        average_factor=0.9,
+                                        read_every=30.,
+                                        csv=Csv_Input(mock_files["volume"],end_of_file="loop"),
+                                        calibration_file=volume_calibration_file,
+                                        calibrate_on_startup=False,
+                                        rollups=rollups,
+                                        **kwargs)
+    # ph_max below any reading and volume_min above any reading so the controllers act on every tick
+    devices["Controller_ph_Pump"] = Controller_ph_Pump(devices["Sensor_ph"],
+                                        Controllable_Pump(None,clock=clock),
+                                        Controllable_Pump(None,clock=clock),
+                                        output_path,"controller_ph_pump",
+                                        ph_min=-1.,
+                                        ph_max=-1.,
+                                        ml_per_s=1.75,
+                                        dispense_volume=3,
+                                        control_every=30*60,
+                                        warmup_time=0.,
+                                        **kwargs)
+    devices["Controller_Volume_Pump"] = Controller_Volume_Pump(devices["Sensor_volume"],
+                                        Controllable_Pump(None,clock=clock),
+                                        output_path,"controller_volume_pump",
+                                        volume_min=1e6,
+                                        control_every=30*60,
+                                        warmup_time=0.,
+                                        **kwargs)
+    return devices
+
+def device_period(device):
+    return getattr(device,"read_every",None) or getattr(device,"control_every")
+
+def bench_devices(output_path,mock_files,calls,writer):
+    '''
+    Time calls ticks of each device, each tick is a reading or control action
+    '''
+    clock = Virtual_Clock()
+    output_writer = Output_Writer(batch_size=50,flush_every=10.) if writer == "output_writer" else None
+    devices = make_devices(output_path,mock_files,clock,output_writer)
+    results = {}
+    with Io_Timer() as io_timer:
+        for name,device in devices.items():
+            io_timer.reset()
+            period = device_period(device)
+            latencies = []
+            for _ in range(calls):
+                clock.advance(period)
+                start = time.perf_counter()
+                device()
+                latencies.append(time.perf_counter() - start)
+            results[name] = latency_stats(latencies)
+            results[name]["io_s"] = io_timer.total
+            results[name]["io_calls"] = io_timer.calls
+            results[name]["io_fraction"] = io_timer.total / results[name]["total_s"]
+    if output_writer is not None:
+        start = time.perf_counter()
+        output_writer.close()
+        results["output_writer_close_s"] = time.perf_counter() - start
+    return results
+
+def bench_main_loop(output_path,mock_files,ticks,writer):
+    '''
+    Time ticks of the main.py loop body, Scheduler.run_pending() with the clock moved 1 second each tick
+    '''
+    clock = Virtual_Clock()
+    output_writer = Output_Writer(batch_size=50,flush_every=10.) if writer == "output_writer" else None
+    devices = make_devices(output_path,mock_files,clock,output_writer,rollups=True)
+    scheduler = Scheduler(late_tolerance=1.0,clock=clock)
+    for name,device in devices.items():
+        scheduler.add(device,device_period(device),name=name)
+
+    latencies = []
+    readings = 0
+    with Io_Timer() as io_timer:
+        for _ in range(ticks):
+            clock.advance(1.)
+            start = time.perf_counter()
+            readings += scheduler.run_pending()
+            latencies.append(time.perf_counter() - start)
+    results = latency_stats(latencies)
+    results["device_calls"] = readings
+    results["device_calls_per_second"] = readings / results["total_s"] if results["total_s"] > 0 else None
+    results["io_s"] = io_timer.total
+    results["io_calls"] = io_timer.calls
+    if output_writer is not None:
+        output_writer.close()
+    return results
+
+def git_commit():
+    '''
+    Returns the current git commit of the repository, None if it is not available
+    '''
+    try:
+        return subprocess.check_output(["git","rev-parse","--short","HEAD"],cwd=repo_path,stderr=subprocess.DEVNULL).decode().strip()
+    except:
+        return None
+
+def print_results(results):
+    for writer,writer_results in results.items():
+        print("{}:".format(writer))
+        print("    {:<24} {:>10} {:>10} {:>10} {:>10} {:>12} {:>8}".format("device","p50 us","p99 us","max us","io us/call","per second","io %"))
+        for name,stats in writer_results.items():
+            if not isinstance(stats,dict):
+                continue
+            io_per_call = stats["io_s"] / stats["calls"] * 1e6
+            print("    {:<24} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f} {:>12.0f} {:>8.1f}".format(name,stats["p50_us"],stats["p99_us"],stats["max_us"],
+                                                                            io_per_call,stats["per_second"],100.*stats["io_s"]/stats["total_s"]))
+
+def compare(old_file,new_file):
+    '''
+    Print the change in p50 and p99 latency between two result files
+    '''
+    with open(old_file,'r') as fp:
+        old = json.load(fp)
+    with open(new_file,'r') as fp:
+        new = json.load(fp)
+    print("{} ({}) -> {} ({})".format(old_file,old["metadata"]["commit"],new_file,new["metadata"]["commit"]))
+    for writer,writer_results in new["results"].items():
+        for name,stats in writer_results.items():
+            old_stats = old["results"].get(writer,{}).get(name)
+            if not isinstance(stats,dict) or not isinstance(old_stats,dict):
+                continue
+            print("    {:<14} {:<24} p50 {:>9.1f} -> {:>9.1f} us ({:+.0f}%)   p99 {:>9.1f} -> {:>9.1f} us ({:+.0f}%)".format(writer,name,
+                    old_stats["p50_us"],stats["p50_us"],100.*(stats["p50_us"]/old_stats["p50_us"]-1),
+                    old_stats["p99_us"],stats["p99_us"],100.*(stats["p99_us"]/old_stats["p99_us"]-1)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the per tick cost of the growControl devices in csv/mock mode")
+    parser.add_argument("--calls",type=int,default=2000,help="ticks of each device and of the main loop")
+    parser.add_argument("--existing-days",type=int,default=0,help="days of old files to put in the output directory first")
+    parser.add_argument("--writer",choices=["direct","output_writer","both"],default="both")
+    parser.add_argument("--output",default=None,help="json file to save the results to")
+    parser.add_argument("--compare",nargs=2,default=None,metavar=("OLD","NEW"),help="compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        compare(*args.compare)
+        sys.exit(0)
+
+    writers = ["direct","output_writer"] if args.writer == "both" else [args.writer]
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        mock_files = make_mock_inputs(tmp_dir)
+        results = {}
+        for writer in writers:
+            output_path = os.path.join(tmp_dir,writer,"")
+            os.makedirs(output_path)
+            populate_output_dir(output_path,["sensor_ph_bin1","humidity_temp_grow","sensor_volume","controller_ph_pump","controller_volume_pump"],
+                                args.existing_days)
+            results[writer] = bench_devices(output_path,mock_files,args.calls,writer)
+            results[writer]["main_loop"] = bench_main_loop(output_path,mock_files,args.calls,writer)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    print_results(results)
+
+    commit = git_commit()
+    metadata = {"commit":commit,
+                "time":datetime.datetime.now().astimezone().isoformat(),
+                "python":platform.python_version(),
+                "platform":platform.platform(),
+                "machine":platform.machine(),
+                "calls":args.calls,
+                "existing_days":args.existing_days,
+                "main_loop_excludes":"draw_screen"}
+    output_file = args.output
+    if output_file is None:
+        results_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),"results")
+        os.makedirs(results_path,exist_ok=True)
+        output_file = os.path.join(results_path,"bench_devices_{}_{}.json".format(commit,datetime.datetime.now().strftime("%Y%m%dT%H%M%S")))
+    with open(output_file,'w') as fp:
+        json.dump({"metadata":metadata,"results":results},fp,indent=2)
+    print("Saved results to {}".format(output_file))
@@ -0,0 +1,124 @@
+'''
+Benchmark how long it takes to import growControl, and check that the import is quiet
+
+Each import is run in a fresh python process with -X importtime, so nothing is cached in sys.modules.
+    For each statement the median time of its imports as measured by importtime, the modules
+    it loaded beyond the ones python loads at startup that take the most time, and anything it printed
+    are reported. With --max-ms the script exits with status 1 if the median
+    of the first statement is slower than that, or if any import printed something, so it can gate CI.
+
+    python benchmarks/bench_import.py --runs 20 --max-ms 20
+
+Results are saved as json in benchmarks/results/ unless --output is given
+'''
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+
+repo_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),"..")
+
+statements = ["import growControl",
+                "from growControl import Scheduler, Virtual_Clock",
+                "from growControl import Sensor_ph, Controller_ph_Pump, Controllable_Pump",
+                "from growControl.data_access import Data_Store"]
+
+def time_import(statement,startup_modules=()):
+    '''
+    Run statement in a new python process
+    startup_modules: the modules python imports before running the statement, left out of the total
+    Returns (microseconds of all of the imports, {module: cumulative microseconds}, stdout)
+    '''
+    result = subprocess.run([sys.executable,"-X","importtime","-c",statement],cwd=repo_path,capture_output=True,text=True,check=True)
+    modules = {}
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us,cumulative_us,name = line[len("import time:"):].split("|")
+        if not cumulative_us.strip().isdigit(): # the header
+            continue
+        modules[name.strip()] = int(cumulative_us)
+        if len(name) - len(name.lstrip()) == 1 and name.strip() not in startup_modules: # nested imports are indented, their time is in the top level one
+            total += int(cumulative_us)
+    return total,modules,result.stdout
+
+def bench_import(statement,runs,startup_modules):
+    '''
+    Returns a dict of the statistics of runs imports of statement
+    startup_modules: the modules python imports before running the statement, left out of the report
+    '''
+    totals = []
+    modules = {}
+    output = ""
+    for ii in range(runs):
+        total,run_modules,stdout = time_import(statement,startup_modules)
+        totals.append(total)
+        output += stdout
+        for name,us in run_modules.items():
+            if name in startup_modules:
+                continue
+            modules.setdefault(name,[]).append(us)
+    heaviest = sorted(((statistics.median(us),name) for name,us in modules.items() if not name.startswith("growControl")),reverse=True)[:10]
+    return {"median_ms":statistics.median(totals)/1000.,
+            "min_ms":min(totals)/1000.,
+            "max_ms":max(totals)/1000.,
+            "modules_loaded":len(modules),
+            "heaviest_ms":{name:us/1000. for us,name in heaviest},
+            "hardware_modules":sorted(name for name in modules if name.split(".")[0] in ("RPi","Adafruit_DHT","board","busio","adafruit_ads1x15")),
+            "printed":output}
+
+def git_commit():
+    '''
+    Returns the current git commit of the repository, None if it is not available
+    '''
+    try:
+        return subprocess.check_output(["git","rev-parse","--short","HEAD"],cwd=repo_path,stderr=subprocess.DEVNULL).decode().strip()
+    except:
+        return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the import time of growControl")
+    parser.add_argument("--runs",type=int,default=10,help="fresh processes to import in for each statement")
+    parser.add_argument("--max-ms",type=float,default=None,help="fail if 'import growControl' takes longer than this or anything prints")
+    parser.add_argument("--output",default=None,help="json file to save the results to")
+    args = parser.parse_args()
+
+    _,startup_modules,_ = time_import("pass")
+    results = {}
+    for statement in statements:
+        results[statement] = bench_import(statement,args.runs,startup_modules)
+        stats = results[statement]
+        print("{}".format(statement))
+        print("    median {:.1f} ms (min {:.1f}, max {:.1f}), {} modules loaded".format(stats["median_ms"],stats["min_ms"],stats["max_ms"],stats["modules_loaded"]))
+        for name,ms in stats["heaviest_ms"].items():
+            print("        {:<40} {:>8.1f} ms".format(name,ms))
+        if len(stats["printed"]) > 0:
+            print("    printed: {!r}".format(stats["printed"][:200]))
+
+    commit = git_commit()
+    metadata = {"commit":commit,
+                "time":datetime.datetime.now().astimezone().isoformat(),
+                "python":platform.python_version(),
+                "platform":platform.platform(),
+                "machine":platform.machine(),
+                "runs":args.runs}
+    output_file = args.output
+    if output_file is None:
+        results_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),"results")
+        os.makedirs(results_path,exist_ok=True)
+        output_file = os.path.join(results_path,"bench_import_{}_{}.json".format(commit,datetime.datetime.now().strftime("%Y%m%dT%H%M%S")))
+    with open(output_file,'w') as fp:
+        json.dump({"metadata":metadata,"results":results},fp,indent=2)
+    print("Saved results to {}".format(output_file))
+
+    if args.max_ms is not None:
+        failed = results[statements[0]]["median_ms"] > args.max_ms
+        failed = failed or any(len(stats["printed"]) > 0 for stats in results.values())
+        if failed:
+            print("FAILED: import growControl took {:.1f} ms (limit {:.1f} ms) or an import printed output".format(results[statements[0]]["median_ms"],args.max_ms))
+            sys.exit(1)
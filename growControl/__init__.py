@@ -1,6 +1,37 @@
-from .sensor_ph import Sensor_ph
-from .controllable_pump import Controllable_Pump
-from .control_ph_pump import Controller_ph_Pump
-from .control_volume_pump import Controller_Volume_Pump
-from .sensor_humidity_temp import Sensor_humidity_temp
-from .sensor_volume import Sensor_volume
\ No newline at end of file
+'''
+The classes are imported from their modules the first time they are used, so importing growControl is
+    quick and does not touch the hardware libraries, see hardware.py
+'''
+import importlib
+
+_exports = {"Sensor_ph":".sensor_ph",
+            "Controllable_Pump":".controllable_pump",
+            "Controller_ph_Pump":".control_ph_pump",
+            "Controller_Volume_Pump":".control_volume_pump",
+            "Sensor_humidity_temp":".sensor_humidity_temp",
+            "Sensor_volume":".sensor_volume",
+            "Output_Writer":".output_writer",
+            "Output_Rotation":".output_rotation",
+            "Scheduler":".scheduler",
+            "Fake_GPIO":".fake_gpio",
+            "Data_Store":".data_access",
+            "Csv_Input":".csv_input",
+            "Real_Clock":".clock",
+            "Virtual_Clock":".clock",
+            "Latency_Histogram":".latency",
+            "ADS1115_Bus_Manager":".ads1115_bus",
+            "Fake_ADS1115":".ads1115_bus",
+            "Calibration_Store":".calibration_store",
+            "Ema_Filter":".ema_filter"}
+
+__all__ = list(_exports.keys())
+
+def __getattr__(name):
+    if name not in _exports:
+        raise AttributeError("module {} has no attribute {}".format(__name__,name))
+    value = getattr(importlib.import_module(_exports[name],__name__),name)
+    globals()[name] = value # later lookups do not come back here
+    return value
+
+def __dir__():
+    return sorted(list(globals().keys()) + __all__)
@@ -0,0 +1,242 @@
+import itertools
+import sys
+import threading
+
+from .clock import get_default_clock
+from . import hardware
+
+class ADS1115_Channel:
+    '''
+    One single ended input of an ADS1115 registered with an ADS1115_Bus_Manager
+    '''
+    def __init__(self,manager,address,pin,gain,data_rate):
+        '''
+        manager: the ADS1115_Bus_Manager the channel is read through
+        address: int, I2C address of the chip, 0x48 to 0x4B
+        pin: int 0-3, the single ended input
+        gain: gain of the conversions, see ADS1115_Bus_Manager.register()
+        data_rate: int, samples/sec of the conversions
+        '''
+        self.manager = manager
+        self.address = address
+        self.pin = pin
+        self.gain = gain
+        self.data_rate = data_rate
+        self.voltage = None # result of the last conversion, None if it failed
+        self.converted = None # clock.monotonic() time of the last conversion
+
+    def read(self,max_age=None):
+        '''
+        Return the voltage of the channel, see ADS1115_Bus_Manager.read()
+        '''
+        return self.manager.read(self,max_age=max_age)
+
+class ADS1115_Bus_Manager:
+    '''
+    Shares one I2C bus between every ADS1115 input that is read on it
+
+    The bus and each chip are opened once, however many sensors use them. All of the registered channels,
+        up to 4 per chip and 4 chips per bus, are converted in one pass with single shot conversions, taking
+        the chips in turn so consecutive conversions are on different chips. When a sensor reads a channel
+        whose last conversion is older than scan_max_age a pass is made, so the other sensors that are due
+        in the same tick get their value from that pass instead of waiting for their own conversions.
+        A conversion takes 1/data_rate seconds, so a pass over 4 channels at 8 samples/sec takes half a second.
+    '''
+
+    def __init__(self,bus=1,backend=None,scan_max_age=0.1,clock=None,verbose=False):
+        '''
+        bus: int, number of the I2C bus, used to open it and by get_bus_manager()
+        backend: None or instance of Fake_ADS1115. If None the chips are read with the adafruit_ads1x15 library
+        scan_max_age: float >= 0, seconds a converted value is used before a read starts a new pass
+        clock: None or instance of Real_Clock or Virtual_Clock used for the age of the values. If None the default Real_Clock is used
+        verbose: Boolean, Output failed conversions
+        '''
+        self.bus = bus
+        self.backend = backend if backend is not None else Adafruit_ADS1115_Backend(bus)
+        self.scan_max_age = scan_max_age
+        self.clock = clock if clock is not None else get_default_clock()
+        self.verbose = verbose
+
+        self.channels = [] # every registered ADS1115_Channel, in the order they are converted in a pass
+        self.chips = {} # address -> chip opened on the backend
+        self.passes = 0 # number of passes over all of the channels
+        self.conversions = 0 # number of conversions, including the ones outside of a pass
+        self._lock = threading.RLock() # one conversion on the bus at a time
+
+    def register(self,address=0x48,pin=0,gain=8,data_rate=8):
+        '''
+        Add a single ended input to the passes, registering the same input again returns the same channel
+        address: int, I2C address of the chip, 0x48 (ADDR to GND) to 0x4B
+        pin: int 0-3, the single ended input
+        gain: Gain of the conversions and voltage range:
+            2/3: 6.144V
+              1: 4.096V
+              2: 2.048V
+              4: 1.024V
+              8: 0.512V
+             16: 0.256V
+        data_rate: int, samples/sec of the conversions: 8,16,32,64,128,250,475,860
+        Returns the ADS1115_Channel
+        '''
+        if pin not in (0,1,2,3):
+            raise ValueError("Invalid pin {}. Expected 0, 1, 2 or 3".format(pin))
+        with self._lock:
+            for channel in self.channels:
+                if (channel.address,channel.pin) == (address,pin):
+                    if (channel.gain,channel.data_rate) != (gain,data_rate):
+                        raise ValueError("ADS1115 0x{:02x} pin {} is already registered with gain {} and data rate {}".format(address,pin,channel.gain,channel.data_rate))
+                    return channel
+            if address not in self.chips:
+                self.chips[address] = self.backend.open_chip(address)
+            channel = ADS1115_Channel(self,address,pin,gain,data_rate)
+            self.channels.append(channel)
+            self.channels = self._pass_order(self.channels)
+        return channel
+
+    def read(self,channel,max_age=None):
+        '''
+        Return the voltage of channel, None if the conversion failed
+        max_age: None or float >= 0, seconds. The last value is returned if it is younger than this, else a pass
+                    is made over all of the channels. If 0 only this channel is converted, ie for a burst of samples
+                    If None scan_max_age is used
+        '''
+        if max_age is None:
+            max_age = self.scan_max_age
+        with self._lock:
+            if max_age <= 0.:
+                self._convert(channel)
+            elif channel.converted is None or self.clock.monotonic() - channel.converted > max_age:
+                self.scan()
+            return channel.voltage
+
+    def scan(self):
+        '''
+        Convert every registered channel once
+        '''
+        with self._lock:
+            for channel in self.channels:
+                self._convert(channel)
+            finished = self.clock.monotonic()
+            for channel in self.channels: # the values are as of the end of the pass, so it is not repeated right away
+                channel.converted = finished
+            self.passes += 1
+
+    def _convert(self,channel):
+        '''
+        Read channel with a single shot conversion
+        '''
+        try:
+            channel.voltage = self.chips[channel.address].read(channel.pin,channel.gain,channel.data_rate)
+        except:
+            e = sys.exc_info()
+            if self.verbose:
+                print("Exception thrown while reading ADS1115 0x{:02x} pin {}:".format(channel.address,channel.pin))
+                print("{}: {}".format(e[0],e[1]))
+            channel.voltage = None
+        channel.converted = self.clock.monotonic()
+        self.conversions += 1
+
+    @staticmethod
+    def _pass_order(channels):
+        '''
+        Order the channels so the chips take turns: the first input of each chip, then the second of each, ...
+        '''
+        by_address = {}
+        for channel in sorted(channels,key=lambda channel: (channel.address,channel.pin)):
+            by_address.setdefault(channel.address,[]).append(channel)
+        ordered = []
+        for group in itertools.zip_longest(*by_address.values()):
+            ordered.extend(channel for channel in group if channel is not None)
+        return ordered
+
+class Adafruit_ADS1115_Backend:
+    '''
+    Opens the I2C bus and the ADS1115 chips with the adafruit_ads1x15 library
+    '''
+    def __init__(self,bus=1):
+        '''
+        bus: int, number of the I2C bus. Bus 1 is the one on the SCL and SDA pins, others need the adafruit_extended_bus package
+        '''
+        self.hardware = hardware.ads1115("ADS1115_Bus_Manager")
+        if bus == 1:
+            self.i2c = self.hardware.busio.I2C(self.hardware.board.SCL,self.hardware.board.SDA)
+        else:
+            from adafruit_extended_bus import ExtendedI2C
+            self.i2c = ExtendedI2C(bus)
+
+    def open_chip(self,address):
+        return Adafruit_ADS1115_Chip(self.hardware,self.i2c,address)
+
+class Adafruit_ADS1115_Chip:
+    '''
+    One ADS1115 read with single shot conversions, so each read can be on a different input
+    '''
+    def __init__(self,hardware,i2c,address):
+        self.hardware = hardware
+        self.ads1115 = hardware.ADS.ADS1115(i2c,address=address)
+        self.ads1115.mode = hardware.Mode.SINGLE
+        self.inputs = {} # pin -> AnalogIn
+
+    def read(self,pin,gain,data_rate):
+        self.ads1115.gain = gain
+        self.ads1115.data_rate = data_rate
+        if pin not in self.inputs:
+            self.inputs[pin] = self.hardware.AnalogIn(self.ads1115,pin)
+        return self.inputs[pin].voltage
+
+class Fake_ADS1115:
+    '''
+    Stand in for the ADS1115 chips on a bus so the sensors can be tested off of the raspberry pi
+
+    Pass as the backend of an ADS1115_Bus_Manager. The voltage of each input is set with set_voltage(),
+        inputs that have not been set read 0.0 volts. Opening a chip at an address that is not in
+        addresses raises OSError, like a chip that does not answer on the bus. Every conversion is
+        recorded in conversions as (address,pin)
+    '''
+    def __init__(self,addresses=(0x48,)):
+        '''
+        addresses: list of int, I2C addresses of the chips on the fake bus
+        '''
+        self.addresses = list(addresses)
+        self.voltages = {} # (address,pin) -> float or function() returning the voltage
+        self.conversions = []
+        self.opened = [] # addresses opened, in order
+
+    def set_voltage(self,address,pin,voltage):
+        '''
+        voltage: float, None to fail the conversions, or function() returning either that is called for each conversion
+        '''
+        self.voltages[(address,pin)] = voltage
+
+    def open_chip(self,address):
+        if address not in self.addresses:
+            raise OSError("[Errno 121] Remote I/O error, no ADS1115 at 0x{:02x}".format(address))
+        self.opened.append(address)
+        return Fake_ADS1115_Chip(self,address)
+
+class Fake_ADS1115_Chip:
+    '''
+    A chip of a Fake_ADS1115
+    '''
+    def __init__(self,fake,address):
+        self.fake = fake
+        self.address = address
+
+    def read(self,pin,gain,data_rate):
+        self.fake.conversions.append((self.address,pin))
+        voltage = self.fake.voltages.get((self.address,pin),0.)
+        if callable(voltage):
+            voltage = voltage()
+        if voltage is None:
+            raise OSError("[Errno 121] Remote I/O error reading 0x{:02x} pin {}".format(self.address,pin))
+        return voltage
+
+_bus_managers = {}
+
+def get_bus_manager(bus=1):
+    '''
+    Return the ADS1115_Bus_Manager shared by every sensor on bus that is not given one
+    '''
+    if bus not in _bus_managers:
+        _bus_managers[bus] = ADS1115_Bus_Manager(bus=bus)
+    return _bus_managers[bus]
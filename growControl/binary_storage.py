@@ -0,0 +1,110 @@
+'''
+Compact binary storage for the sensor and controller history
+
+A file is a header followed by fixed width records
+    header: 8 byte magic b"GCBIN001", little endian uint32 length of the json that follows,
+            json {"columns": [...], "dtype": "<f8"}, padded with spaces so the records start on an 8 byte boundary
+    records: one little endian float64 per column, the first column is the epoch of the reading.
+            Missing values (None) are stored as NaN
+A month of 10 second pH readings is ~260k records, which load_binary() maps into a NumPy array without parsing anything
+'''
+import argparse
+import datetime
+import json
+import math
+import os
+import struct
+
+MAGIC = b"GCBIN001"
+
+def binary_header(columns):
+    '''
+    Return the header for a binary file with the given column names
+    columns: list of str, the first should be "time"
+    '''
+    header = json.dumps({"columns":list(columns),"dtype":"<f8"}).encode("utf-8")
+    length = len(MAGIC) + 4 + len(header)
+    header += b" " * (-length % 8)
+    return MAGIC + struct.pack("<I",len(header)) + header
+
+def encode_record(epoch,values):
+    '''
+    Return the bytes of one record
+    epoch: float, time of the reading
+    values: list of floats or None, None is stored as NaN
+    '''
+    values = [math.nan if value is None else float(value) for value in values]
+    return struct.pack("<{}d".format(len(values)+1),epoch,*values)
+
+def read_header(path):
+    '''
+    Read the header of a binary file
+    Returns (columns,offset) where offset is the byte position of the first record
+    '''
+    with open(path,'rb') as fp:
+        magic = fp.read(len(MAGIC))
+        if magic != MAGIC:
+            raise ValueError("{} is not a growControl binary file".format(path))
+        length, = struct.unpack("<I",fp.read(4))
+        header = json.loads(fp.read(length).decode("utf-8"))
+    return header["columns"],len(MAGIC) + 4 + length
+
+def repair_binary(path):
+    '''
+    Remove a partially written record from the end of the binary file at path, ie from a power failure
+    Records appended after a partial one would be shifted and read as garbage, so this is done before a file is appended to
+    Returns the number of bytes removed, 0 if the file does not exist or ends on a whole record
+    '''
+    if not os.path.isfile(path):
+        return 0
+    columns,offset = read_header(path)
+    size = os.path.getsize(path)
+    torn = (size - offset) % (8 * len(columns)) if size > offset else 0
+    if torn > 0:
+        with open(path,'r+b') as fp:
+            fp.truncate(size - torn)
+    return torn
+
+def load_binary(path,mmap=True):
+    '''
+    Load a binary file as a NumPy structured array with one field per column
+    path: path to the file
+    mmap: Boolean, memory map the file instead of reading it. Only the pages that are used are read from disk
+    A partially written record at the end of the file (ie from a power failure) is ignored
+    '''
+    import numpy as np
+    columns,offset = read_header(path)
+    dtype = np.dtype([(column,"<f8") for column in columns])
+    n_records = (os.path.getsize(path) - offset) // dtype.itemsize
+    if n_records == 0:
+        return np.zeros(0,dtype=dtype)
+    if mmap:
+        return np.memmap(path,dtype=dtype,mode='r',offset=offset,shape=(n_records,))
+    with open(path,'rb') as fp:
+        fp.seek(offset)
+        return np.fromfile(fp,dtype=dtype,count=n_records)
+
+def export_csv(path,csv_path):
+    '''
+    Write the binary file at path to csv_path in the same format the csv storage uses
+    Returns the number of records written
+    '''
+    data = load_binary(path)
+    columns = list(data.dtype.names)
+    with open(csv_path,'w') as fp:
+        fp.write(",".join([columns[0],"datetime_timezone"] + columns[1:]) + "\n")
+        for record in data:
+            epoch = float(record[0])
+            values = ["None" if math.isnan(value) else str(float(value)) for value in record.tolist()[1:]]
+            fp.write(",".join([str(epoch),str(datetime.datetime.fromtimestamp(epoch).astimezone())] + values) + "\n")
+    return len(data)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export growControl binary history files to csv")
+    parser.add_argument("files",nargs="+",help="binary files to export, the csv is written next to each with a .csv extension")
+    args = parser.parse_args()
+
+    for path in args.files:
+        csv_path = os.path.splitext(path)[0] + ".csv"
+        n_records = export_csv(path,csv_path)
+        print("Exported {} records from {} to {}".format(n_records,path,csv_path))
@@ -0,0 +1,159 @@
+import bisect
+import datetime
+import json
+import os
+import re
+import threading
+
+class Calibration_Store:
+    '''
+    Keeps the calibrations of the sensors in their own directory with an index
+
+    The calibration json files are saved to <path>/calibrations/ and each is listed in
+        <path>/calibrations/index.json with the sensor class, the sensor (its output_file_base), the time it
+        was made and its coefficients. Finding the newest calibration, or the one that was in effect at a past
+        time, only reads the index, however many daily output files are in path.
+    The first time the index is needed and it does not exist, the calibration files saved in path by earlier
+        versions (<class>_calibration_raw_<isoformat>.json) are copied in to the store. Those are not tied to a
+        sensor, so they apply to every sensor of their class that has no calibration of its own.
+    '''
+    directory_name = "calibrations"
+    index_name = "index.json"
+
+    def __init__(self,path,verbose=False):
+        '''
+        path: str, the output directory of the sensors, the store is the calibrations directory in it
+        verbose: Boolean, Output when legacy calibration files are migrated
+        '''
+        self.path = path
+        self.directory = os.path.join(path,self.directory_name)
+        self.index_file = os.path.join(self.directory,self.index_name)
+        self.verbose = verbose
+        self._entries = None # list of index entries sorted by time, loaded on first use
+        self._lock = threading.Lock()
+
+    def save(self,sensor_class,sensor,data,epoch=None):
+        '''
+        Save a calibration and add it to the index
+        sensor_class: str, class name of the sensor, ie "Sensor_ph"
+        sensor: str, output_file_base of the sensor
+        data: dict of the calibration, must have the coefficients "m" and "b"
+        epoch: None or float, the time of the calibration. If None now
+        Returns the path of the saved file
+        '''
+        if epoch is None:
+            epoch = datetime.datetime.now().timestamp()
+        os.makedirs(self.directory,exist_ok=True)
+        filename = "{}_{}_calibration_raw_{}.json".format(sensor_class.lower(),sensor,datetime.datetime.fromtimestamp(epoch).isoformat())
+        with open(os.path.join(self.directory,filename),'w') as fp:
+            json.dump(data,fp,indent=2,default=float)
+
+        with self._lock:
+            self._entries = None # another sensor may have saved since the index was read
+            entries = self._load()
+            entry = {"sensor_class":sensor_class,
+                        "sensor":sensor,
+                        "time":epoch,
+                        "file":filename,
+                        "m":float(data["m"]) if data.get("m") is not None else None,
+                        "b":float(data["b"]) if data.get("b") is not None else None}
+            entries.insert(bisect.bisect_right([e["time"] for e in entries],epoch),entry)
+            self._write(entries)
+        return os.path.join(self.directory,filename)
+
+    def lookup(self,sensor_class,sensor=None,epoch=None):
+        '''
+        Return the index entry of the calibration in effect at epoch, None if there was none
+            The newest calibration of sensor_class made at or before epoch, for sensor or for the whole class
+            The entry is a dict with sensor_class, sensor, time, file, m, b, and path, the full path of the file
+        sensor: None or str, output_file_base of the sensor. If None any sensor of sensor_class
+        epoch: None or float. If None the newest calibration
+        '''
+        with self._lock:
+            entries = self._load()
+        for entry in reversed(entries):
+            if entry["sensor_class"] != sensor_class:
+                continue
+            if sensor is not None and entry["sensor"] not in (sensor,None):
+                continue
+            if epoch is not None and entry["time"] > epoch:
+                continue
+            entry = dict(entry)
+            entry["path"] = os.path.join(self.directory,entry["file"])
+            return entry
+        return None
+
+    def latest(self,sensor_class,sensor=None):
+        '''
+        Return the index entry of the newest calibration, see lookup()
+        '''
+        return self.lookup(sensor_class,sensor)
+
+    def history(self,sensor_class,sensor=None):
+        '''
+        Return the index entries of every calibration of sensor_class, oldest first, see lookup()
+        '''
+        with self._lock:
+            entries = self._load()
+        return [dict(entry) for entry in entries
+                    if entry["sensor_class"] == sensor_class and (sensor is None or entry["sensor"] in (sensor,None))]
+
+    def _load(self):
+        '''
+        Return the entries of the index, reading it or migrating the legacy files the first time
+        '''
+        if self._entries is None:
+            if os.path.exists(self.index_file):
+                with open(self.index_file,'r') as fp:
+                    self._entries = json.load(fp)["calibrations"]
+            else:
+                self._entries = self._migrate_legacy()
+        return self._entries
+
+    def _write(self,entries):
+        '''
+        Replace the index with entries, written to a temporary file first so a crash does not leave half an index
+        '''
+        os.makedirs(self.directory,exist_ok=True)
+        tmp_file = self.index_file + ".tmp"
+        with open(tmp_file,'w') as fp:
+            json.dump({"calibrations":entries},fp,indent=2)
+        os.replace(tmp_file,self.index_file)
+        self._entries = entries
+
+    def _migrate_legacy(self):
+        '''
+        Copy the calibration files saved directly in path in to the store and index them
+        This is the only time path is listed. Returns the entries, an empty list if there were none
+        '''
+        pattern = re.compile(r"^(sensor_[a-z_]+?)_calibration_raw_(.+)\.json$")
+        if not os.path.isdir(self.path):
+            return []
+        entries = []
+        for fname in os.listdir(self.path):
+            match = pattern.match(fname)
+            if match is None:
+                continue
+            source = os.path.join(self.path,fname)
+            try:
+                epoch = datetime.datetime.fromisoformat(match.group(2)).timestamp()
+            except ValueError:
+                epoch = os.path.getmtime(source)
+            with open(source,'r') as fp:
+                data = json.load(fp)
+            os.makedirs(self.directory,exist_ok=True)
+            with open(os.path.join(self.directory,fname),'w') as fp:
+                json.dump(data,fp,indent=2)
+            entries.append({"sensor_class":match.group(1).capitalize(),
+                            "sensor":None,
+                            "time":epoch,
+                            "file":fname,
+                            "m":data.get("m"),
+                            "b":data.get("b")})
+        if len(entries) == 0:
+            return []
+        entries.sort(key=lambda entry: entry["time"])
+        if self.verbose:
+            print("Calibration_Store: indexed {} calibration files from {}".format(len(entries),self.path))
+        self._write(entries)
+        return entries
@@ -0,0 +1,134 @@
+import heapq
+import itertools
+import threading
+import time
+
+class Real_Clock:
+    '''
+    The clock used by the sensors, controllers and pumps when they are not given one
+
+    time() is the wall clock used for timestamps and the read_every/control_every checks, monotonic() is
+        used for measuring intervals that must not jump when the system time is set.
+    '''
+
+    def time(self):
+        '''
+        Seconds since the epoch
+        '''
+        return time.time()
+
+    def monotonic(self):
+        '''
+        Seconds from an arbitrary start that never goes backwards
+        '''
+        return time.monotonic()
+
+    def sleep(self,seconds):
+        '''
+        Block for seconds
+        '''
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def call_later(self,delay,function):
+        '''
+        Call function with no arguments from a background thread after delay seconds
+        Returns a handle with a cancel() method
+        '''
+        timer = threading.Timer(delay,function)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+class Virtual_Timer:
+    '''
+    Handle returned by Virtual_Clock.call_later()
+    '''
+    def __init__(self,due,function):
+        self.due = due
+        self.function = function
+        self.cancelled = False
+
+    def cancel(self):
+        '''
+        Stop the function from being called. Safe to call after it has been called
+        '''
+        self.cancelled = True
+
+class Virtual_Clock:
+    '''
+    A clock that only moves when it is told to, so tests run in milliseconds and give the same result every time
+
+    time() and monotonic() both return the virtual time. sleep() and advance() move the time forward and
+        call the functions given to call_later() that come due, in order, with the time set to when each was due.
+    '''
+
+    def __init__(self,start=None):
+        '''
+        start: None or float, the epoch to start at. If None the current wall time is used
+        '''
+        self._now = time.time() if start is None else float(start)
+        self._lock = threading.RLock()
+        self._timers = [] # heap of (due, sequence, Virtual_Timer)
+        self._sequence = itertools.count() # keeps timers due at the same time in the order they were added
+
+    def time(self):
+        '''
+        The current virtual time
+        '''
+        return self._now
+
+    def monotonic(self):
+        '''
+        The current virtual time
+        '''
+        return self._now
+
+    def sleep(self,seconds):
+        '''
+        Advance the virtual time by seconds, returns immediately
+        '''
+        self.advance(seconds)
+
+    def call_later(self,delay,function):
+        '''
+        Call function with no arguments once the virtual time has been advanced by delay seconds
+        Returns a Virtual_Timer that can be cancelled
+        '''
+        with self._lock:
+            timer = Virtual_Timer(self._now + max(delay,0.),function)
+            heapq.heappush(self._timers,(timer.due,next(self._sequence),timer))
+        return timer
+
+    def advance(self,seconds):
+        '''
+        Move the virtual time forward by seconds, calling every timer that comes due
+        '''
+        if seconds < 0:
+            raise ValueError("Virtual_Clock: can not go back in time, got {} seconds".format(seconds))
+        self.advance_to(self._now + seconds)
+
+    def advance_to(self,epoch):
+        '''
+        Move the virtual time forward to epoch, calling every timer that comes due
+        '''
+        while True:
+            with self._lock:
+                if len(self._timers) == 0 or self._timers[0][0] > epoch:
+                    self._now = max(self._now,epoch)
+                    return
+                due,_,timer = heapq.heappop(self._timers)
+                self._now = max(self._now,due)
+            if not timer.cancelled:
+                timer.function()
+
+_default_clock = None
+
+def get_default_clock():
+    '''
+    Return the Real_Clock shared by everything that is not given a clock
+    '''
+    global _default_clock
+    if _default_clock is None:
+        _default_clock = Real_Clock()
+    return _default_clock
@@ -3,10 +3,15 @@ import time
 import datetime
 import os
 
+from .output_writer import append_to_file, format_output_row, output_file_header, STORAGE_EXTENSIONS
+from .output_rotation import get_default_output_rotation
+from .clock import get_default_clock
+
 class Controller_ph_Pump:
     ''' 
     Uses to pumps to control the ph of a system
     '''
+    output_header = "time,datetime_timezone,ph_down_time,ph_down_volume,ph_up_time,ph_up_volume\n"
 
     def __init__(self,
                 sensor_ph,
@@ -20,6 +25,10 @@ class Controller_ph_Pump:
                 ph_max=6.2,
                 control_every=30*60,
                 warmup_time=10*60,
+                storage="csv",
+                output_writer=None,
+                output_rotation=None,
+                clock=None,
                 verbose=False):
         '''
         Turns on ph up and down pumps based on the current ph of sensor_ph
@@ -38,6 +47,10 @@ class Controller_ph_Pump:
         control_every: Float: Minimum number of seconds must pass between each control action
         warmup_time: Float: Minimum number of seconds after the controller is instantiated before a control action can happen
             This is to prevent false starts
+        storage: str, format of the output files. "csv" for text files, "binary" for fixed width float64 records, see binary_storage
+        output_writer: None or instance of Output_Writer. If given the output rows are queued on it instead of written immediately
+        output_rotation: None or instance of Output_Rotation that manages the daily output files. If None the default shared one is used
+        clock: None or instance of Real_Clock or Virtual_Clock used for the control_every and warmup_time checks and timestamps. If None the default Real_Clock is used
         '''
 
         self.sensor_ph = sensor_ph
@@ -47,9 +60,16 @@ class Controller_ph_Pump:
         self.ml_per_s = ml_per_s
         self.dispense_volume = dispense_volume
         
+        self.clock = clock if clock is not None else get_default_clock()
         self.output_file_path = output_file_path
         self.output_file_base = output_file_base
         os.makedirs(os.path.dirname(self.output_file_path),exist_ok=True)
+        self.output_rotation = output_rotation if output_rotation is not None else get_default_output_rotation()
+        self.storage = storage
+        self._output_file_key = self.output_rotation.register(self.output_file_path,
+                                                                self.output_file_base,
+                                                                output_file_header(self.output_header,self.storage),
+                                                                extension=STORAGE_EXTENSIONS[self.storage])
         self.update_output_file_path()     
 
 
@@ -58,6 +78,7 @@ class Controller_ph_Pump:
         self.control_every = control_every
         self.warmup_time = warmup_time
         self.verbose = verbose
+        self.output_writer = output_writer
 
         self.dispense_time = self.dispense_volume / self.ml_per_s
 
@@ -66,33 +87,41 @@ class Controller_ph_Pump:
         #   before it starts to control
         # last_loop is the last time the controller checked for an action
         # last_action is the last time the controller took an action
-        self.last_loop_time = time.time() + self.warmup_time - self.control_every
+        self.last_loop_time = self.clock.time() + self.warmup_time - self.control_every
         self.last_action_time = self.last_loop_time 
         self.last_action = "None"
 
     def update_output_file_path(self):
         '''
-        Updates the property self.output_file
-        Checks to see if the file <self.output_file_path> + <self.output_file_base> + <date in YYYY-MM-DD format> .csv
-            If it does:
-                do nothing
-            If it does not exist:
-                create it and initialize the header
+        Updates the property self.output_file to the file for the current day
+            <self.output_file_path> + <self.output_file_base> + <date in YYYY-MM-DD format> .csv
+        The file is created and the header written by self.output_rotation when the day changes
         '''
+        self.output_file = self.output_rotation.get_output_file(self._output_file_key)
 
-        date = datetime.date.today().isoformat()
-        self.output_file = os.path.join(self.output_file_path,"{}_{}.csv".format(self.output_file_base,date))
-        if not os.path.isfile(self.output_file):
-            with open(self.output_file,'a') as fp:
-                fp.write("time,datetime_timezone,ph_down_time,ph_down_volume,ph_up_time,ph_up_volume\n")        
+    def _dispense(self,pump,t):
+        '''
+        Start a dispense of dispense_time on pump, it returns immediately and the sensors keep reading while the pump runs
+        pump: Instance of Controllable_Pump
+        t: str, the time for the verbose output
+        Returns True if the dispense was started, False if the pump is still running an earlier dispense
+            The controller and its pumps are called from the one scheduler thread, so the pump can not be started in between
+        '''
+        if pump.is_running():
+            if self.verbose:
+                print("{}: pump is still running, {:.2f}s remaining. Skipping the dispense".format(t,pump.time_remaining()))
+            return False
+        pump.dispense(self.dispense_time)
+        return True
 
     def __call__(self):
         '''
         Execute a control command based on the current sensor_ph value, and time since last control
+        Returns True if the control was checked, False if it was not due yet
         ''' 
-        current_time = time.time()
+        current_time = self.clock.time()
         if current_time - self.control_every < self.last_loop_time:
-            return 
+            return False
 
         self.update_output_file_path() # Starts a new output file every day
         
@@ -105,31 +134,34 @@ class Controller_ph_Pump:
         ph_down_dispensed_volume = 0.
         ph_down_dispensed_time = 0.
 
-        t = datetime.datetime.strftime(datetime.datetime.now(),"%m/%d %H:%M:%S")
-        if self.sensor_ph.ph_avg > self.ph_max:
+        t = datetime.datetime.strftime(datetime.datetime.fromtimestamp(self.clock.time()),"%m/%d %H:%M:%S")
+        if self.sensor_ph.ph_avg is None: # the sensor has not read yet
+            pass
+        elif self.sensor_ph.ph_avg > self.ph_max:
             if self.verbose:
                 print("{}: ph low {:.1f}s since last control".format(t,current_time-self.last_loop_time))
-            self.pump_down(self.dispense_time)
-            self.last_action_time = current_time
-            self.last_action = "Adjust ph Down"
-            ph_down_dispensed_volume = self.dispense_volume
-            ph_down_dispensed_time = self.dispense_time
+            if self._dispense(self.pump_down,t):
+                self.last_action_time = current_time
+                self.last_action = "Adjust ph Down"
+                ph_down_dispensed_volume = self.dispense_volume
+                ph_down_dispensed_time = self.dispense_time
         elif self.sensor_ph.ph_avg < self.ph_min:
             if self.verbose:
                 print("{}: ph high {:.1f}s since last control".format(t,current_time-self.last_loop_time))
-            self.pump_up(self.dispense_time)
-            self.last_action_time = current_time
-            self.last_action = "Adjust ph Up"
-            ph_up_dispensed_volume = self.dispense_volume
-            ph_up_dispensed_time = self.dispense_time
+            if self._dispense(self.pump_up,t):
+                self.last_action_time = current_time
+                self.last_action = "Adjust ph Up"
+                ph_up_dispensed_volume = self.dispense_volume
+                ph_up_dispensed_time = self.dispense_time
         
         if (ph_up_dispensed_time != 0.) or (ph_down_dispensed_time != 0):
             # Only record when an action was taken
             #fp.write("time,datetime,datetime_timezone, ph_down_time,ph_down_volume, ph_up_time,ph_up_volume\n")        
-            output = "{},{},".format(current_time,datetime.datetime.now().astimezone())
-            output += "{},{},{},{}\n".format(ph_down_dispensed_time,ph_down_dispensed_volume,ph_up_dispensed_time,ph_up_dispensed_volume)
-            with open(self.output_file,'a') as fp:
-                fp.write(output)
+            output = format_output_row(current_time,
+                                        [ph_down_dispensed_time,ph_down_dispensed_volume,ph_up_dispensed_time,ph_up_dispensed_volume],
+                                        self.storage)
+            append_to_file(self.output_file,output,self.output_writer)
+        return True
 
 if __name__ == "__main__":
     from growControl import Controller_ph_Pump, Sensor_ph, Controllable_Pump
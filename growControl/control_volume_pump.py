@@ -3,10 +3,15 @@ import time
 import datetime
 import os
 
+from .output_writer import append_to_file, format_output_row, output_file_header, STORAGE_EXTENSIONS
+from .output_rotation import get_default_output_rotation
+from .clock import get_default_clock
+
 class Controller_Volume_Pump:
     ''' 
     Uses to pumps to control the volume of a system
     '''
+    output_header = "time,datetime_timezone, dispensed_time,dispensed_volume\n"
 
     def __init__(self,
                 sensor_volume,
@@ -18,6 +23,10 @@ class Controller_Volume_Pump:
                 volume_min=7.0, # gallons
                 control_every=30*60,
                 warmup_time=10*60,
+                storage="csv",
+                output_writer=None,
+                output_rotation=None,
+                clock=None,
                 verbose=False):
         '''
         Turns on a water pump to add water to the tank based on the readings of a sensor_volume
@@ -34,6 +43,10 @@ class Controller_Volume_Pump:
         control_every: Float: Minimum number of seconds must pass between each control action
         warmup_time: Float: Minimum number of seconds after the controller is instantiated before a control action can happen
             This is to prevent false starts
+        storage: str, format of the output files. "csv" for text files, "binary" for fixed width float64 records, see binary_storage
+        output_writer: None or instance of Output_Writer. If given the output rows are queued on it instead of written immediately
+        output_rotation: None or instance of Output_Rotation that manages the daily output files. If None the default shared one is used
+        clock: None or instance of Real_Clock or Virtual_Clock used for the control_every and warmup_time checks and timestamps. If None the default Real_Clock is used
         '''
 
         self.sensor_volume = sensor_volume
@@ -42,9 +55,16 @@ class Controller_Volume_Pump:
         self.ml_per_s = ml_per_s
         self.dispense_volume = dispense_volume
         
+        self.clock = clock if clock is not None else get_default_clock()
         self.output_file_path = output_file_path
         self.output_file_base = output_file_base
         os.makedirs(os.path.dirname(self.output_file_path),exist_ok=True)
+        self.output_rotation = output_rotation if output_rotation is not None else get_default_output_rotation()
+        self.storage = storage
+        self._output_file_key = self.output_rotation.register(self.output_file_path,
+                                                                self.output_file_base,
+                                                                output_file_header(self.output_header,self.storage),
+                                                                extension=STORAGE_EXTENSIONS[self.storage])
         self.update_output_file_path()     
 
 
@@ -52,6 +72,7 @@ class Controller_Volume_Pump:
         self.control_every = control_every
         self.warmup_time = warmup_time
         self.verbose = verbose
+        self.output_writer = output_writer
 
         self.dispense_time = self.dispense_volume / self.ml_per_s
 
@@ -60,33 +81,26 @@ class Controller_Volume_Pump:
         #   before it starts to control
         # last_loop is the last time the controller checked for an action
         # last_action is the last time the controller took an action
-        self.last_loop_time = time.time() + self.warmup_time - self.control_every
+        self.last_loop_time = self.clock.time() + self.warmup_time - self.control_every
         self.last_action_time = self.last_loop_time 
         self.last_action = "None"
 
     def update_output_file_path(self):
         '''
-        Updates the property self.output_file
-        Checks to see if the file <self.output_file_path> + <self.output_file_base> + <date in YYYY-MM-DD format> .csv
-            If it does:
-                do nothing
-            If it does not exist:
-                create it and initialize the header
+        Updates the property self.output_file to the file for the current day
+            <self.output_file_path> + <self.output_file_base> + <date in YYYY-MM-DD format> .csv
+        The file is created and the header written by self.output_rotation when the day changes
         '''
-
-        date = datetime.date.today().isoformat()
-        self.output_file = os.path.join(self.output_file_path,"{}_{}.csv".format(self.output_file_base,date))
-        if not os.path.isfile(self.output_file):
-            with open(self.output_file,'a') as fp:
-                fp.write("time,datetime_timezone, dispensed_time,dispensed_volume\n")    
+        self.output_file = self.output_rotation.get_output_file(self._output_file_key)
 
     def __call__(self):
         '''
         Execute a control command based on the current sensor_volume value, and time since last control
+        Returns True if the control was checked, False if it was not due yet
         ''' 
-        current_time = time.time()
+        current_time = self.clock.time()
         if current_time - self.control_every < self.last_loop_time:
-            return 
+            return False
 
         self.update_output_file_path() # Starts a new output file every day
         
@@ -97,21 +111,24 @@ class Controller_Volume_Pump:
         dispensed_volume = 0.
         dispensed_time = 0.
 
-        t = datetime.datetime.strftime(datetime.datetime.now(),"%m/%d %H:%M:%S")
-        if self.sensor_volume.volume_avg < self.volume_min:
+        t = datetime.datetime.strftime(datetime.datetime.fromtimestamp(self.clock.time()),"%m/%d %H:%M:%S")
+        if self.sensor_volume.volume_avg is not None and self.sensor_volume.volume_avg < self.volume_min:
             if self.verbose:
                 print("{}: Volume low {:.1f}s since last control".format(t,current_time-self.last_loop_time))
-            self.pump(self.dispense_time)
-            self.last_action_time = current_time
-            self.last_action = "Add Water"
-            dispensed_volume = self.dispense_volume
-            dispensed_time = self.dispense_time
-
-            #fp.write("time,datetime,datetime_timezone, dispensed_time,dispensed_volume\n")        
-            output = "{},{},".format(current_time,datetime.datetime.now().astimezone())
-            output += "{},{}\n".format(dispensed_time,dispensed_volume)
-            with open(self.output_file,'a') as fp:
-                fp.write(output)
+            if self.pump.is_running(): # the controller and pump are called from the one scheduler thread
+                if self.verbose:
+                    print("{}: pump is still running, {:.2f}s remaining. Skipping the dispense".format(t,self.pump.time_remaining()))
+            else:
+                self.pump.dispense(self.dispense_time) # returns immediately, sensors keep reading while the pump runs
+                self.last_action_time = current_time
+                self.last_action = "Add Water"
+                dispensed_volume = self.dispense_volume
+                dispensed_time = self.dispense_time
+
+                #fp.write("time,datetime,datetime_timezone, dispensed_time,dispensed_volume\n")        
+                output = format_output_row(current_time,[dispensed_time,dispensed_volume],self.storage)
+                append_to_file(self.output_file,output,self.output_writer)
+        return True
 
 if __name__ == "__main__":
     from growControl import Controller_Volume_Pump
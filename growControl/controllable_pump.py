@@ -1,22 +1,39 @@
 import os
 import time
 import datetime
-try:
-    import RPi.GPIO as GPIO
-except:
-    print("Controllable_Pump: Unable to import raspberry pi specific modules" +\
-             "\tWill only be able to run with 'gpio_pin=None'")
+import threading
+import atexit
+import weakref
+
+from .clock import get_default_clock
+from . import hardware
+
+# Pumps that are turned off at exit, held weakly so a pump that is no longer used can be freed
+_pumps = weakref.WeakSet()
+
+def _stop_pumps():
+    '''
+    Never leave a pump running when the program exits
+    '''
+    for pump in list(_pumps):
+        pump.stop()
+
+atexit.register(_stop_pumps)
 
 class Controllable_Pump:
     '''
     Defines a peristaltic pump and the control of it
     '''
 
-    def __init__(self,gpio_pin,verbose=False):
+    def __init__(self,gpio_pin,clock=None,verbose=False):
         '''
         Initialize a pump for control
+        gpio_pin: None or int, the pin the relay of the pump is on. If None the pump is mocked
+        clock: None or instance of Real_Clock or Virtual_Clock used to time the dispenses. If None the default Real_Clock is used
+        verbose: Boolean, Output when the pump is turned on and off
         '''
         self.verbose = verbose
+        self.clock = clock if clock is not None else get_default_clock()
         self.gpio_pin = gpio_pin
 
         # The logic is a little weird. Setting the pin to high
@@ -31,6 +48,14 @@ class Controllable_Pump:
             self._initialize_gpio()        
         else:
             self._initialize_gpio_mock()
+
+        # State of a dispense started with dispense()
+        self._lock = threading.Lock()
+        self._timer = None # timer from self.clock.call_later() that turns the pump off
+        self._future = None # Future of the running dispense
+        self._on_time = None # self.clock.monotonic() when the pump was turned on
+        self._off_time = None # self.clock.monotonic() when the pump is scheduled to turn off
+        _pumps.add(self) # turned off at exit
         
     def _initialize_gpio(self):
         '''
@@ -40,30 +65,32 @@ class Controllable_Pump:
         self._pump_on = self._pump_on_real
         self._pump_off = self._pump_off_real
         
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(self.gpio_pin, GPIO.OUT)
-        GPIO.output(self.gpio_pin,self._turn_pump_off_gpio_value)
+        self.gpio = hardware.gpio("Controllable_Pump")
+        self.gpio.setmode(self.gpio.BCM)
+        self.gpio.setup(self.gpio_pin, self.gpio.OUT)
+        self.gpio.output(self.gpio_pin,self._turn_pump_off_gpio_value)
 
     def cleanup(self):
         '''
         Reset the GPIO
         '''
+        self.stop()
         if self.verbose:
             print("Cleaning up gpio pin {}".format(self.gpio_pin))
         if self.gpio_pin is not None:
-            GPIO.cleanup(self.gpio_pin)
+            self.gpio.cleanup(self.gpio_pin)
 
     def _pump_on_real(self):
         '''
         Turn the pump on using the real GPIO
         '''
-        GPIO.output(self.gpio_pin,self._turn_pump_on_gpio_value)
+        self.gpio.output(self.gpio_pin,self._turn_pump_on_gpio_value)
 
     def _pump_off_real(self):
         '''
         Turn the pump off using the real GPIO
         '''
-        GPIO.output(self.gpio_pin,self._turn_pump_off_gpio_value)
+        self.gpio.output(self.gpio_pin,self._turn_pump_off_gpio_value)
 
     def _initialize_gpio_mock(self):
         '''
@@ -88,16 +115,92 @@ class Controllable_Pump:
     def __call__(self,time_on):
         '''
         Turn the pump on for time_on seconds
+        This blocks until the pump is turned off, use dispense() to run the pump in the background
         '''
         if self.verbose:
-            t = datetime.datetime.strftime(datetime.datetime.now(),"%m/%d %H:%M:%S")
+            t = datetime.datetime.strftime(datetime.datetime.fromtimestamp(self.clock.time()),"%m/%d %H:%M:%S")
             print("{}: Turning pump on for {:.2f} seconds".format(t,time_on))
-        self._pump_on()
-        time.sleep(time_on)
-        self._pump_off()
+        try:
+            self._pump_on()
+            self.clock.sleep(time_on)
+        finally:
+            self._pump_off()
         if self.verbose:
-            t = datetime.datetime.strftime(datetime.datetime.now(),"%m/%d %H:%M:%S")
+            t = datetime.datetime.strftime(datetime.datetime.fromtimestamp(self.clock.time()),"%m/%d %H:%M:%S")
             print("{}: Turning pump off".format(t))
+
+    def dispense(self,time_on,callback=None):
+        '''
+        Turn the pump on for time_on seconds without blocking
+        The pump is turned on and this returns immediately, a timer turns the pump off after time_on seconds.
+        time_on: float >= 0, seconds to run the pump
+        callback: None or function, called with the Future when the dispense is complete
+        Returns a concurrent.futures.Future, its result is the number of seconds the pump was on.
+            If the pump is already running the Future of the running dispense is returned and time_on is ignored
+        '''
+        from concurrent.futures import Future
+        with self._lock:
+            if self._future is not None:
+                print("Controllable_Pump: pump on gpio pin {} is already running, ignoring the request for {:.2f} seconds".format(self.gpio_pin,time_on))
+                return self._future
+
+            future = Future()
+            future.set_running_or_notify_cancel()
+            if callback is not None:
+                future.add_done_callback(callback)
+
+            if self.verbose:
+                t = datetime.datetime.strftime(datetime.datetime.fromtimestamp(self.clock.time()),"%m/%d %H:%M:%S")
+                print("{}: Turning pump on for {:.2f} seconds".format(t,time_on))
+            try:
+                self._pump_on()
+            except:
+                self._pump_off()
+                raise
+            self._future = future
+            self._on_time = self.clock.monotonic()
+            self._off_time = self._on_time + time_on
+            self._timer = self.clock.call_later(time_on,self.stop)
+        return future
+
+    def stop(self):
+        '''
+        Turn the pump off now, ending any dispense that is running
+        Safe to call when the pump is not running
+        '''
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            if self._future is not None:
+                self._pump_off()
+
+            future = self._future
+            on_time = self._on_time
+            self._timer = None
+            self._future = None
+            self._on_time = None
+            self._off_time = None
+        if future is not None:
+            if self.verbose:
+                t = datetime.datetime.strftime(datetime.datetime.fromtimestamp(self.clock.time()),"%m/%d %H:%M:%S")
+                print("{}: Turning pump off".format(t))
+            future.set_result(self.clock.monotonic() - on_time)
+
+    def is_running(self):
+        '''
+        Returns True if a dispense started with dispense() is running
+        '''
+        return self._future is not None
+
+    def time_remaining(self):
+        '''
+        Returns the number of seconds until the running dispense completes, 0.0 if the pump is not running
+        '''
+        off_time = self._off_time
+        if off_time is None:
+            return 0.
+        return max(off_time - self.clock.monotonic(),0.)
+
 if __name__ == "__main__":
     gpio_pin = 12
     try:
@@ -0,0 +1,147 @@
+import mmap
+
+# what Csv_Input does when the last row of the last file has been read
+END_OF_FILE_MODES = ("stop","loop","hold")
+
+class Csv_Input:
+    '''
+    Streams the rows of one or more csv files to use as the mock input of a sensor
+
+    Only the current line is held in memory, the files are opened when they are reached and closed
+        when they run out, so replaying months of recorded data starts instantly and uses constant memory.
+    The files are either plain mock inputs with one or more values per row, or output files of a device
+        in which case columns picks the values out of each row and the header of every file is used to
+        find them. Values of "None" or empty are returned as None.
+    When the end of the last file is reached:
+        "stop": read() raises EOFError
+        "loop": start over from the first row of the first file
+        "hold": keep returning the last row
+    '''
+
+    def __init__(self,
+                paths,
+                columns=None,
+                end_of_file="stop",
+                use_mmap=False):
+        '''
+        paths: str or list of str, the files to read, in order
+        columns: None or list of str. If None every value of each row is returned and the files have no header
+                    Otherwise the files have a header row, and only the named columns are returned in the given order
+        end_of_file: str, "stop", "loop" or "hold", what to do after the last row
+        use_mmap: Boolean, memory map the files instead of reading them through a buffered file object
+        '''
+        if isinstance(paths,str):
+            paths = [paths]
+        if end_of_file not in END_OF_FILE_MODES:
+            raise ValueError("Invalid end_of_file {}. Expected one of {}".format(end_of_file,list(END_OF_FILE_MODES)))
+        if len(paths) == 0:
+            raise ValueError("Csv_Input needs at least one file")
+
+        self.paths = list(paths)
+        self.columns = None if columns is None else list(columns)
+        self.end_of_file = end_of_file
+        self.use_mmap = use_mmap
+
+        self.rows_read = 0 # number of rows returned, including repeats of the held row
+        self._path_index = -1 # index into self.paths of the open file
+        self._fp = None
+        self._mm = None
+        self._column_indices = None # position of each of self.columns in the rows of the open file
+        self._last_row = None
+        self._rows_this_pass = 0 # rows read since the first file was last opened, used to detect empty input
+
+    def read(self):
+        '''
+        Return the next row as a list of float or None
+        Raises EOFError at the end of the input when end_of_file is "stop", or if there is no data
+        '''
+        while True:
+            line = self._readline()
+            if line is None: # out of files
+                if self.end_of_file == "loop" and self._rows_this_pass > 0:
+                    self._path_index = -1
+                    self._rows_this_pass = 0
+                    continue
+                if self.end_of_file == "hold" and self._last_row is not None:
+                    self.rows_read += 1
+                    return list(self._last_row)
+                raise EOFError("End of mock input {}".format(self.paths))
+
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            items = line.split(b",")
+            if self._column_indices is not None:
+                items = [items[ii] for ii in self._column_indices]
+            row = [parse_value(item) for item in items]
+
+            self._last_row = row
+            self._rows_this_pass += 1
+            self.rows_read += 1
+            return list(row)
+
+    def close(self):
+        '''
+        Close the open file. The next read() carries on with the next file
+        '''
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return self.read()
+        except EOFError:
+            raise StopIteration
+
+    def _readline(self):
+        '''
+        Return the next line of the input as bytes, opening the next file as needed
+        Returns None when there are no more files
+        '''
+        while True:
+            if self._fp is not None:
+                line = self._mm.readline() if self._mm is not None else self._fp.readline()
+                if len(line) > 0:
+                    return line
+                self.close()
+            if self._path_index + 1 >= len(self.paths):
+                self._path_index = len(self.paths)
+                return None
+            self._path_index += 1
+            self._open(self.paths[self._path_index])
+
+    def _open(self,path):
+        '''
+        Open path and read its header if columns were given
+        '''
+        self._fp = open(path,'rb')
+        if self.use_mmap:
+            try:
+                self._mm = mmap.mmap(self._fp.fileno(),0,access=mmap.ACCESS_READ)
+            except ValueError: # empty files can not be mapped
+                self._mm = None
+        if self.columns is not None:
+            header = self._mm.readline() if self._mm is not None else self._fp.readline()
+            names = [name.strip() for name in header.decode("utf-8").strip().split(",")]
+            missing = [column for column in self.columns if column not in names]
+            if len(missing) > 0:
+                self.close()
+                raise ValueError("Columns {} not found in {}".format(missing,path))
+            self._column_indices = [names.index(column) for column in self.columns]
+
+def parse_value(item):
+    '''
+    Convert one value from a mock input to a float, or None for "None" or an empty value
+    item: str or bytes
+    '''
+    item = item.strip()
+    if len(item) == 0 or item in (b"None","None"):
+        return None
+    return float(item)
@@ -0,0 +1,269 @@
+import datetime
+import io
+import json
+import os
+
+from .binary_storage import load_binary
+from .rollups import rollup_file_base
+
+class Data_Store:
+    '''
+    Loads time ranges of the daily output files without reading the whole archive
+
+    The files for a sensor are found from the dates in the requested range, so the directory is never listed.
+    Each csv file gets a sidecar index in <data_path>/.index/ holding the column names, number of rows,
+        first and last epoch, and the byte offset of the first row of every hour. load() uses it to read
+        only the bytes covering the requested range. The index of a file that is still being appended to
+        is extended from where it left off the next time it is used.
+    Binary files do not need an index, the records are fixed width so the range is found with a binary search.
+    '''
+
+    def __init__(self,data_path,verbose=False):
+        '''
+        data_path: directory the sensors and controllers write to
+        verbose: Boolean, Output the files that are read
+        '''
+        self.data_path = data_path
+        self.index_path = os.path.join(data_path,".index")
+        self.verbose = verbose
+
+    def files(self,sensor,start,end):
+        '''
+        Return the paths of the daily files of sensor that can hold data between start and end
+        sensor: str, the output_file_base of the device, ie "sensor_ph_bin1"
+        start, end: float, epochs of the range
+        '''
+        # A row written just after midnight can land in the previous day's file, and a rollup bucket
+        #   that closes at midnight is written to the next day's file, so look one day each way
+        day = datetime.date.fromtimestamp(start) - datetime.timedelta(days=1)
+        last_day = datetime.date.fromtimestamp(end) + datetime.timedelta(days=1)
+        paths = []
+        while day <= last_day:
+            for extension in [".csv",".bin"]:
+                path = os.path.join(self.data_path,"{}_{}{}".format(sensor,day.isoformat(),extension))
+                if os.path.isfile(path):
+                    paths.append(path)
+            day += datetime.timedelta(days=1)
+        return paths
+
+    def index(self,path):
+        '''
+        Return the index of the csv file at path, building or extending it as needed
+        The index is a dict with keys:
+            columns: list of column names
+            size: number of bytes of the file that have been indexed
+            rows: number of rows indexed
+            first, last: epochs of the first and last rows, None if there are no rows
+            hours: dict of epoch of the start of an hour -> byte offset of the first row in that hour
+            hour_rows: dict of epoch of the start of an hour -> number of rows before that hour
+        '''
+        index_file = os.path.join(self.index_path,os.path.basename(path) + ".json")
+        index = None
+        if os.path.isfile(index_file):
+            with open(index_file,'r') as fp:
+                index = json.load(fp)
+            index["hours"] = {int(hour):offset for hour,offset in index["hours"].items()}
+            if "hour_rows" in index:
+                index["hour_rows"] = {int(hour):rows for hour,rows in index["hour_rows"].items()}
+            else:
+                index = None # from before the row counts were indexed
+
+        size = os.path.getsize(path)
+        if (index is not None) and (index["size"] == size):
+            return index
+        with open(path,'rb') as fp:
+            header = fp.readline()
+            columns = [column.strip() for column in header.decode("utf-8").strip().split(",")]
+            if (index is not None) and ((index["size"] > size) or (index["columns"] != columns)):
+                index = None # the file was replaced, ie moved aside by Output_Rotation when its header changed
+            if index is None:
+                index = {"columns":columns,
+                        "size":len(header),
+                        "rows":0,
+                        "first":None,
+                        "last":None,
+                        "hours":{},
+                        "hour_rows":{}}
+            fp.seek(index["size"])
+            offset = index["size"]
+            for line in fp:
+                if not line.endswith(b"\n"): # row is still being written
+                    break
+                epoch = float(line[:line.index(b",")])
+                hour = int(epoch // 3600) * 3600
+                if hour not in index["hours"]:
+                    index["hours"][hour] = offset
+                    index["hour_rows"][hour] = index["rows"]
+                if index["first"] is None:
+                    index["first"] = epoch
+                index["last"] = epoch
+                index["rows"] += 1
+                offset += len(line)
+            index["size"] = offset
+
+        os.makedirs(self.index_path,exist_ok=True)
+        with open(index_file,'w') as fp:
+            json.dump(index,fp)
+        return index
+
+    def load(self,sensor,start,end,every=1):
+        '''
+        Load the rows of sensor with start <= time <= end
+        sensor: str, the output_file_base of the device, ie "sensor_ph_bin1"
+        start, end: float epochs or datetime.datetime of the range
+        every: int >= 1, keep every <every>th row
+        Returns a pandas DataFrame with the time column, a datetime_timezone column computed from it,
+            and the data columns. Missing values are NaN
+        '''
+        import pandas as pd
+
+        if isinstance(start,datetime.datetime):
+            start = start.timestamp()
+        if isinstance(end,datetime.datetime):
+            end = end.timestamp()
+
+        frames = []
+        for path in self.files(sensor,start,end):
+            if path.endswith(".bin"):
+                frame = self._load_binary(path,start,end)
+            else:
+                frame = self._load_csv(path,start,end)
+            if frame is not None and len(frame) > 0:
+                frames.append(frame)
+
+        if len(frames) == 0:
+            return pd.DataFrame()
+        df = pd.concat(frames,axis=0,ignore_index=True)
+        df.sort_values("time",inplace=True,kind="stable")
+        df = df.iloc[::every].reset_index(drop=True)
+
+        local_timezone = datetime.datetime.now().astimezone().tzinfo
+        df.insert(1,"datetime_timezone",pd.to_datetime(df["time"],unit="s",utc=True).dt.tz_convert(local_timezone))
+        return df
+
+    def load_rollup(self,sensor,resolution,start,end):
+        '''
+        Load the rollup rows of sensor at resolution seconds with start <= time <= end, see Rollup
+        The time column is the start of each bucket
+        '''
+        return self.load(rollup_file_base(sensor,resolution),start,end)
+
+    def load_summary(self,sensor,start,end,max_points=5000,resolutions=(60,3600)):
+        '''
+        Load sensor between start and end at the finest resolution that has at most max_points rows
+        The raw data is used if it fits, otherwise the finest rollup that fits, otherwise the coarsest rollup
+        Returns (resolution,DataFrame), resolution is None for the raw data
+        '''
+        if isinstance(start,datetime.datetime):
+            start = start.timestamp()
+        if isinstance(end,datetime.datetime):
+            end = end.timestamp()
+
+        raw_rows = self.count(sensor,start,end)
+        if raw_rows <= max_points:
+            return None,self.load(sensor,start,end)
+
+        resolutions = sorted(resolutions)
+        for resolution in resolutions:
+            if (end - start) / resolution <= max_points:
+                return resolution,self.load_rollup(sensor,resolution,start,end)
+        return resolutions[-1],self.load_rollup(sensor,resolutions[-1],start,end)
+
+    def count(self,sensor,start,end):
+        '''
+        Return the number of rows of sensor with start <= time <= end, the length load() would return
+        The rows of the hours that are wholly in the range are counted from the index, only the hours at
+            the ends of the range are read. The binary files are counted with a binary search
+        '''
+        import numpy as np
+
+        if isinstance(start,datetime.datetime):
+            start = start.timestamp()
+        if isinstance(end,datetime.datetime):
+            end = end.timestamp()
+
+        rows = 0
+        for path in self.files(sensor,start,end):
+            if path.endswith(".bin"):
+                data = load_binary(path)
+                rows += int(np.searchsorted(data["time"],end,side="right") - np.searchsorted(data["time"],start,side="left"))
+            else:
+                rows += self._count_csv(path,start,end)
+        return rows
+
+    def _count_csv(self,path,start,end):
+        '''
+        Count the rows of the csv file at path between start and end using its index
+        '''
+        index = self.index(path)
+        if index["rows"] == 0 or index["last"] < start or index["first"] > end:
+            return 0
+
+        hours = sorted(index["hours"].items())
+        rows = 0
+        for ii,(hour,offset) in enumerate(hours):
+            if ii+1 < len(hours):
+                next_offset = hours[ii+1][1]
+                hour_rows = index["hour_rows"][hours[ii+1][0]] - index["hour_rows"][hour]
+            else:
+                next_offset = index["size"]
+                hour_rows = index["rows"] - index["hour_rows"][hour]
+            if hour + 3600 <= start or hour > end:
+                continue
+            if start <= hour and hour + 3600 <= end:
+                rows += hour_rows
+                continue
+            # The hour holds one of the ends of the range, count its rows
+            with open(path,'rb') as fp:
+                fp.seek(offset)
+                data = fp.read(next_offset - offset)
+            for line in data.splitlines():
+                epoch = float(line[:line.index(b",")])
+                if start <= epoch <= end:
+                    rows += 1
+        return rows
+
+    def _load_csv(self,path,start,end):
+        '''
+        Read the rows of the csv file at path between start and end using its index
+        '''
+        import pandas as pd
+
+        index = self.index(path)
+        if index["rows"] == 0 or index["last"] < start or index["first"] > end:
+            return None
+
+        hours = sorted(index["hours"].items())
+        start_offset = hours[0][1]
+        end_offset = index["size"]
+        for hour,offset in hours:
+            if hour <= start:
+                start_offset = offset
+            if hour > end:
+                end_offset = offset
+                break
+
+        with open(path,'rb') as fp:
+            fp.seek(start_offset)
+            data = fp.read(end_offset - start_offset)
+        if self.verbose:
+            print("Data_Store: read {} of {} bytes from {}".format(len(data),index["size"],path))
+
+        columns = index["columns"]
+        usecols = [column for column in columns if column != "datetime_timezone"]
+        df = pd.read_csv(io.BytesIO(data),header=None,names=columns,usecols=usecols,na_values=["None"])
+        return df[(df["time"] >= start) & (df["time"] <= end)]
+
+    def _load_binary(self,path,start,end):
+        '''
+        Read the records of the binary file at path between start and end
+        '''
+        import numpy as np
+        import pandas as pd
+
+        data = load_binary(path)
+        first = np.searchsorted(data["time"],start,side="left")
+        last = np.searchsorted(data["time"],end,side="right")
+        if self.verbose:
+            print("Data_Store: read {} of {} records from {}".format(last-first,len(data),path))
+        return pd.DataFrame(np.array(data[first:last]))
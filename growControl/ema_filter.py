@@ -0,0 +1,80 @@
+import math
+
+class Ema_Filter:
+    '''
+    Exponential moving average of a sensor reading
+
+    With a time_constant each reading is weighted by the time since the previous one,
+        alpha = 1 - exp(-dt/time_constant), so skipped or late readings do not change how quickly the
+        average follows the readings. The average starts at the first reading instead of a guess.
+    With a factor each reading is weighted the same, average = average*factor + reading*(1-factor),
+        starting at initial. This is how the sensors have always averaged, and their default.
+    Readings of None are ignored.
+    '''
+
+    def __init__(self,time_constant=None,factor=None,initial=None):
+        '''
+        time_constant: None or float > 0, seconds for the average to move 63% of the way to a new steady reading
+        factor: None or float [0,1), weight of the previous average for each reading. Used if time_constant is None
+        initial: None or float, the average before the first reading. If None the first reading is the average
+        '''
+        if time_constant is None and factor is None:
+            raise ValueError("Either time_constant or factor must be given")
+        if time_constant is not None and time_constant <= 0.:
+            raise ValueError("time_constant must be greater than 0, got {}".format(time_constant))
+        self.time_constant = time_constant
+        self.factor = factor
+        self.value = initial
+        self.last_update = None # epoch of the last reading folded in to the average
+
+    def update(self,reading,epoch=None):
+        '''
+        Fold reading in to the average
+        epoch: float, time of the reading. Needed with a time_constant
+        Returns the average
+        '''
+        if reading is None:
+            return self.value
+        if self.value is None:
+            self.value = reading
+        elif self.time_constant is not None:
+            dt = epoch - self.last_update if self.last_update is not None else 0.
+            alpha = 1. - math.exp(-max(dt,0.) / self.time_constant)
+            self.value = self.value + alpha * (reading - self.value)
+        else:
+            self.value = self.value * self.factor + reading * (1-self.factor)
+        self.last_update = epoch
+        return self.value
+
+def factor_to_time_constant(factor,every):
+    '''
+    Return the time constant in seconds that averages like factor does with a reading every seconds
+    '''
+    return -every / math.log(factor)
+
+class Ema_Filter_Bank:
+    '''
+    Several time constant Ema_Filters of the same reading, ie a fast one for the UI and a slow one for a controller
+    '''
+
+    def __init__(self,time_constants):
+        '''
+        time_constants: dict of name -> time constant in seconds
+        '''
+        self.filters = {name:Ema_Filter(time_constant=time_constant) for name,time_constant in time_constants.items()}
+
+    def update(self,reading,epoch):
+        '''
+        Fold reading in to every average
+        '''
+        for ema in self.filters.values():
+            ema.update(reading,epoch)
+
+    def values(self):
+        '''
+        Returns a dict of name -> average, None until the first reading
+        '''
+        return {name:ema.value for name,ema in self.filters.items()}
+
+    def __getitem__(self,name):
+        return self.filters[name].value
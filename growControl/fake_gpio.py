@@ -0,0 +1,131 @@
+import threading
+import time
+
+class Fake_GPIO:
+    '''
+    Stand in for the RPi.GPIO module so the devices can be tested off of the raspberry pi
+
+    Implements the parts of the RPi.GPIO interface that growControl uses. Output pins remember
+        their value, input pins read as low unless a simulated device drives them.
+    attach_sr04() simulates an ultrasonic distance sensor: when its trigger pin goes from high
+        to low the echo pin goes high for pulse_duration seconds, and edge callbacks registered
+        with add_event_detect() are called from a background thread like the real interrupts are
+    With a Virtual_Clock the echo is timed on the clock instead: each input() of the echo pin advances the clock
+        by poll_time, like a polling loop takes time, and with edge callbacks the trigger advances the clock
+        through the echo and calls them at the edges, so the measured pulse is exact when the sensor is given
+        pulse_timer=clock.monotonic
+    '''
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self,clock=None,poll_time=1e-6):
+        '''
+        clock: None or instance of Virtual_Clock the simulated echoes are timed on. If None they take real time
+        poll_time: float, seconds the clock is advanced by each input() of an echo pin when a clock is given
+        '''
+        self.clock = clock
+        self.poll_time = poll_time
+        self.mode = None
+        self.pin_directions = {} # pin -> OUT or IN
+        self.pin_values = {} # pin -> LOW or HIGH
+        self._callbacks = {} # pin -> (edge, callback)
+        self._sr04 = {} # trigger pin -> [echo pin, echo_delay, pulse_duration]
+        self._echo_times = {} # echo pin -> (rise epoch, fall epoch) of the last simulated echo
+
+    def setmode(self,mode):
+        self.mode = mode
+
+    def setup(self,pin,direction):
+        self.pin_directions[pin] = direction
+        self.pin_values.setdefault(pin,self.LOW)
+
+    def output(self,pin,value):
+        if self.pin_directions.get(pin) != self.OUT:
+            raise RuntimeError("Fake_GPIO: pin {} has not been set up as an output".format(pin))
+        previous = self.pin_values.get(pin,self.LOW)
+        value = self.HIGH if value else self.LOW
+        self.pin_values[pin] = value
+        if (pin in self._sr04) and previous == self.HIGH and value == self.LOW:
+            self._start_echo(pin)
+
+    def input(self,pin):
+        if pin in self._echo_times:
+            rise,fall = self._echo_times[pin]
+            if self.clock is not None:
+                self.clock.advance(self.poll_time)
+            now = self._now()
+            return self.HIGH if rise <= now < fall else self.LOW
+        return self.pin_values.get(pin,self.LOW)
+
+    def add_event_detect(self,pin,edge,callback=None,bouncetime=None):
+        if pin in self._callbacks:
+            raise RuntimeError("Fake_GPIO: Conflicting edge detection already enabled for pin {}".format(pin))
+        self._callbacks[pin] = (edge,callback)
+
+    def remove_event_detect(self,pin):
+        self._callbacks.pop(pin,None)
+
+    def cleanup(self,pins=None):
+        if pins is None:
+            pins = list(self.pin_directions.keys())
+        elif isinstance(pins,int):
+            pins = [pins]
+        for pin in pins:
+            self.pin_directions.pop(pin,None)
+            self.pin_values.pop(pin,None)
+            self._callbacks.pop(pin,None)
+
+    def attach_sr04(self,trigger_pin,echo_pin,pulse_duration,echo_delay=0.0005):
+        '''
+        Simulate an ultrasonic distance sensor on trigger_pin and echo_pin
+        pulse_duration: float, seconds the echo pin is high for, the value the sensor should measure
+        echo_delay: float, seconds after the trigger before the echo pin goes high
+        '''
+        self._sr04[trigger_pin] = [echo_pin,echo_delay,pulse_duration]
+
+    def set_pulse_duration(self,trigger_pin,pulse_duration):
+        '''
+        Change the pulse duration returned by the simulated sensor on trigger_pin
+        '''
+        self._sr04[trigger_pin][2] = pulse_duration
+
+    def _start_echo(self,trigger_pin):
+        '''
+        Drive the echo pin of the simulated sensor, calling any edge callbacks at the edges
+        '''
+        echo_pin,echo_delay,pulse_duration = self._sr04[trigger_pin]
+        rise = self._now() + echo_delay
+        fall = rise + pulse_duration
+        self._echo_times[echo_pin] = (rise,fall)
+        if echo_pin in self._callbacks and self.clock is not None:
+            for edge_time,edge in [(rise,self.RISING),(fall,self.FALLING)]:
+                self.clock.advance_to(edge_time)
+                self._call_edge_callback(echo_pin,edge)
+        elif echo_pin in self._callbacks:
+            thread = threading.Thread(target=self._run_echo_callbacks,args=(echo_pin,rise,fall),daemon=True)
+            thread.start()
+
+    def _run_echo_callbacks(self,echo_pin,rise,fall):
+        for edge_time,edge in [(rise,self.RISING),(fall,self.FALLING)]:
+            # sleep most of the way, then spin to get close to the real interrupt timing
+            delay = edge_time - time.perf_counter() - 0.001
+            if delay > 0:
+                time.sleep(delay)
+            while time.perf_counter() < edge_time:
+                pass
+            self._call_edge_callback(echo_pin,edge)
+
+    def _call_edge_callback(self,echo_pin,edge):
+        wanted_edge,callback = self._callbacks.get(echo_pin,(None,None))
+        if callback is not None and wanted_edge in (edge,self.BOTH):
+            callback(echo_pin)
+
+    def _now(self):
+        return self.clock.monotonic() if self.clock is not None else time.perf_counter()
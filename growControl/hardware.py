@@ -0,0 +1,58 @@
+'''
+Imports the raspberry pi hardware libraries the first time a real device needs them
+
+Nothing here is imported when growControl is, so the package imports quickly and quietly off of the pi,
+    and the devices that run from csv files or with gpio_pin=None never need the libraries. A device that
+    needs a library that can not be imported raises ImportError saying how to run it without the hardware.
+'''
+import types
+
+_modules = {} # name -> the imported module or namespace
+
+def _load(name,importer,device,hint):
+    '''
+    Return the result of importer(), importing it only the first time name is loaded
+    device: str, the device that needs it, for the error message
+    hint: str, how to run the device without the hardware, for the error message
+    '''
+    if name not in _modules:
+        try:
+            _modules[name] = importer()
+        except Exception as e:
+            raise ImportError("{}: Unable to import the raspberry pi specific module {} ({}: {}). {}".format(device,name,type(e).__name__,e,hint)) from e
+    return _modules[name]
+
+def gpio(device="growControl"):
+    '''
+    Return the RPi.GPIO module
+    device: str, the device that needs it, used in the error message
+    '''
+    def importer():
+        import RPi.GPIO
+        return RPi.GPIO
+    return _load("RPi.GPIO",importer,device,"Use gpio_pin=None, a csv input, or pass a Fake_GPIO")
+
+def dht(device="growControl"):
+    '''
+    Return the Adafruit_DHT module
+    device: str, the device that needs it, used in the error message
+    '''
+    def importer():
+        import Adafruit_DHT
+        return Adafruit_DHT
+    return _load("Adafruit_DHT",importer,device,"Use a csv input")
+
+def ads1115(device="growControl"):
+    '''
+    Return a namespace of the modules used to read an ADS1115: board, busio, ADS (adafruit_ads1x15.ads1115),
+        AnalogIn and Mode
+    device: str, the device that needs it, used in the error message
+    '''
+    def importer():
+        import board
+        import busio
+        import adafruit_ads1x15.ads1115 as ADS
+        from adafruit_ads1x15.analog_in import AnalogIn
+        from adafruit_ads1x15.ads1x15 import Mode
+        return types.SimpleNamespace(board=board,busio=busio,ADS=ADS,AnalogIn=AnalogIn,Mode=Mode)
+    return _load("adafruit_ads1x15",importer,device,"Use a csv input, or an ADS1115_Bus_Manager with a Fake_ADS1115 backend")
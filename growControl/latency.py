@@ -0,0 +1,121 @@
+import json
+import math
+import time
+
+class Latency_Histogram:
+    '''
+    Rolling histogram of how long the calls to a device take
+
+    Durations are counted in log spaced buckets, buckets_per_octave per doubling starting at min_latency,
+        so recording is a log and an increment and the memory does not grow. The counts are kept for the
+        current and the previous window of window seconds, so the percentiles cover between window and
+        2*window seconds of calls and old stalls roll off. Percentiles are the upper edge of their bucket,
+        ie at most 19% high with 4 buckets per octave.
+    The total number of calls, the number that did work (the device was due and was read or controlled),
+        and the all time maximum are also kept.
+    '''
+
+    def __init__(self,window=600.,min_latency=1e-6,max_latency=100.,buckets_per_octave=4):
+        '''
+        window: float > 0, seconds of calls in each of the two rolling windows
+        min_latency: float > 0, seconds, upper edge of the first bucket
+        max_latency: float > min_latency, seconds, durations above this are counted in the last bucket
+        buckets_per_octave: int > 0, resolution of the histogram
+        '''
+        self.window = window
+        self.min_latency = min_latency
+        self.buckets_per_octave = buckets_per_octave
+        self.n_buckets = int(math.ceil(math.log2(max_latency/min_latency) * buckets_per_octave)) + 1
+
+        self.calls = 0 # calls since the start
+        self.work = 0 # calls that did work since the start
+        self.max = 0. # longest call since the start
+        self._counts = [0] * self.n_buckets # current window
+        self._previous_counts = [0] * self.n_buckets # previous window
+        self._window_max = 0.
+        self._previous_window_max = 0.
+        self._window_end = time.monotonic() + self.window
+
+    def record(self,seconds,did_work=True):
+        '''
+        Count one call that took seconds
+        did_work: Boolean, False if the device was called but was not due
+        '''
+        now = time.monotonic()
+        if now >= self._window_end:
+            self._roll(now)
+
+        if seconds <= self.min_latency:
+            bucket = 0
+        else:
+            bucket = min(int(math.ceil(math.log2(seconds/self.min_latency) * self.buckets_per_octave)),self.n_buckets-1)
+        self._counts[bucket] += 1
+        self.calls += 1
+        if did_work:
+            self.work += 1
+        if seconds > self._window_max:
+            self._window_max = seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self,p):
+        '''
+        Return the p-th percentile (0 to 100) of the calls in the rolling windows in seconds, None if there are none
+        '''
+        counts = [a+b for a,b in zip(self._counts,self._previous_counts)]
+        total = sum(counts)
+        if total == 0:
+            return None
+        target = p / 100. * total
+        cumulative = 0
+        for bucket,count in enumerate(counts):
+            cumulative += count
+            if cumulative >= target and count > 0:
+                return self.bucket_upper_edge(bucket)
+        return self.bucket_upper_edge(self.n_buckets-1)
+
+    def bucket_upper_edge(self,bucket):
+        '''
+        Return the longest duration in seconds counted in bucket
+        '''
+        return self.min_latency * 2.**(bucket / self.buckets_per_octave)
+
+    def summary(self):
+        '''
+        Return a dict of the statistics
+            calls, work: number of calls and calls that did work since the start
+            p50, p95: percentiles of the rolling windows in seconds
+            recent_max: longest call in the rolling windows in seconds
+            max: longest call since the start in seconds
+        '''
+        if time.monotonic() >= self._window_end:
+            self._roll(time.monotonic())
+        return {"calls":self.calls,
+                "work":self.work,
+                "p50":self.percentile(50),
+                "p95":self.percentile(95),
+                "recent_max":max(self._window_max,self._previous_window_max),
+                "max":self.max}
+
+    def _roll(self,now):
+        '''
+        Start a new window, dropping the oldest one
+        '''
+        if now >= self._window_end + self.window: # more than a whole window without a call, both windows are stale
+            self._previous_counts = [0] * self.n_buckets
+            self._previous_window_max = 0.
+        else:
+            self._previous_counts = self._counts
+            self._previous_window_max = self._window_max
+        self._counts = [0] * self.n_buckets
+        self._window_max = 0.
+        self._window_end = now + self.window
+
+def dump_latency(path,histograms):
+    '''
+    Write the summaries of histograms to the json file at path
+    histograms: dict of name -> Latency_Histogram
+    '''
+    data = {name:histogram.summary() for name,histogram in histograms.items()}
+    with open(path,'w') as fp:
+        json.dump(data,fp,indent=2)
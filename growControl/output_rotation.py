@@ -0,0 +1,125 @@
+import datetime
+import os
+import threading
+
+from .binary_storage import repair_binary
+from .clock import get_default_clock
+
+class Output_Rotation:
+    '''
+    Keeps track of the daily output files for all of the sensors and controllers
+
+    Each device registers the directory, base name and header of its output file once. The path
+        of the current file is cached and served until the next local midnight, so the hot path of
+        a reading is a single float comparison instead of a date lookup, path join and stat of the file.
+    At midnight the file for the new day is created and the header written, once for every registered device.
+        The rollover is done under a lock, since devices reading on an executor ask for their file from other threads.
+    A file that already exists with a different header, ie after a setting that adds a column was changed, is moved
+        to <file name>.<n><extension> and a new file is started, so rows with different columns are never mixed in one file.
+    '''
+
+    def __init__(self,clock=None,verbose=False):
+        '''
+        clock: None or instance of Real_Clock or Virtual_Clock that decides the current day. If None the default Real_Clock is used
+        verbose: Boolean, Output the new file names at every rollover
+        '''
+        self.clock = clock if clock is not None else get_default_clock()
+        self.verbose = verbose
+        self._devices = {} # key -> (output_file_path, output_file_base, header, extension)
+        self._output_files = {} # key -> path of the file for the current day
+        self.date = None # date the current files are for
+        self.next_rollover = None # epoch of the next local midnight
+        self._lock = threading.Lock()
+
+    def register(self,output_file_path,output_file_base,header,extension=".csv"):
+        '''
+        Register a device, creates the file for the current day if it does not exist
+        output_file_path: path to where the output data should be saved
+        output_file_base: start of the output file name. This will get the date appended to it
+        header: str or bytes, start of a new file. bytes are written in binary mode
+        extension: str, extension of the file name
+        Returns the key to pass to get_output_file()
+        '''
+        key = os.path.join(output_file_path,output_file_base)
+        with self._lock:
+            self._devices[key] = (output_file_path,output_file_base,header,extension)
+            if self.next_rollover is None:
+                self._update_date()
+            self._output_files[key] = self._create_file(key)
+        return key
+
+    def get_output_file(self,key):
+        '''
+        Return the path to the file for the current day for the device registered as key
+        '''
+        if self.clock.time() >= self.next_rollover:
+            with self._lock:
+                if self.clock.time() >= self.next_rollover: # another thread may have rolled over while this one waited
+                    self._rollover()
+        return self._output_files[key]
+
+    def _update_date(self):
+        '''
+        Set the current date and compute the epoch of the next local midnight
+        '''
+        self.date = datetime.date.fromtimestamp(self.clock.time())
+        tomorrow = self.date + datetime.timedelta(days=1)
+        self.next_rollover = datetime.datetime.combine(tomorrow,datetime.time()).timestamp()
+
+    def _rollover(self):
+        '''
+        Move every registered device to the file for the new day
+        '''
+        self._update_date()
+        for key in self._devices:
+            self._output_files[key] = self._create_file(key)
+            if self.verbose:
+                print("Output_Rotation: now writing to {}".format(self._output_files[key]))
+
+    def _create_file(self,key):
+        '''
+        Create the file for the current day and write the header if the file does not exist
+        An existing file with a different header is moved aside first. A binary file that already exists is repaired
+            before it is appended to, see repair_binary
+        '''
+        output_file_path,output_file_base,header,extension = self._devices[key]
+        output_file = os.path.join(output_file_path,"{}_{}{}".format(output_file_base,self.date.isoformat(),extension))
+        if os.path.isfile(output_file) and not self._header_matches(output_file,header):
+            self._move_aside(output_file,extension)
+        if not os.path.isfile(output_file):
+            with open(output_file,"ab" if isinstance(header,bytes) else "a") as fp:
+                fp.write(header)
+        elif isinstance(header,bytes):
+            repair_binary(output_file)
+        return output_file
+
+    def _header_matches(self,output_file,header):
+        '''
+        Return True if output_file starts with header
+        '''
+        expected = header if isinstance(header,bytes) else header.encode("utf-8")
+        with open(output_file,'rb') as fp:
+            return fp.read(len(expected)) == expected
+
+    def _move_aside(self,output_file,extension):
+        '''
+        Rename output_file to the first free <name>.<n><extension>
+        '''
+        stem = output_file[:len(output_file)-len(extension)] if extension else output_file
+        n = 1
+        while os.path.exists("{}.{}{}".format(stem,n,extension)):
+            n += 1
+        moved = "{}.{}{}".format(stem,n,extension)
+        os.replace(output_file,moved)
+        print("Output_Rotation: the header of {} does not match the columns written now, moved it to {} and started a new file".format(output_file,moved))
+
+_default_output_rotation = None
+
+def get_default_output_rotation():
+    '''
+    Return the Output_Rotation shared by all devices that are not given one
+    '''
+    global _default_output_rotation
+    if _default_output_rotation is None:
+        _default_output_rotation = Output_Rotation()
+    return _default_output_rotation
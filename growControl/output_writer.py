@@ -0,0 +1,212 @@
+import atexit
+import collections
+import datetime
+import os
+import queue
+import sys
+import threading
+import time
+
+from .binary_storage import binary_header, encode_record, repair_binary
+
+# file extension of the output files for each storage format
+STORAGE_EXTENSIONS = {"csv":".csv","binary":".bin"}
+
+class Output_Writer:
+    '''
+    Writes the output rows of the sensors and controllers to disk from a background thread
+
+    Devices hand their rows to write() which only puts them on a queue, so a slow SD card never
+        delays a reading. The background thread keeps the file handles open and writes the rows
+        in batches. A batch is flushed to disk when any of these happen:
+            * batch_size rows are waiting
+            * flush_every seconds have passed since the last flush
+            * flush() or close() is called
+    close() is registered with atexit so everything queued is written when the program exits
+    '''
+
+    def __init__(self,
+                batch_size=50,
+                flush_every=5.0,
+                fsync=False,
+                max_open_files=32,
+                verbose=False):
+        '''
+        batch_size: int > 0, flush once this many rows are waiting to be written
+        flush_every: float > 0, maximum number of seconds a row can wait before it is flushed
+        fsync: Boolean, call os.fsync after every flush so the data is actually on the card.
+                This is slower, but no data is lost on a power failure
+        max_open_files: int > 0, number of file handles to keep open. The least recently used
+                handle is closed when more files than this are written to
+        verbose: Boolean, Output information about the flushes to standard out
+        '''
+        self.batch_size = batch_size
+        self.flush_every = flush_every
+        self.fsync = fsync
+        self.max_open_files = max_open_files
+        self.verbose = verbose
+
+        self._queue = queue.Queue()
+        self._files = collections.OrderedDict() # path -> open file handle, in least recently used order
+        self._pending = 0 # number of rows written to handles but not flushed
+        self._last_flush = time.time()
+        self._closed = False
+
+        self._thread = threading.Thread(target=self._run,name="Output_Writer",daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self,path,data):
+        '''
+        Queue data to be appended to the file at path
+        path: str, file to append to
+        data: str or bytes, the data to append. bytes are written to the file in binary mode
+        '''
+        if self._closed:
+            raise ValueError("Output_Writer: write() called after close()")
+        self._queue.put((path,data))
+
+    def flush(self):
+        '''
+        Block until everything that has been queued is written and flushed to disk
+        '''
+        if self._closed:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+
+    def close(self):
+        '''
+        Flush everything that has been queued, close all the files and stop the background thread
+        Safe to call more than once
+        '''
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        '''
+        Main loop of the background thread
+        '''
+        while True:
+            timeout = max(self._last_flush + self.flush_every - time.time(),0.)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                self._flush()
+                continue
+
+            if item is None: # close() was called
+                self._flush()
+                self._close_files()
+                return
+            elif isinstance(item,threading.Event): # flush() was called
+                self._flush()
+                item.set()
+                continue
+
+            path,data = item
+            try:
+                self._get_file(path,binary=isinstance(data,bytes)).write(data)
+                self._pending += 1
+            except:
+                e = sys.exc_info()
+                print("Exception thrown while writing to {}:".format(path))
+                print("{}: {}".format(e[0],e[1]))
+
+            if (self._pending >= self.batch_size) or (time.time() - self._last_flush >= self.flush_every):
+                self._flush()
+
+    def _get_file(self,path,binary=False):
+        '''
+        Return an open handle to path, opening it if needed
+        '''
+        mode = "ab" if binary else "a"
+        fp = self._files.get(path)
+        if (fp is not None) and (fp.mode != mode):
+            fp.close()
+            del self._files[path]
+            fp = None
+
+        if fp is None:
+            if binary and os.path.isfile(path):
+                repair_binary(path) # a record cut short by a crash would shift every record appended after it
+            fp = open(path,mode)
+            self._files[path] = fp
+            if len(self._files) > self.max_open_files:
+                _,oldest = self._files.popitem(last=False)
+                oldest.close()
+        else:
+            self._files.move_to_end(path)
+        return fp
+
+    def _flush(self):
+        '''
+        Flush all the open files to disk
+        '''
+        for path,fp in self._files.items():
+            try:
+                fp.flush()
+                if self.fsync:
+                    os.fsync(fp.fileno())
+            except:
+                e = sys.exc_info()
+                print("Exception thrown while flushing {}:".format(path))
+                print("{}: {}".format(e[0],e[1]))
+        if self.verbose and self._pending > 0:
+            print("Output_Writer: flushed {} rows".format(self._pending))
+        self._pending = 0
+        self._last_flush = time.time()
+
+    def _close_files(self):
+        '''
+        Close all of the open files
+        '''
+        for fp in self._files.values():
+            fp.close()
+        self._files.clear()
+
+def append_to_file(path,data,output_writer=None):
+    '''
+    Append data to the file at path
+    If output_writer is None the data is written immediately, otherwise it is queued on output_writer
+    path: str, file to append to
+    data: str or bytes, the data to append
+    output_writer: None or instance of Output_Writer
+    '''
+    if output_writer is None:
+        with open(path,"ab" if isinstance(data,bytes) else "a") as fp:
+            fp.write(data)
+    else:
+        output_writer.write(path,data)
+
+def output_file_header(header,storage="csv"):
+    '''
+    Return the header to start a new output file with
+    header: str, the csv header of the device, ie "time,datetime_timezone,voltage_raw,...\n"
+    storage: str, "csv" or "binary"
+        For "binary" the datetime_timezone column is dropped, it can be recomputed from the epoch in the time column
+    '''
+    if storage == "csv":
+        return header
+    elif storage == "binary":
+        columns = [column.strip() for column in header.strip().split(",")]
+        return binary_header([column for column in columns if column != "datetime_timezone"])
+    else:
+        raise ValueError("Invalid storage {}. Expected one of {}".format(storage,list(STORAGE_EXTENSIONS.keys())))
+
+def format_output_row(epoch,values,storage="csv"):
+    '''
+    Return one row of output
+    epoch: float, time of the reading
+    values: list of the values for the columns after time and datetime_timezone
+    storage: str, "csv" or "binary"
+    '''
+    if storage == "binary":
+        return encode_record(epoch,values)
+    output = "{},{},".format(epoch,datetime.datetime.fromtimestamp(epoch).astimezone())
+    output += ",".join("{}".format(value) for value in values) + "\n"
+    return output
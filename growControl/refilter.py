@@ -0,0 +1,186 @@
+'''
+Recomputes the moving average of recorded sensor readings for a grid of average factors at once
+
+The sensors average with average = average*factor + reading*(1-factor), skipping readings of None. ema_grid()
+    runs that recurrence over the whole recorded history for every factor of the grid in one vectorized pass,
+    with scipy.signal.lfilter if scipy is installed, otherwise with a numpy prefix scan. refilter_report()
+    then gives for each factor how far the average lags the readings and how much noise is left in it,
+    so average_factor can be picked from months of data in seconds instead of by eye.
+
+    python -m growControl.refilter --data <data dir> --sensor sensor_ph_bin1 --start 2021-01-01 --end 2021-03-01 \
+        --factors 0.9,0.95,0.98,0.99,0.995 --window 1800
+
+The average lags a steady trend by factor/(1-factor) readings, reported in seconds as delay_s. The residual is
+    the average minus its centered rolling mean over window seconds, noise is its standard deviation and swing is
+    half of its 5th to 95th percentile range, the +/- the average wanders by around the trend.
+    tracking_error is the RMS difference between the average and the centered rolling mean of the readings,
+    which grows with the delay.
+'''
+import argparse
+import datetime
+import os
+import time
+
+def _ema_lfilter(readings,factors,initial):
+    '''
+    ema_grid() of the readings that are not NaN, with scipy.signal.lfilter
+    '''
+    import numpy as np
+    from scipy.signal import lfilter
+
+    averages = np.empty((len(factors),len(readings)))
+    for ii,factor in enumerate(factors):
+        averages[ii],_ = lfilter([1.-factor],[1.,-factor],readings,zi=[factor*initial])
+    return averages
+
+def _ema_scan(readings,factors,initial):
+    '''
+    ema_grid() of the readings that are not NaN, with numpy
+    The recurrence y[n] = a*y[n-1] + b[n] is combined over doubling strides (Hillis-Steele scan), so there
+        are log2(len(readings)) array operations instead of a python loop over the readings
+    '''
+    import numpy as np
+
+    factors = np.asarray(factors,dtype=float)[:,None]
+    a = np.repeat(factors,len(readings),axis=1)
+    b = (1.-factors) * readings[None,:]
+    stride = 1
+    while stride < len(readings):
+        b[:,stride:] = a[:,stride:] * b[:,:-stride] + b[:,stride:]
+        a[:,stride:] = a[:,stride:] * a[:,:-stride]
+        stride *= 2
+    return a*initial + b
+
+def ema_grid(readings,factors,initial=None,method="auto"):
+    '''
+    Returns a 2D numpy array with the moving average of readings for each factor, one row per factor
+    readings: 1D array like, NaN (or None) for a failed reading, which keeps the previous average as the sensors do
+    factors: 1D array like of average factors in [0,1)
+    initial: None or float, the average before the first reading, ie 7.0 to match Sensor_ph.ph_avg.
+                If None the average starts at the first reading
+    method: str, "scipy", "numpy", or "auto" to use scipy if it is installed
+    '''
+    import numpy as np
+
+    readings = np.asarray(readings,dtype=float)
+    factors = np.asarray(factors,dtype=float)
+    valid = np.isfinite(readings)
+    if not np.any(valid):
+        return np.full((len(factors),len(readings)),np.nan if initial is None else initial)
+    values = readings[valid]
+    if initial is None:
+        initial = values[0]
+
+    if method == "auto":
+        try:
+            import scipy.signal
+            method = "scipy"
+        except ImportError:
+            method = "numpy"
+    if method == "scipy":
+        averages = _ema_lfilter(values,factors,initial)
+    elif method == "numpy":
+        averages = _ema_scan(values,factors,initial)
+    else:
+        raise ValueError("Unknown method {}, use auto, scipy or numpy".format(method))
+
+    # Failed readings keep the average of the last good one, and the initial value before the first
+    last_valid = np.cumsum(valid) - 1
+    averages = np.concatenate([np.full((len(factors),1),initial),averages],axis=1)
+    return averages[:,last_valid+1]
+
+def _centered_mean(values,width):
+    '''
+    Centered rolling mean of the last axis of values over width samples, ignoring NaN
+    '''
+    import numpy as np
+
+    valid = np.isfinite(values)
+    pad = [(0,0)]*(values.ndim-1) + [(1,0)]
+    sums = np.pad(np.cumsum(np.where(valid,values,0.),axis=-1),pad)
+    counts = np.pad(np.cumsum(valid,axis=-1),pad)
+    n = values.shape[-1]
+    lower = np.clip(np.arange(n) - width//2,0,n)
+    upper = np.clip(np.arange(n) + width - width//2,0,n)
+    with np.errstate(invalid="ignore",divide="ignore"):
+        return (sums[...,upper] - sums[...,lower]) / (counts[...,upper] - counts[...,lower])
+
+def refilter_report(times,readings,factors,initial=None,window=1800.,method="auto"):
+    '''
+    Returns a list of dicts, one per factor, of how the moving average with that factor would have behaved
+        factor, time_constant_s, delay_s, noise, swing, tracking_error: see the module docstring
+    times: 1D array like of the epochs of the readings
+    readings, factors, initial, method: see ema_grid()
+    window: float, seconds of the centered rolling mean the residual noise is measured around
+    '''
+    import numpy as np
+
+    times = np.asarray(times,dtype=float)
+    readings = np.asarray(readings,dtype=float)
+    factors = np.asarray(factors,dtype=float)
+    every = float(np.median(np.diff(times))) if len(times) > 1 else float("nan")
+    width = max(int(round(window / every)),1) if np.isfinite(every) and every > 0 else 1
+
+    averages = ema_grid(readings,factors,initial,method)
+    residual = averages - _centered_mean(averages,width)
+    tracking = averages - _centered_mean(readings,width)[None,:]
+    valid = np.isfinite(readings)
+
+    report = []
+    for ii,factor in enumerate(factors):
+        low,high = np.nanpercentile(residual[ii,valid],[5.,95.]) if np.any(valid) else (np.nan,np.nan)
+        report.append({"factor":float(factor),
+                        "time_constant_s":-every / np.log(factor) if 0. < factor < 1. else 0.,
+                        "delay_s":factor / (1.-factor) * every,
+                        "noise":float(np.nanstd(residual[ii,valid])) if np.any(valid) else float("nan"),
+                        "swing":float(high-low) / 2.,
+                        "tracking_error":float(np.sqrt(np.nanmean(tracking[ii,valid]**2))) if np.any(valid) else float("nan")})
+    return report
+
+def format_report(report):
+    '''
+    Return the report from refilter_report() as a text table
+    '''
+    lines = ["{:>8} {:>12} {:>10} {:>10} {:>10} {:>14}".format("factor","tau [s]","delay [s]","noise","+/- swing","tracking err")]
+    for row in report:
+        lines.append("{factor:>8.4f} {time_constant_s:>12.1f} {delay_s:>10.1f} {noise:>10.4f} {swing:>10.4f} {tracking_error:>14.4f}".format(**row))
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    from .data_access import Data_Store
+
+    parser = argparse.ArgumentParser(description="Recompute the moving average of recorded readings for a grid of average factors")
+    parser.add_argument("--data",required=True,help="directory of the recorded daily files")
+    parser.add_argument("--sensor",required=True,help="output_file_base of the recorded sensor, ie sensor_ph_bin1")
+    parser.add_argument("--column",default="ph_raw",help="raw column to average, ie ph_raw or voltage_raw")
+    parser.add_argument("--start",required=True,help="first day to load, YYYY-MM-DD")
+    parser.add_argument("--end",required=True,help="last day to load, YYYY-MM-DD")
+    parser.add_argument("--factors",default="0.8,0.9,0.95,0.98,0.99,0.995,0.999",help="comma separated average factors")
+    parser.add_argument("--initial",type=float,default=None,help="average before the first reading, ie 7.0 for ph_raw. Default is the first reading")
+    parser.add_argument("--window",type=float,default=30*60,help="seconds of the rolling mean the noise is measured around")
+    parser.add_argument("--method",default="auto",choices=["auto","scipy","numpy"])
+    parser.add_argument("--output",default=None,help="csv file to save the report to")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    start = datetime.datetime.strptime(args.start,"%Y-%m-%d").timestamp()
+    end = (datetime.datetime.strptime(args.end,"%Y-%m-%d") + datetime.timedelta(days=1)).timestamp()
+    df = Data_Store(args.data).load(args.sensor,start,end)
+    if len(df) == 0:
+        raise ValueError("No {} readings of {} between {} and {} in {}".format(args.column,args.sensor,args.start,args.end,args.data))
+    print("Loaded {} readings after {:.1f} s".format(len(df),time.time()-start_time))
+
+    factors = [float(factor) for factor in args.factors.split(",")]
+    report = refilter_report(df["time"].values,df[args.column].values,factors,
+                                initial=args.initial,
+                                window=args.window,
+                                method=args.method)
+    print(format_report(report))
+    print("Completed in {:.1f} s".format(time.time()-start_time))
+
+    if args.output is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)),exist_ok=True)
+        with open(args.output,'w') as fp:
+            fp.write(",".join(report[0].keys()) + "\n")
+            for row in report:
+                fp.write(",".join(str(value) for value in row.values()) + "\n")
@@ -0,0 +1,230 @@
+'''
+Builds the sensors, pumps and controllers of any number of grow bins from a config file
+
+The config is json, or toml when tomllib (python 3.11+) or tomli is available:
+    {
+        "output_dir": "/home/pi/growControl_Data/",
+        "output_writer": {"batch_size": 50, "flush_every": 10.0},   optional, null to write rows directly
+        "executor_workers": 2,                                       optional, threads shared by the sensors that take an executor
+        "bins": [
+            {"name": "bin1",
+             "devices": [
+                {"name": "ph", "type": "Sensor_ph", "label": "pH Sensor", "params": {"read_every": 10.0, ...}},
+                {"name": "pump_up", "type": "Controllable_Pump", "params": {"gpio_pin": 27}},
+                {"name": "ph_controller", "type": "Controller_ph_Pump",
+                    "params": {"sensor_ph": "@ph", "pump_ph_up": "@pump_up", "pump_ph_down": "@pump_down", ...}}
+             ]}
+        ]
+    }
+Other keys of a device, ie "notes", are ignored. "params" are passed to the class of "type". A string "@<name>" refers to another device of the same bin,
+    "@<bin>/<name>" to a device of another bin; devices are built in order so it must come earlier.
+    output_file_path defaults to output_dir and output_file_base to <name>_<bin>. The shared output_writer,
+    output_rotation, clock and executor are passed to every class that takes them, unless the params set them.
+'''
+import inspect
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .clock import get_default_clock
+from .output_rotation import Output_Rotation
+from .output_writer import Output_Writer
+
+def device_types():
+    '''
+    Returns a dict of the name used for "type" in the config -> class
+    '''
+    from .sensor_ph import Sensor_ph
+    from .sensor_volume import Sensor_volume
+    from .sensor_humidity_temp import Sensor_humidity_temp
+    from .controllable_pump import Controllable_Pump
+    from .control_ph_pump import Controller_ph_Pump
+    from .control_volume_pump import Controller_Volume_Pump
+    return {"Sensor_ph":Sensor_ph,
+            "Sensor_volume":Sensor_volume,
+            "Sensor_humidity_temp":Sensor_humidity_temp,
+            "Controllable_Pump":Controllable_Pump,
+            "Controller_ph_Pump":Controller_ph_Pump,
+            "Controller_Volume_Pump":Controller_Volume_Pump}
+
+def load_config(path):
+    '''
+    Read the config file at path, .json or .toml
+    '''
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".json":
+        with open(path,'r') as fp:
+            return json.load(fp)
+    elif extension == ".toml":
+        try:
+            import tomllib
+        except ImportError:
+            try:
+                import tomli as tomllib
+            except ImportError:
+                raise ValueError("Reading {} needs python 3.11+ or the tomli package, or use a json config".format(path))
+        with open(path,'rb') as fp:
+            return tomllib.load(fp)
+    else:
+        raise ValueError("Invalid config file {}. Expected a .json or .toml file".format(path))
+
+class Registered_Device:
+    '''
+    A device built by the Registry, and how it is scheduled
+    '''
+    def __init__(self,bin_name,name,type_name,label,device):
+        '''
+        bin_name: str, name of the bin the device is in
+        name: str, name of the device in the bin
+        type_name: str, the "type" from the config
+        label: str, used in the UI
+        device: the instance
+        '''
+        self.bin_name = bin_name
+        self.name = name
+        self.type_name = type_name
+        self.label = label
+        self.device = device
+        self.key = "{}/{}".format(bin_name,name)
+
+        # Sensors are called every read_every, controllers every control_every after warmup_time. Pumps are not scheduled
+        self.every = getattr(device,"read_every",None) or getattr(device,"control_every",None)
+        self.delay = getattr(device,"warmup_time",0.)
+
+    def status(self):
+        '''
+        Returns a dict of the values shown in the UI, plain values so it can be sent from a worker process
+            key, label: as above
+            values: for sensors, list of (name, current, average) of its display_values, followed by
+                (name + " " + average name, current, average) for each of the sensor's extra_averages
+            last_action, last_action_time, last_loop_time: for controllers
+        '''
+        status = {"key":self.key,"label":self.label}
+        if hasattr(self.device,"display_values"):
+            status["values"] = [(name,getattr(self.device,current),getattr(self.device,average)) for name,current,average in self.device.display_values]
+            extra_averages = getattr(self.device,"extra_averages",{})
+            for name,current,average in self.device.display_values:
+                if average in extra_averages:
+                    for extra_name,value in extra_averages[average].values().items():
+                        status["values"].append(("{} {}".format(name,extra_name),getattr(self.device,current),value))
+        else:
+            for attribute in ["last_action","last_action_time","last_loop_time"]:
+                status[attribute] = getattr(self.device,attribute,None)
+        return status
+
+class Registry:
+    '''
+    Instantiates the devices described by a config, see the module docstring for the format
+    '''
+
+    def __init__(self,config,clock=None,verbose=False):
+        '''
+        config: dict, or path to a .json or .toml config file
+        clock: None or instance of Real_Clock or Virtual_Clock passed to all of the devices
+        verbose: Boolean, passed to the devices that do not set it in their params
+        '''
+        if isinstance(config,str):
+            config = load_config(config)
+        self.config = config
+        self.verbose = verbose
+        self.clock = clock if clock is not None else get_default_clock()
+        self.output_dir = config.get("output_dir","")
+
+        writer_config = config.get("output_writer",{})
+        self.output_writer = Output_Writer(**writer_config) if writer_config is not None else None
+        self.output_rotation = Output_Rotation(clock=self.clock)
+        self.executor = ThreadPoolExecutor(max_workers=config.get("executor_workers",2),thread_name_prefix="registry")
+
+        self.devices = [] # list of Registered_Device in the order they are in the config
+        self._by_key = {}
+        self._types = device_types()
+        for bin_config in config.get("bins",[]):
+            for device_config in bin_config.get("devices",[]):
+                self._build(bin_config["name"],device_config)
+
+    def __getitem__(self,key):
+        '''
+        Returns the device instance for "<bin>/<name>"
+        '''
+        return self._by_key[key].device
+
+    def scheduled(self):
+        '''
+        Returns the Registered_Device of the sensors and controllers, the devices that are called periodically
+        '''
+        return [entry for entry in self.devices if entry.every]
+
+    def of_type(self,type_name):
+        '''
+        Returns the Registered_Device of every device of type_name, ie "Sensor_ph"
+        '''
+        return [entry for entry in self.devices if entry.type_name == type_name]
+
+    def schedule(self,scheduler,wrap=None):
+        '''
+        Add every sensor and controller to scheduler
+        wrap: None or function(Registered_Device) returning the callable to schedule in place of the device
+        '''
+        for entry in self.scheduled():
+            device = entry.device if wrap is None else wrap(entry)
+            scheduler.add(device,entry.every,delay=entry.delay,name=entry.key, # the label is only for display, it need not be unique
+                            read_latency=getattr(entry.device,"read_latency",None))
+
+    def close(self):
+        '''
+        Turn off the pumps, release the pins of the sensors, wait for running reads, write the partial rollups and everything queued
+        '''
+        pumps = [entry for entry in self.devices if entry.type_name == "Controllable_Pump"]
+        others = [entry for entry in self.devices if entry.type_name != "Controllable_Pump"]
+        for entry in pumps + others:
+            if hasattr(entry.device,"cleanup"):
+                entry.device.cleanup()
+        self.executor.shutdown(wait=True)
+        for entry in self.devices:
+            rollup = getattr(entry.device,"rollup",None)
+            if rollup is not None:
+                rollup.close()
+        if self.output_writer is not None:
+            self.output_writer.close()
+
+    def _build(self,bin_name,device_config):
+        '''
+        Instantiate one device of bin_name
+        '''
+        name = device_config["name"]
+        type_name = device_config["type"]
+        if type_name not in self._types:
+            raise ValueError("Invalid device type {} for {}/{}. Expected one of {}".format(type_name,bin_name,name,list(self._types.keys())))
+        cls = self._types[type_name]
+        accepted = inspect.signature(cls.__init__).parameters
+
+        params = {key:self._resolve(bin_name,value) for key,value in device_config.get("params",{}).items()}
+        defaults = {"output_file_path":self.output_dir,
+                    "output_file_base":"{}_{}".format(name,bin_name),
+                    "output_writer":self.output_writer,
+                    "output_rotation":self.output_rotation,
+                    "clock":self.clock,
+                    "executor":self.executor,
+                    "verbose":self.verbose}
+        for key,value in defaults.items():
+            if key in accepted and key not in params:
+                params[key] = value
+
+        device = cls(**params)
+        label = device_config.get("label","{} {}".format(bin_name,name))
+        entry = Registered_Device(bin_name,name,type_name,label,device)
+        if entry.key in self._by_key:
+            raise ValueError("Device {} is defined more than once".format(entry.key))
+        self.devices.append(entry)
+        self._by_key[entry.key] = entry
+
+    def _resolve(self,bin_name,value):
+        '''
+        Replace a "@<name>" or "@<bin>/<name>" reference with the device
+        '''
+        if isinstance(value,str) and value.startswith("@"):
+            key = value[1:] if "/" in value else "{}/{}".format(bin_name,value[1:])
+            if key not in self._by_key:
+                raise ValueError("Unknown device {} in bin {}, devices must be defined before they are used".format(value,bin_name))
+            return self._by_key[key].device
+        return value
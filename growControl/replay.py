@@ -0,0 +1,260 @@
+'''
+Replays recorded sensor data through the sensors and controllers on a Virtual_Clock
+
+The raw column of the recorded daily csv files (voltage_raw of Sensor_ph, pulse_duration_raw of Sensor_volume)
+    is fed back through new sensors, and the controllers act on the sensors as they would have at the time.
+    Nothing sleeps, so months of data replay in seconds. The sensors and controllers write their output files
+    to a separate directory, dated by the recorded time, and the control actions are collected in Replay.actions.
+
+    python -m growControl.replay --data <data dir> --output <replay dir> --start 2021-01-01 --end 2021-03-01 \
+        --ph sensor_ph_bin1 --ph-calibration <calibration json>
+'''
+import argparse
+import datetime
+import heapq
+import itertools
+import os
+import time
+
+from .clock import Virtual_Clock
+from .calibration_store import Calibration_Store
+from .csv_input import Csv_Input
+from .output_rotation import Output_Rotation
+from .output_writer import Output_Writer
+
+class Replay_Source:
+    '''
+    The recorded readings of one sensor, passed to the sensor as its csv input
+
+    The replay moves the source to the next recorded row with advance(), the sensor gets the value of the
+        current row from read() as it would from a Csv_Input. Rows outside of start and end are skipped
+    '''
+
+    def __init__(self,paths,column,start=None,end=None,use_mmap=False):
+        '''
+        paths: list of str, recorded csv output files of the sensor in time order, ie from Data_Store.files()
+        column: str, the raw column to replay, ie "voltage_raw"
+        start, end: None or float epochs, only replay the rows between these times
+        use_mmap: Boolean, memory map the files, see Csv_Input
+        '''
+        self.column = column
+        self.start = start
+        self.end = end
+        self.rows = 0 # number of rows replayed
+        self.value = None # value of the current row
+        self._input = Csv_Input(paths,columns=["time",column],end_of_file="stop",use_mmap=use_mmap)
+
+    def advance(self):
+        '''
+        Move to the next recorded row in range
+        Returns the epoch of the row, or None when there are no more rows
+        '''
+        while True:
+            try:
+                epoch,value = self._input.read()
+            except EOFError:
+                self._input.close()
+                return None
+            if epoch is None or (self.start is not None and epoch < self.start):
+                continue
+            if self.end is not None and epoch > self.end:
+                self._input.close()
+                return None
+            self.value = value
+            self.rows += 1
+            return epoch
+
+    def read(self):
+        '''
+        Return the current row as a list with the recorded value, called by the sensor in place of Csv_Input.read()
+        '''
+        return [self.value]
+
+class Replay:
+    '''
+    Steps the sensors and controllers through the recorded data in time order
+
+    Create the Replay, then the sensors with csv=<Replay_Source>, read_every=0 and the keyword arguments from
+        device_kwargs(), then the controllers with pumps using the replay clock. Register them with add_sensor()
+        and add_controller(), and run(). For each recorded row the clock is set to the time of the row, the
+        sensor is read and every controller is called.
+    '''
+
+    def __init__(self,output_path,start,batch_size=5000,verbose=False):
+        '''
+        output_path: str, directory the sensors and controllers of the replay write to
+        start: float epoch, the time the clock starts at. Rows before this are skipped
+        batch_size: int > 0, rows the Output_Writer of the replay batches before writing
+        verbose: Boolean, Output the control actions as they are taken
+        '''
+        self.output_path = output_path
+        os.makedirs(self.output_path,exist_ok=True)
+        self.verbose = verbose
+        self.clock = Virtual_Clock(start=start)
+        self.output_rotation = Output_Rotation(clock=self.clock)
+        self.output_writer = Output_Writer(batch_size=batch_size,flush_every=60.)
+
+        self.sensors = [] # list of (sensor, Replay_Source)
+        self.controllers = []
+        self.actions = [] # list of (epoch, controller output_file_base, action, volume in ml)
+
+    def device_kwargs(self):
+        '''
+        Returns the keyword arguments to create the replay's sensors and controllers with
+        '''
+        return {"clock":self.clock,
+                "output_writer":self.output_writer,
+                "output_rotation":self.output_rotation}
+
+    def add_sensor(self,sensor,source):
+        '''
+        Replay the rows of source through sensor, sensor must have been created with csv=source
+        '''
+        self.sensors.append((sensor,source))
+
+    def add_controller(self,controller):
+        '''
+        Call controller after every recorded row
+        '''
+        self.controllers.append(controller)
+
+    def run(self):
+        '''
+        Replay all of the rows of all of the sources
+        Returns self.actions
+        '''
+        queue = [] # heap of (epoch, sequence, sensor, source)
+        sequence = itertools.count() # rows at the same time are replayed in the order the sensors were added
+        for sensor,source in self.sensors:
+            epoch = source.advance()
+            if epoch is not None:
+                heapq.heappush(queue,(epoch,next(sequence),sensor,source))
+
+        wall_start = time.time()
+        n_rows = 0
+        try:
+            while len(queue) > 0:
+                epoch,_,sensor,source = heapq.heappop(queue)
+                if epoch > self.clock.time():
+                    self.clock.advance_to(epoch)
+                sensor()
+                n_rows += 1
+                for controller in self.controllers:
+                    self._call_controller(controller)
+
+                epoch = source.advance()
+                if epoch is not None:
+                    heapq.heappush(queue,(epoch,next(sequence),sensor,source))
+        finally:
+            self.output_writer.flush()
+
+        if self.verbose:
+            print("Replay: replayed {} rows in {:.1f}s, {} control actions".format(n_rows,time.time()-wall_start,len(self.actions)))
+        return self.actions
+
+    def close(self):
+        '''
+        Write everything that is queued and close the output files
+        '''
+        self.output_writer.close()
+
+    def _call_controller(self,controller):
+        '''
+        Call controller and record the action it took, if any
+        '''
+        last_action_time = controller.last_action_time
+        controller()
+        if controller.last_action_time != last_action_time:
+            action = (controller.last_action_time,controller.output_file_base,controller.last_action,controller.dispense_volume)
+            self.actions.append(action)
+            if self.verbose:
+                t = datetime.datetime.strftime(datetime.datetime.fromtimestamp(action[0]),"%Y-%m-%d %H:%M:%S")
+                print("{} {}: {} {:.1f}ml".format(t,action[1],action[2],action[3]))
+
+def replay_files(data_path,sensor,start,end):
+    '''
+    Return the recorded csv files of sensor that can hold data between start and end, see Data_Store.files()
+    '''
+    from .data_access import Data_Store
+    return [path for path in Data_Store(data_path).files(sensor,start,end) if path.endswith(".csv")]
+
+if __name__ == "__main__":
+    from .sensor_ph import Sensor_ph
+    from .sensor_volume import Sensor_volume
+    from .controllable_pump import Controllable_Pump
+    from .control_ph_pump import Controller_ph_Pump
+    from .control_volume_pump import Controller_Volume_Pump
+
+    parser = argparse.ArgumentParser(description="Replay recorded sensor data through the controllers")
+    parser.add_argument("--data",required=True,help="directory of the recorded daily csv files")
+    parser.add_argument("--output",required=True,help="directory to write the replayed sensor and controller files to")
+    parser.add_argument("--start",required=True,help="first day to replay, YYYY-MM-DD")
+    parser.add_argument("--end",required=True,help="last day to replay, YYYY-MM-DD")
+    parser.add_argument("--ph",default=None,help="output_file_base of the recorded ph sensor, ie sensor_ph_bin1")
+    parser.add_argument("--ph-calibration",default=None,help="calibration json of the ph sensor. By default the one in effect at --start in the calibration store of --data")
+    parser.add_argument("--ph-min",type=float,default=5.8)
+    parser.add_argument("--ph-max",type=float,default=6.2)
+    parser.add_argument("--ph-average-factor",type=float,default=0.9)
+    parser.add_argument("--volume",default=None,help="output_file_base of the recorded volume sensor, ie sensor_volume")
+    parser.add_argument("--volume-calibration",default=None,help="calibration json of the volume sensor. By default the one in effect at --start in the calibration store of --data")
+    parser.add_argument("--volume-min",type=float,default=7.0)
+    parser.add_argument("--control-every",type=float,default=30*60)
+    parser.add_argument("--warmup-time",type=float,default=10*60)
+    args = parser.parse_args()
+
+    start = datetime.datetime.strptime(args.start,"%Y-%m-%d").timestamp()
+    end = (datetime.datetime.strptime(args.end,"%Y-%m-%d") + datetime.timedelta(days=1)).timestamp()
+    output_path = os.path.join(args.output,"")
+
+    calibration_store = Calibration_Store(args.data)
+    for sensor_class,sensor,option in [("Sensor_ph",args.ph,"ph_calibration"),("Sensor_volume",args.volume,"volume_calibration")]:
+        if sensor is not None and getattr(args,option) is None:
+            entry = calibration_store.lookup(sensor_class,sensor,start)
+            if entry is None:
+                raise ValueError("No calibration of {} before {} in {}, pass --{}".format(sensor,args.start,args.data,option.replace("_","-")))
+            setattr(args,option,entry["path"])
+
+    replay = Replay(output_path,start,verbose=True)
+    if args.ph is not None:
+        source = Replay_Source(replay_files(args.data,args.ph,start,end),"voltage_raw",start=start,end=end)
+        sensor_ph = Sensor_ph(output_path,args.ph,
+                                average_factor=args.ph_average_factor,
+                                read_every=0.,
+                                csv=source,
+                                calibration_file=args.ph_calibration,
+                                calibrate_on_startup=False,
+                                **replay.device_kwargs())
+        replay.add_sensor(sensor_ph,source)
+        controller = Controller_ph_Pump(sensor_ph,
+                                        Controllable_Pump(None,clock=replay.clock),
+                                        Controllable_Pump(None,clock=replay.clock),
+                                        output_path,"controller_ph_pump",
+                                        ph_min=args.ph_min,
+                                        ph_max=args.ph_max,
+                                        control_every=args.control_every,
+                                        warmup_time=args.warmup_time,
+                                        **replay.device_kwargs())
+        replay.add_controller(controller)
+    if args.volume is not None:
+        source = Replay_Source(replay_files(args.data,args.volume,start,end),"pulse_duration_raw",start=start,end=end)
+        sensor_volume = Sensor_volume(output_path,args.volume,
+                                        iterations_per_reading=1,
+                                        read_every=0.,
+                                        csv=source,
+                                        calibration_file=args.volume_calibration,
+                                        calibrate_on_startup=False,
+                                        **replay.device_kwargs())
+        replay.add_sensor(sensor_volume,source)
+        controller = Controller_Volume_Pump(sensor_volume,
+                                            Controllable_Pump(None,clock=replay.clock),
+                                            output_path,"controller_volume_pump",
+                                            volume_min=args.volume_min,
+                                            control_every=args.control_every,
+                                            warmup_time=args.warmup_time,
+                                            **replay.device_kwargs())
+        replay.add_controller(controller)
+
+    try:
+        replay.run()
+    finally:
+        replay.close()
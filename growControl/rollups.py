@@ -0,0 +1,142 @@
+import math
+import os
+
+from .output_writer import append_to_file
+from .output_rotation import get_default_output_rotation
+
+def rollup_label(resolution):
+    '''
+    Return the name used in the file names for a resolution in seconds, ie 60 -> "1min", 3600 -> "1hour"
+    '''
+    resolution = int(resolution)
+    if resolution % 3600 == 0:
+        return "{}hour".format(resolution // 3600)
+    elif resolution % 60 == 0:
+        return "{}min".format(resolution // 60)
+    return "{}s".format(resolution)
+
+def rollup_file_base(output_file_base,resolution):
+    '''
+    Return the output_file_base of the companion rollup files of a device, ie "sensor_ph_bin1_rollup_1min"
+    '''
+    return "{}_rollup_{}".format(output_file_base,rollup_label(resolution))
+
+class Rollup:
+    '''
+    Maintains min/max/mean/count aggregates of a device's readings at coarser resolutions
+
+    Every reading is folded into the open bucket of each resolution as it arrives, so no history is kept.
+        When a reading lands in a new bucket the finished bucket is written as one row of the companion
+        daily file <output_file_base>_rollup_<label>_<date>.csv and a new bucket is started.
+    The rows have the start of the bucket in the time column, then <column>_min, <column>_max,
+        <column>_mean, <column>_count for each column. Readings of None are not counted
+    close() writes the partial buckets. When the first reading after a restart lands in the bucket of the
+        last row of the file, that row is taken back and merged into the open bucket, so the bucket is written once
+    '''
+
+    def __init__(self,
+                output_file_path,
+                output_file_base,
+                columns,
+                resolutions=(60,3600),
+                output_writer=None,
+                output_rotation=None):
+        '''
+        output_file_path: path to where the rollup files should be saved
+        output_file_base: output_file_base of the device, the rollup files get _rollup_<label> appended to it
+        columns: list of str, names of the values passed to update()
+        resolutions: list of int, bucket sizes in seconds
+        output_writer: None or instance of Output_Writer. If given the rows are queued on it instead of written immediately
+        output_rotation: None or instance of Output_Rotation that manages the daily files. If None the default shared one is used
+        '''
+        self.columns = list(columns)
+        self.resolutions = list(resolutions)
+        self.output_writer = output_writer
+        self.output_rotation = output_rotation if output_rotation is not None else get_default_output_rotation()
+
+        header = "time," + ",".join("{0}_min,{0}_max,{0}_mean,{0}_count".format(column) for column in self.columns) + "\n"
+        self._output_file_keys = [self.output_rotation.register(output_file_path,rollup_file_base(output_file_base,resolution),header)
+                                    for resolution in self.resolutions]
+        self._buckets = [None for _ in self.resolutions] # start epoch of the open bucket of each resolution
+        self._stats = [self._empty_stats() for _ in self.resolutions] # per column [min,max,sum,count] of the open bucket
+
+    def update(self,epoch,values):
+        '''
+        Fold a reading into the open buckets, writing any bucket it closes
+        epoch: float, time of the reading
+        values: list of float or None, one per column
+        '''
+        for ii,resolution in enumerate(self.resolutions):
+            bucket = math.floor(epoch / resolution) * resolution
+            if bucket != self._buckets[ii]:
+                resume = self._buckets[ii] is None # first reading since startup or close()
+                self._write_bucket(ii)
+                self._buckets[ii] = bucket
+                self._stats[ii] = self._empty_stats()
+                if resume:
+                    self._resume_bucket(ii)
+
+            for stats,value in zip(self._stats[ii],values):
+                if value is None or value != value: # None or NaN
+                    continue
+                if stats[3] == 0:
+                    stats[0] = value
+                    stats[1] = value
+                else:
+                    stats[0] = min(stats[0],value)
+                    stats[1] = max(stats[1],value)
+                stats[2] += value
+                stats[3] += 1
+
+    def close(self):
+        '''
+        Write the buckets that are still open, ie on shutdown
+        '''
+        for ii in range(len(self.resolutions)):
+            self._write_bucket(ii)
+            self._buckets[ii] = None
+            self._stats[ii] = self._empty_stats()
+
+    def _resume_bucket(self,ii):
+        '''
+        Take back the last row of the file of resolution ii if it is the open bucket, ie the partial bucket
+            close() wrote before a restart. Its aggregates are merged into the open bucket and the row is removed
+        '''
+        output_file = self.output_rotation.get_output_file(self._output_file_keys[ii])
+        if not os.path.isfile(output_file):
+            return
+        with open(output_file,'rb+') as fp:
+            size = fp.seek(0,os.SEEK_END)
+            fp.seek(max(size - 4096,0))
+            lines = fp.read().splitlines(keepends=True)
+            if len(lines) < 2 or not lines[-1].endswith(b"\n"): # only the header, or a row that was cut off
+                return
+            row = lines[-1].decode("utf-8").strip().split(",")
+            try:
+                if float(row[0]) != self._buckets[ii] or len(row) != 1 + 4*len(self.columns):
+                    return
+            except ValueError: # the header
+                return
+
+            for jj,stats in enumerate(self._stats[ii]):
+                value_min,value_max,value_mean,count = row[1+4*jj:5+4*jj]
+                if int(count) > 0:
+                    stats[:] = [float(value_min),float(value_max),float(value_mean)*int(count),int(count)]
+            fp.truncate(size - len(lines[-1]))
+
+    def _empty_stats(self):
+        return [[None,None,0.,0] for _ in self.columns]
+
+    def _write_bucket(self,ii):
+        '''
+        Write the open bucket of resolution ii
+        '''
+        if self._buckets[ii] is None:
+            return
+        output = "{}".format(self._buckets[ii])
+        for value_min,value_max,value_sum,count in self._stats[ii]:
+            value_mean = value_sum / count if count > 0 else None
+            output += ",{},{},{},{}".format(value_min,value_max,value_mean,count)
+        output += "\n"
+        output_file = self.output_rotation.get_output_file(self._output_file_keys[ii])
+        append_to_file(output_file,output,self.output_writer)
@@ -0,0 +1,180 @@
+import heapq
+import itertools
+import time
+
+from .clock import get_default_clock
+from .latency import Latency_Histogram, dump_latency
+
+class Scheduled_Device:
+    '''
+    Holds a device in the Scheduler and the statistics of how well it has been kept on time
+    '''
+    def __init__(self,device,every,name,read_latency=None):
+        '''
+        device: callable, the sensor, controller, or function to call
+        every: float > 0, number of seconds between calls
+        name: str, used when reporting
+        read_latency: None or Latency_Histogram the device records the reads it runs off of the loop in, ie on an executor
+        '''
+        self.device = device
+        self.every = every
+        self.name = name
+        self.next_due = None # clock.monotonic() time the device is next due to be called
+        self.retrying = False # True while the device is called again because it returned False when it was due
+        self.calls = 0 # number of times the device has been called
+        self.missed_deadlines = 0 # number of calls that started more than late_tolerance after they were due
+        self.max_late = 0. # seconds, the latest a call has started after it was due
+        self.latency = Latency_Histogram() # how long the calls take, a device that returns False was not due and did no work
+        self.read_latency = read_latency
+
+class Scheduler:
+    '''
+    Calls each sensor and controller when it is due instead of every device every loop
+
+    The devices are kept in a priority queue keyed by the time they are next due. The caller
+        sleeps for time_until_next() (or waits that long for a key press), then calls run_pending().
+        After a device is called it is next due every seconds after its last deadline, so the calls do not
+        drift later by the time each call takes. Deadlines that already passed are skipped rather than run back to back.
+    A device that returns False took no new reading, ie its own read_every check was not satisfied yet or a read is
+        still running. It is called again retry_time seconds later instead of waiting for its next deadline.
+    A call that starts more than late_tolerance seconds after it was due is counted as a missed deadline.
+    Every call is timed into the Latency_Histogram of the device, see latency_summary() and dump_latency().
+        A device that only submits its read to an executor, ie Sensor_humidity_temp, times the read itself in
+        its read_latency, which is reported as "<name> read" so the stalls moved off of the loop are still seen.
+    '''
+
+    def __init__(self,late_tolerance=0.5,retry_time=0.1,clock=None,verbose=False):
+        '''
+        late_tolerance: float >= 0, seconds a call may start after it is due before it counts as a missed deadline
+        retry_time: float > 0, seconds until a device that returned False is called again
+        clock: None or instance of Real_Clock or Virtual_Clock. The due times are kept on its monotonic() time. If None the default Real_Clock is used
+        verbose: Boolean, Output missed deadlines to standard out
+        '''
+        self.late_tolerance = late_tolerance
+        self.retry_time = retry_time
+        self.clock = clock if clock is not None else get_default_clock()
+        self.verbose = verbose
+        self.devices = []
+        self.missed_deadlines = 0
+        self._queue = [] # heap of (next_due, sequence, Scheduled_Device)
+        self._sequence = itertools.count() # breaks ties between devices due at the same time
+
+    def add(self,device,every,delay=0.,name=None,read_latency=None):
+        '''
+        Add a device to be called every <every> seconds
+        device: callable, the sensor, controller, or function to call
+        every: float > 0, number of seconds between calls, normally the read_every or control_every of the device
+        delay: float >= 0, seconds from now until the first call, ie the warmup_time of a controller
+        name: str, used when reporting. Defaults to the class name of the device
+        read_latency: None or Latency_Histogram of the reads of the device. Defaults to device.read_latency if it has one
+        Returns the Scheduled_Device
+        '''
+        if every <= 0:
+            raise ValueError("Scheduler: every must be greater than 0, got {}".format(every))
+        if name is None:
+            name = getattr(device,"__name__",device.__class__.__name__)
+        if read_latency is None:
+            read_latency = getattr(device,"read_latency",None)
+        entry = Scheduled_Device(device,every,name,read_latency)
+        self.devices.append(entry)
+        self._push(entry,self.clock.monotonic() + delay)
+        return entry
+
+    def time_until_next(self):
+        '''
+        Seconds until the next device is due, 0 if one is already due, None if nothing is scheduled
+        '''
+        if len(self._queue) == 0:
+            return None
+        return max(self._queue[0][0] - self.clock.monotonic(),0.)
+
+    def run_pending(self):
+        '''
+        Call every device that is due
+        Returns the number of devices that were called
+        '''
+        n_called = 0
+        now = self.clock.monotonic()
+        while len(self._queue) > 0 and self._queue[0][0] <= now:
+            due,_,entry = heapq.heappop(self._queue)
+
+            if not entry.retrying: # a retry is only as late as the deadline it retries
+                late = now - due
+                entry.max_late = max(entry.max_late,late)
+                if late > self.late_tolerance:
+                    entry.missed_deadlines += 1
+                    self.missed_deadlines += 1
+                    if self.verbose:
+                        print("Scheduler: {} started {:.3f}s late".format(entry.name,late))
+
+            result = None
+            start = time.perf_counter()
+            try:
+                result = entry.device()
+            finally:
+                entry.latency.record(time.perf_counter() - start,did_work=result is not False)
+                entry.calls += 1
+                n_called += 1
+                self._reschedule(entry,result is False)
+            now = self.clock.monotonic()
+        return n_called
+
+    def latency_summary(self):
+        '''
+        Returns a dict of device name -> summary of its Latency_Histogram, and "<name> read" -> summary of its read_latency
+        '''
+        return {name:histogram.summary() for name,histogram in self._histograms().items()}
+
+    def dump_latency(self,path):
+        '''
+        Write the latency summary of every device to the json file at path
+        '''
+        dump_latency(path,self._histograms())
+
+    def _histograms(self):
+        '''
+        Returns a dict of name -> Latency_Histogram of the calls, and of the reads of the devices that have read_latency
+        '''
+        histograms = {}
+        for entry in self.devices:
+            histograms[entry.name] = entry.latency
+            if entry.read_latency is not None:
+                histograms[entry.name + " read"] = entry.read_latency
+        return histograms
+
+    def run_forever(self):
+        '''
+        Call the devices as they are due, sleeping in between. Only returns on an exception
+        '''
+        while True:
+            self.run_pending()
+            timeout = self.time_until_next()
+            if timeout is None:
+                return
+            self.clock.sleep(timeout)
+
+    def _reschedule(self,entry,retry):
+        '''
+        Put entry back in the queue after it was called
+        retry: Boolean, the device returned False and is called again retry_time from now,
+            unless that is after its next deadline
+        '''
+        now = self.clock.monotonic()
+        next_due = entry.next_due + entry.every
+        if next_due < now: # skip the deadlines that passed while the device was late or running
+            next_due += (int((now - next_due) / entry.every) + 1) * entry.every
+
+        retry_due = now + self.retry_time
+        if retry and retry_due < next_due:
+            entry.retrying = True
+            heapq.heappush(self._queue,(retry_due,next(self._sequence),entry))
+        else:
+            entry.retrying = False
+            self._push(entry,next_due)
+
+    def _push(self,entry,next_due):
+        '''
+        Put entry in the queue to be called at next_due
+        '''
+        entry.next_due = next_due
+        heapq.heappush(self._queue,(next_due,next(self._sequence),entry))
@@ -4,16 +4,21 @@ import os
 import sys
 import time
 
-try:
-    import Adafruit_DHT
-except:
-    print("In sensor_humidity_temp: Unable to import Adafruit_DHT" +\
-           "\tWill only able to run in csv mode!")
+from .output_writer import append_to_file, format_output_row, output_file_header, STORAGE_EXTENSIONS
+from .output_rotation import get_default_output_rotation
+from .clock import get_default_clock
+from .csv_input import Csv_Input
+from .rollups import Rollup
+from .ema_filter import Ema_Filter, Ema_Filter_Bank
+from .latency import Latency_Histogram
+from . import hardware
 
 class Sensor_humidity_temp:
     '''
     Read the temperature and humidity from a DHT11 or DHT22 sensor
     '''
+    output_header = "time,datetime_timezone,relative_humidity_raw,relative_humidity_average,temperature_raw,temperature_average\n"
+    display_values = [("Temperature","temp_raw","temp_avg"),("Humidity","humidity_raw","humidity_avg")] # (name, current attribute, average attribute) shown in the UI
     def __init__(self,
                 gpio_pin,
                 output_file_path,
@@ -22,6 +27,15 @@ class Sensor_humidity_temp:
                 average_factor_temp=0.9,
                 average_factor_humidity=0.9,
                 csv=None,
+                executor=None,
+                average_time_constant_temp=None,
+                average_time_constant_humidity=None,
+                extra_averages=None,
+                storage="csv",
+                rollups=False,
+                output_writer=None,
+                output_rotation=None,
+                clock=None,
                 verbose=False):
         '''
         gpio_pin: The pin to read from
@@ -35,17 +49,48 @@ class Sensor_humidity_temp:
         average_factor_humidity: [Float,Float), How much emphasis is put on old vs new data. Higher value will do better with more noise, but it will lag more
             if the humidity changes quickly
         csv: Path to file containting raw readings, used for debugging. Must have 2 values per row separated by a comma, first is humidity, second is temperature
-            File must end with a new line, and not have excess blank rows.
+            A list of paths is read one after the other, or pass an instance of Csv_Input to replay the
+            relative_humidity_raw and temperature_raw columns of recorded output files or to loop or hold at the end of the input
+        executor: None or concurrent.futures.Executor. If given the sensor is read on the executor so the slow
+            retries of the DHT do not block the caller. The result is folded into the averages and written
+            to the output file as soon as the read completes. Sharing a ThreadPoolExecutor with max_workers>1
+            between sensors lets them be read at the same time
+        average_time_constant_temp: None or float > 0, seconds. If given the temperature average is weighted by the time between
+                            readings with this time constant and starts at the first reading, instead of using average_factor_temp, see Ema_Filter
+        average_time_constant_humidity: None or float > 0, seconds. Same as average_time_constant_temp for the humidity average
+        extra_averages: None or dict of name -> time constant in seconds. Also keep these averages of the temperature and humidity,
+                            available as self.extra_averages["temp_avg"][name] and self.extra_averages["humidity_avg"][name], see Ema_Filter_Bank
+        storage: str, format of the output files. "csv" for text files, "binary" for fixed width float64 records, see binary_storage
+        rollups: Boolean, Also keep 1 minute and 1 hour min/max/mean/count rollups of the readings in companion files, see Rollup
+        output_writer: None or instance of Output_Writer. If given the output rows are queued on it instead of written immediately
+        output_rotation: None or instance of Output_Rotation that manages the daily output files. If None the default shared one is used
+        clock: None or instance of Real_Clock or Virtual_Clock used for the read_every checks and timestamps. If None the default Real_Clock is used
         verbose: Output the reading whenever one is taken 
         '''
 
+        self.output_writer = output_writer
+        self.clock = clock if clock is not None else get_default_clock()
         self.output_file_path = output_file_path
         self.output_file_base = output_file_base
         os.makedirs(os.path.dirname(self.output_file_path),exist_ok=True)
+        self.output_rotation = output_rotation if output_rotation is not None else get_default_output_rotation()
+        self.storage = storage
+        self._output_file_key = self.output_rotation.register(self.output_file_path,
+                                                                self.output_file_base,
+                                                                output_file_header(self.output_header,self.storage),
+                                                                extension=STORAGE_EXTENSIONS[self.storage])
+        self.rollup = None
+        if rollups:
+            columns = [column.strip() for column in self.output_header.strip().split(",")[2:]]
+            self.rollup = Rollup(self.output_file_path,self.output_file_base,columns,
+                                    output_writer=self.output_writer,
+                                    output_rotation=self.output_rotation)
         self.update_output_file_path()
 
         self.average_factor_temp = average_factor_temp
         self.average_factor_humidity = average_factor_humidity
+        self.average_time_constant_temp = average_time_constant_temp
+        self.average_time_constant_humidity = average_time_constant_humidity
         self.read_every = read_every # seconds, minimum time between readings
 
         self.verbose = verbose
@@ -53,6 +98,9 @@ class Sensor_humidity_temp:
         self.gpio_pin = gpio_pin
         self.retries = 15 # number of times to try and read the sensor
         self.retry_pause = 0.1 # Time to wait between retries
+        self.executor = executor
+        self.pending_read = None # Future of the read running on the executor
+        self.read_latency = Latency_Histogram() # how long the reads take, wherever they run
         
         if csv is None:
             self._initialize_sensor()
@@ -60,64 +108,59 @@ class Sensor_humidity_temp:
             self._initialize_csv(csv)
 
         self.temp_raw = None
-        self.humidiy_raw = None
-        self.temp_avg = 20. # initialize to 20 degrees C
-        self.humidity_avg = 50. # initialize to 50% relative humidity
+        self.humidity_raw = None
+        if self.average_time_constant_temp is None:
+            self.temp_filter = Ema_Filter(factor=self.average_factor_temp,initial=20.) # initialize to 20 degrees C
+        else: # None until the first reading
+            self.temp_filter = Ema_Filter(time_constant=self.average_time_constant_temp)
+        if self.average_time_constant_humidity is None:
+            self.humidity_filter = Ema_Filter(factor=self.average_factor_humidity,initial=50.) # initialize to 50% relative humidity
+        else: # None until the first reading
+            self.humidity_filter = Ema_Filter(time_constant=self.average_time_constant_humidity)
+        self.temp_avg = self.temp_filter.value
+        self.humidity_avg = self.humidity_filter.value
+        extra_averages = extra_averages if extra_averages is not None else {}
+        self.extra_averages = {"temp_avg":Ema_Filter_Bank(extra_averages),"humidity_avg":Ema_Filter_Bank(extra_averages)}
 
-        self.last_reading_temp = time.time() - self.read_every - 1 # make it so imediatly the data is out of date to force reading
-        self.last_reading_humidity = time.time() - self.read_every - 1 # make it so imediatly the data is out of date to force reading
+        self.last_reading_temp = self.clock.time() - self.read_every - 1 # make it so imediatly the data is out of date to force reading
+        self.last_reading_humidity = self.clock.time() - self.read_every - 1 # make it so imediatly the data is out of date to force reading
 
     def update_output_file_path(self):
         '''
-        Updates the property self.output_file
-        Checks to see if the file <self.output_file_path> + <self.output_file_base> + <date in YYYY-MM-DD format> .csv
-            If it does:
-                do nothing
-            If it does not exist:
-                create it and initialize the header
+        Updates the property self.output_file to the file for the current day
+            <self.output_file_path> + <self.output_file_base> + <date in YYYY-MM-DD format> .csv
+        The file is created and the header written by self.output_rotation when the day changes
         '''
-
-        date = datetime.date.today().isoformat()
-        self.output_file = os.path.join(self.output_file_path,"{}_{}.csv".format(self.output_file_base,date))
-        if not os.path.isfile(self.output_file):
-            with open(self.output_file,'a') as fp:
-                fp.write("time,datetime_timezone,relative_humidity_raw,relative_humidity_average,temperature_raw,temperature_average\n")
+        self.output_file = self.output_rotation.get_output_file(self._output_file_key)
 
     def _initialize_csv(self,csv):
         '''
-        Read in all the data from the csv file, set up self to read from csv instead of sensor
-        csv: path to valid csv file with mock readings
-        '''
-        with open(csv,'r') as fp:
-            data = fp.readlines()
-        self.csv_data = []
-        for line in data:
-            humidity,temp = line.strip().split(",")
-            humidity = float(humidity) if humidity != 'None' else None
-            temp = float(temp) if temp != 'None' else None
-            self.csv_data.append((humidity,temp))
-        self.csv_current_position = 0
+        Set up self to read from csv instead of sensor. The rows are streamed from the file, see Csv_Input
+        csv: path or list of paths to valid csv files with mock readings, or an instance of Csv_Input or Replay_Source
+        '''
+        self.csv_input = csv if hasattr(csv,"read") else Csv_Input(csv)
         self._read = self._read_csv
 
     def _read_csv(self):
         '''
         Return the next value from a csv
         This lets us test without needing the sensor hooked up
+        Raises EOFError at the end of the input unless the Csv_Input loops or holds
         '''
-        value = self.csv_data[self.csv_current_position]
-        self.csv_current_position += 1
-        return value
+        humidity,temp = self.csv_input.read()
+        return (humidity,temp)
 
     def _initialize_sensor(self):
         '''
         Initialize the interface for the sensor
         '''
+        self._dht = hardware.dht("Sensor_humidity_temp")
         if self.sensor_model == "DHT11":
-            self._sensor = Adafruit_DHT.DHT11
+            self._sensor = self._dht.DHT11
         elif self.sensor_model == "DHT22":
-            self._sensor = Adafruit_DHT.DHT22
+            self._sensor = self._dht.DHT22
         elif self.sensor_model == "AM2302":
-            self._sensor = Adafruit_DHT.AM2302
+            self._sensor = self._dht.AM2302
         else:
             raise ValueError("Invalid sensor_model {}. Expected DHT11, DHT22, or AM2302".format(self.sensor_model))
 
@@ -130,7 +173,7 @@ class Sensor_humidity_temp:
             If it fails to read then returns (None,None)
         '''
         try:
-            humidity,temp = Adafruit_DHT.read_retry(self._sensor,
+            humidity,temp = self._dht.read_retry(self._sensor,
                                             self.gpio_pin,
                                             retries=self.retries,
                                             delay_seconds=self.retry_pause)
@@ -145,39 +188,71 @@ class Sensor_humidity_temp:
     def __call__(self):
         '''
         Reads the sensor
+        If an executor was given the read is submitted to it and this returns without waiting for the result
+        Returns True if the sensor was read or a read was submitted, False if it was not due yet or a read is still running
+        An exception raised by a read on the executor is raised here on the next call, as it would be without an executor
         '''
+        if (self.pending_read is not None) and self.pending_read.done():
+            pending_read,self.pending_read = self.pending_read,None
+            pending_read.result()
 
-        current_time = time.time()
+        current_time = self.clock.time()
         # check to the see if the oldest reading is out of date
         if current_time - self.read_every < min(self.last_reading_temp,self.last_reading_humidity):
-            return
+            return False
+
+        if self.executor is None:
+            self._read_and_update(current_time)
+        elif self.pending_read is None:
+            self.pending_read = self.executor.submit(self._read_and_update,current_time)
+        else:
+            return False
+        return True
+
+    def _read_and_update(self,current_time):
+        '''
+        Read the sensor, update the moving averages, and write the output
+        The time it takes is recorded in self.read_latency, on the executor the call to __call__ only submits it
+        current_time: epoch the reading was requested at
+        '''
+        start = time.perf_counter()
+        try:
+            self._update(current_time)
+        finally:
+            self.read_latency.record(time.perf_counter() - start)
 
+    def _update(self,current_time):
+        '''
+        Read the sensor, update the moving averages, and write the output, see _read_and_update()
+        '''
         self.update_output_file_path() # Starts a new output file every day
 
-        self.humidity_raw,self.temp_raw = self._read()
+        humidity_raw,temp_raw = self._read()
+        self.humidity_raw,self.temp_raw = humidity_raw,temp_raw
 
-        if self.humidity_raw is not None:
-            self.humidity_avg = self.humidity_avg * self.average_factor_humidity + self.humidity_raw * (1-self.average_factor_humidity)
+        if humidity_raw is not None:
+            self.humidity_avg = self.humidity_filter.update(humidity_raw,current_time)
+            self.extra_averages["humidity_avg"].update(humidity_raw,current_time)
             self.last_reading_humidity = current_time
-        if self.temp_raw is not None:
-            self.temp_avg = self.temp_avg * self.average_factor_temp + self.temp_raw * (1-self.average_factor_temp)
+        if temp_raw is not None:
+            self.temp_avg = self.temp_filter.update(temp_raw,current_time)
+            self.extra_averages["temp_avg"].update(temp_raw,current_time)
             self.last_reading_temp = current_time
 
-        output = "{},{},".format(time.time(),datetime.datetime.now().astimezone())
-        output += "{},{},".format(self.humidity_raw,self.humidity_avg)
-        output += "{},{}\n".format(self.temp_raw,self.temp_avg)
-        
-        with open(self.output_file,'a') as fp:
-            fp.write(output)
+        epoch = self.clock.time()
+        values = [humidity_raw,self.humidity_avg,temp_raw,self.temp_avg]
+        append_to_file(self.output_file,format_output_row(epoch,values,self.storage),self.output_writer)
+        if self.rollup is not None:
+            self.rollup.update(epoch,values)
 
         if self.verbose:
-            t = datetime.datetime.strftime(datetime.datetime.now(),"%m/%d %H:%M:%S")
+            t = datetime.datetime.strftime(datetime.datetime.fromtimestamp(self.clock.time()),"%m/%d %H:%M:%S")
             if self.humidity_raw is None:
-                print("{} Humidity: Current: ---- Average: {:.1f}".format(t,self.humidity_avg))
+                print("{} Humidity: Current: ---- Average: {}".format(t,"{:.1f}".format(self.humidity_avg) if self.humidity_avg is not None else "----"))
             else:
                 print("{} Humidity: Current: {:.1f} Average: {:.1f}".format(t,self.humidity_raw,self.humidity_avg))
             if self.temp_raw is None:
-                print("{}     Temp: Current: ---- Average: {:.1f}".format(t,self.temp_avg))
+                print("{}     Temp: Current: ---- Average: {}".format(t,"{:.1f}".format(self.temp_avg) if self.temp_avg is not None else "----"))
             else:
                 print("{}     Temp: Current: {:.1f} Average: {:.1f}".format(t,self.temp_raw,self.temp_avg))
 
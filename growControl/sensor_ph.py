@@ -5,21 +5,22 @@ import sys
 import time
 import json
 
-try:
-    import board
-    import busio
-    import adafruit_ads1x15.ads1115 as ADS
-    from adafruit_ads1x15.analog_in import AnalogIn
-    from adafruit_ads1x15.ads1x15 import Mode
-except:
-    print("Sensor_ph: Unable to import raspberry pi specific modules" +\
-           "\tWill only be able to run in csv mode!")
-        
+from .output_writer import append_to_file, format_output_row, output_file_header, STORAGE_EXTENSIONS
+from .output_rotation import get_default_output_rotation
+from .clock import get_default_clock
+from .csv_input import Csv_Input
+from .rollups import Rollup
+from .ema_filter import Ema_Filter, Ema_Filter_Bank
+from .calibration_store import Calibration_Store
+from .ads1115_bus import get_bus_manager
+
 
 class Sensor_ph:
     '''
     Defines a ph sensor and interface
     '''
+    output_header = "time,datetime_timezone,voltage_raw,voltage_avg,ph_raw,ph_avg\n"
+    display_values = [("pH","ph_raw","ph_avg")] # (name, current attribute, average attribute) shown in the UI
     
 
     def __init__(self,
@@ -30,6 +31,19 @@ class Sensor_ph:
                   csv=None,
                   calibration_file=None,
                   calibrate_on_startup=True,
+                  burst_samples=1,
+                  burst_sample_rate=128,
+                  outlier_rejection="mad",
+                  average_time_constant=None,
+                  extra_averages=None,
+                  bus_manager=None,
+                  ads1115_address=0x48,
+                  ads1115_pin=0,
+                  storage="csv",
+                  rollups=False,
+                  output_writer=None,
+                  output_rotation=None,
+                  clock=None,
                   verbose=False):
         '''
         Create the instance of the ph sensor
@@ -41,27 +55,76 @@ class Sensor_ph:
         csv: None or path ot csv file to use as a mock input.
                 If csv is not None then it must be a valid file path. This is only for debugging
                     the csv file is a file with rows of a single float which is a voltage corresponding to a ph value
-                    it should be the same as what data_stream.voltage would return
+                    it should be the same as what the ADS1115 would return
+                A list of paths is read one after the other, or pass an instance of Csv_Input to replay the
+                    voltage_raw column of recorded output files or to loop or hold at the end of the input
         calibration_file: None or path to json file with calibration data. The file must contain keys "m" and "b" with floats corresponding
-                            to the slope and y-intercept of the voltage vs ph plot
+                            to the slope and y-intercept of the voltage vs ph plot. If None the newest calibration of the sensor in
+                            the Calibration_Store of output_file_path is used
         calibrate_on_startup: Boolean, As for calibration to be done when the object is created
+        burst_samples: int >= 1, number of samples to take for each reading. When more than 1 the samples are taken
+                            back to back, outliers are rejected, and the robust average is the reading. The spread of
+                            the samples is recorded in the voltage_spread column of the output file
+        burst_sample_rate: int, ADS1115 data rate in samples/sec to use when burst_samples > 1. One of 8,16,32,64,128,250,475,860
+        outlier_rejection: str, How the burst is averaged, see robust_average()
+                            "mad": mean of the samples within 3.5 scaled median absolute deviations of the median
+                            "trimmed": mean of the samples after the highest and lowest 20% are removed
+        average_time_constant: None or float > 0, seconds. If given the averages are weighted by the time between readings
+                            with this time constant and start at the first reading, instead of using average_factor, see Ema_Filter
+        extra_averages: None or dict of name -> time constant in seconds. Also keep these averages of the ph, available
+                            as self.extra_averages["ph_avg"][name] for the UI and controllers, see Ema_Filter_Bank
+        bus_manager: None or instance of ADS1115_Bus_Manager the ADS1115 is read through. If None the shared manager of I2C bus 1 is used
+        ads1115_address: int, I2C address of the ADS1115 the probe is on, 0x48 to 0x4B
+        ads1115_pin: int 0-3, the single ended input of the ADS1115 the probe is on
+        storage: str, format of the output files. "csv" for text files, "binary" for fixed width float64 records, see binary_storage
+        rollups: Boolean, Also keep 1 minute and 1 hour min/max/mean/count rollups of the readings in companion files, see Rollup
+        output_writer: None or instance of Output_Writer. If given the output rows are queued on it instead of written immediately
+        output_rotation: None or instance of Output_Rotation that manages the daily output files. If None the default shared one is used
+        clock: None or instance of Real_Clock or Virtual_Clock used for the read_every checks, timestamps and calibration. If None the default Real_Clock is used
         verbose: Boolean, Output the data to standard out
         '''
         self.verbose = verbose
-
+        self.output_writer = output_writer
+
+        if burst_samples < 1:
+            raise ValueError("burst_samples must be at least 1, got {}".format(burst_samples))
+        if outlier_rejection not in ("mad","trimmed"):
+            raise ValueError("Invalid outlier_rejection {}. Expected 'mad' or 'trimmed'".format(outlier_rejection))
+        self.burst_samples = burst_samples
+        self.burst_sample_rate = burst_sample_rate
+        self.outlier_rejection = outlier_rejection
+        if self.burst_samples > 1:
+            self.output_header = self.output_header.replace("\n",",voltage_spread\n")
+
+        self.clock = clock if clock is not None else get_default_clock()
         self.output_file_path = output_file_path
         self.output_file_base = output_file_base
         os.makedirs(os.path.dirname(self.output_file_path),exist_ok=True)
+        self.output_rotation = output_rotation if output_rotation is not None else get_default_output_rotation()
+        self.storage = storage
+        self._output_file_key = self.output_rotation.register(self.output_file_path,
+                                                                self.output_file_base,
+                                                                output_file_header(self.output_header,self.storage),
+                                                                extension=STORAGE_EXTENSIONS[self.storage])
+        self.rollup = None
+        if rollups:
+            columns = [column.strip() for column in self.output_header.strip().split(",")[2:]]
+            self.rollup = Rollup(self.output_file_path,self.output_file_base,columns,
+                                    output_writer=self.output_writer,
+                                    output_rotation=self.output_rotation)
         self.update_output_file_path()     
+        self.calibration_store = Calibration_Store(self.output_file_path) # only read when no calibration_file is given
 
         # how much of the previous value to keep result = previous * average_factor + new * (1-average_factor)
         #   A larger value makes it slower to respond but is more noise resistant
         self.average_factor = average_factor
+        self.average_time_constant = average_time_constant
         self.read_every = read_every # seconds, minimum time between readings
 
         self.ads1115_gain =  8
-        self.ads1115_data_sample_rate =  8
-        self.ads1115_single_ended_input_pin = 0
+        self.ads1115_data_sample_rate =  8 if self.burst_samples == 1 else self.burst_sample_rate
+        self.ads1115_address = ads1115_address
+        self.ads1115_single_ended_input_pin = ads1115_pin
         
         ####
         # Intialzie everything
@@ -69,87 +132,78 @@ class Sensor_ph:
 
         # allow us to use a csv file as voltage input instead of the sensor for debugging
         if csv is None:
-            self._initialize_ads1115()
+            self._initialize_ads1115(bus_manager)
         else: # debugging
             self._initialize_csv(csv)
+
+        if self.burst_samples > 1:
+            self._read_single = self._read
+            self._read = self._read_burst
         
         if calibrate_on_startup:
             self.calibrate()
         else:
             self._load_calibration_params(calibration_file)
 
-        self.last_reading = time.time() - self.read_every - 1 # make it so imediatly the data is out of date to force reading
+        self.last_reading = self.clock.time() - self.read_every - 1 # make it so imediatly the data is out of date to force reading
 
         self.voltage_raw = None # initilize the value of the current voltage
-        self.voltage_avg = 0. # the average voltage value, initalize to 0.0 volts which is 7.0 ph
+        self.voltage_spread = None # spread of the samples in the last burst
         self.ph_raw = None # initilize the ph value
-        self.ph_avg = 7.0 # the averaged ph value, set to neutral ph
+        if self.average_time_constant is None:
+            self.voltage_filter = Ema_Filter(factor=self.average_factor,initial=0.) # initalize to 0.0 volts which is 7.0 ph
+            self.ph_filter = Ema_Filter(factor=self.average_factor,initial=7.0) # set to neutral ph
+        else: # None until the first reading
+            self.voltage_filter = Ema_Filter(time_constant=self.average_time_constant)
+            self.ph_filter = Ema_Filter(time_constant=self.average_time_constant)
+        self.voltage_avg = self.voltage_filter.value # the average voltage value
+        self.ph_avg = self.ph_filter.value # the averaged ph value
+        self.extra_averages = {"ph_avg":Ema_Filter_Bank(extra_averages if extra_averages is not None else {})}
 
     def update_output_file_path(self):
         '''
-        Updates the property self.output_file
-        Checks to see if the file <self.output_file_path> + <self.output_file_base> + <date in YYYY-MM-DD format> .csv
-            If it does:
-                do nothing
-            If it does not exist:
-                create it and initialize the header
+        Updates the property self.output_file to the file for the current day
+            <self.output_file_path> + <self.output_file_base> + <date in YYYY-MM-DD format> .csv
+        The file is created and the header written by self.output_rotation when the day changes
         '''
-
-        date = datetime.date.today().isoformat()
-        self.output_file = os.path.join(self.output_file_path,"{}_{}.csv".format(self.output_file_base,date))
-        if not os.path.isfile(self.output_file):
-            with open(self.output_file,'a') as fp:
-                fp.write("time,datetime_timezone,voltage_raw,voltage_avg,ph_raw,ph_avg\n")
+        self.output_file = self.output_rotation.get_output_file(self._output_file_key)
 
     def _initialize_csv(self,csv):
         '''
-        Read in all the data from the csv file, set up self to read from csv instead of sensor
-        csv: path to valid csv file with mock readings
+        Set up self to read from csv instead of sensor. The rows are streamed from the file, see Csv_Input
+        csv: path or list of paths to valid csv files with mock readings, or an instance of Csv_Input or Replay_Source
         '''
-        with open(csv,'r') as fp:
-            data = fp.readlines()
-        data = [line.strip("\n") for line in data]
-        self.csv_data = [item if item=="None" else float(item) for item in data]
-        self.csv_current_position = 0
+        self.csv_input = csv if hasattr(csv,"read") else Csv_Input(csv)
         self._read = self._read_csv
     
     def _read_csv(self):
         '''
         Return the next value from a csv
         This lets us test without needing the sensor hooked up
+        Raises EOFError at the end of the input unless the Csv_Input loops or holds
         '''
-        value = self.csv_data[self.csv_current_position]
-        if value == "None":
-            value = None
-        self.csv_current_position += 1
-        return value
+        return self.csv_input.read()[0]
         
-    def _initialize_ads1115(self):
+    def _initialize_ads1115(self,bus_manager=None):
         '''
         Initialize the sensor
+        The ADS1115 is shared with the other probes on the I2C bus through bus_manager, see ADS1115_Bus_Manager
         '''
-        self.ads1115_i2c = busio.I2C(board.SCL,board.SDA)
-        self.ads1115 = ADS.ADS1115(self.ads1115_i2c)
-        # Gain for the system: voltage range:
-        # 2/3: 6.144V
-        #   1: 4.096V
-        #   2: 2.048V
-        #   4: 1.024V
-        #   8: 0.512V
-        #  16: 0.256V
-        self.ads1115.gain = self.ads1115_gain
-        self.ads1115.mode = Mode.CONTINUOUS
-        self.ads1115.data_rate = self.ads1115_data_sample_rate # datarates in samples/secs:8,16,32,64,128,250,475,860
-
-        self.data_stream = AnalogIn(self.ads1115,self.ads1115_single_ended_input_pin)
+        self.bus_manager = bus_manager if bus_manager is not None else get_bus_manager()
+        # Gain 8 is a 0.512V range, see ADS1115_Bus_Manager.register() for the others
+        self.ads1115_channel = self.bus_manager.register(self.ads1115_address,
+                                                            self.ads1115_single_ended_input_pin,
+                                                            gain=self.ads1115_gain,
+                                                            data_rate=self.ads1115_data_sample_rate)
         self._read = self._read_sensor
     
     def _read_sensor(self):
         '''
         Read the value from the real sensor
+        A single reading uses the pass over all of the probes on the bus, a burst converts its own input for each sample
         '''
         try:
-            value = self.data_stream.voltage
+            value = self.ads1115_channel.read(max_age=0. if self.burst_samples > 1 else None)
         except:
             e = sys.exc_info()
             print("Exception thrown while reading ph probe:")
@@ -157,23 +211,36 @@ class Sensor_ph:
             value = None
         return value
 
+    def _read_burst(self):
+        '''
+        Take self.burst_samples samples and return their robust average
+        Sets self.voltage_spread to the spread of the samples
+        '''
+        samples = []
+        for ii in range(self.burst_samples): # each single shot conversion waits for its own result
+            value = self._read_single()
+            if value is not None:
+                samples.append(value)
+        if len(samples) == 0:
+            self.voltage_spread = None
+            return None
+        value,self.voltage_spread = robust_average(samples,method=self.outlier_rejection)
+        return value
+
     def _load_calibration_params(self,calibration_file=None):
         '''
         Set the calibration parameters from a file
         If the file does not exist prompt to calibrate
         '''
         if calibration_file is None:
-            # no calibration data was was given, so try and find the file in the output directory
-            calibration_path = os.path.dirname(os.path.abspath(self.output_file))
-            print(calibration_path)
-            calibration_files = [fname for fname in os.listdir(calibration_path) if "sensor_ph_calibration_" in fname]
-            if len(calibration_files) == 0:
+            # no calibration data was was given, so use the newest one in the calibration store of the output directory
+            entry = self.calibration_store.latest(self.__class__.__name__,self.output_file_base)
+            if entry is None:
                 print("No calibration data found, please calibrate now")
                 self.calibrate()
                 self._load_calibration_params()
                 return
-            calibration_file = sorted(calibration_files)[-1]
-            calibration_file = os.path.join(calibration_path,calibration_file)
+            calibration_file = entry["path"]
 
         print("Loading calibration data from {}".format(calibration_file))
         with open(calibration_file,'r') as fp:
@@ -200,7 +267,7 @@ class Sensor_ph:
         Perform a calibration routine on the sensor
         Will ask user to place in a 4 ph solution, then a 7ph solution
         It will record:
-            * Raw and calculated values to a file called 'sensor_ph_calibration_<timestamp>'
+            * Raw and calculated values to the calibration store, see Calibration_Store
         '''
         calibrate = input("Calibrate Sensor? If no, will load most recent calibration data <y/n>\n")
         if calibrate.lower()[0] != "y":
@@ -242,10 +309,10 @@ class Sensor_ph:
             raise ValueError("in _calibrate_point, name must be either '4ph' or '7ph'")
         
         raw_data = []
-        end_time = time.time() + duration
-        while time.time() < end_time:
+        end_time = self.clock.time() + duration
+        while self.clock.time() < end_time:
             raw_data.append(self._read())
-            time.sleep(pause_time)
+            self.clock.sleep(pause_time)
 
         mean = sum(raw_data)/len(raw_data)
         data = {"{}_raw".format(name):raw_data,
@@ -267,21 +334,19 @@ class Sensor_ph:
 
     def _calibration_save_data(self,data):
         '''
-        Save the calibration data to disk
+        Save the calibration data to the calibration store, see Calibration_Store
         '''
-        calibration_filename = os.path.join(self.output_file_path,'sensor_ph_calibration_raw_'+datetime.datetime.now().isoformat()+".json")
-        with open(calibration_filename,'w') as fp:
-            json.dump(data,fp,indent=2)
-        return calibration_filename
+        return self.calibration_store.save(self.__class__.__name__,self.output_file_base,data)
 
     def __call__(self):
         '''
         Get a reading from the sensor
+        Returns True if the sensor was read, False if it was not due yet
         '''
-        current_time = time.time()
+        current_time = self.clock.time()
         if current_time - self.read_every < self.last_reading:
             # not enough time has passed since last reading, just return
-            return
+            return False
 
         self.update_output_file_path() # Starts a new output file every day
 
@@ -295,21 +360,53 @@ class Sensor_ph:
         # If there was an error reading voltage is none. 
         #   In this case we do not want to update the moving average
         if self.voltage_raw is not None: 
-            self.voltage_avg = self.voltage_avg * self.average_factor + self.voltage_raw * (1-self.average_factor)
-            self.ph_avg = self.ph_avg * self.average_factor + self.ph_raw * (1-self.average_factor)
+            self.voltage_avg = self.voltage_filter.update(self.voltage_raw,current_time)
+            self.ph_avg = self.ph_filter.update(self.ph_raw,current_time)
+            self.extra_averages["ph_avg"].update(self.ph_raw,current_time)
 
         #fp.write("time,datetime_timezone,voltage_raw,voltage_avg,ph_raw,ph_avg\n")
-        output = "{},{},".format(time.time(),datetime.datetime.now().astimezone())
-        output += "{},{},{},{}\n".format(self.voltage_raw,self.voltage_avg,self.ph_raw,self.ph_avg)
-        with open(self.output_file,'a') as fp:
-            fp.write(output)
+        values = [self.voltage_raw,self.voltage_avg,self.ph_raw,self.ph_avg]
+        if self.burst_samples > 1:
+            values.append(self.voltage_spread)
+        epoch = self.clock.time()
+        append_to_file(self.output_file,format_output_row(epoch,values,self.storage),self.output_writer)
+        if self.rollup is not None:
+            self.rollup.update(epoch,values)
 
         if self.verbose:
-            t = datetime.datetime.strftime(datetime.datetime.now(),"%m/%d %H:%M:%S")
+            t = datetime.datetime.strftime(datetime.datetime.fromtimestamp(self.clock.time()),"%m/%d %H:%M:%S")
             if type(self.ph_raw) is float:
                 print("{}       ph: Current: {:.2f} Average: {:.2f}".format(t,self.ph_raw,self.ph_avg))
             else:
-                print("{}       ph: Current: {} Average: {:.2f}".format(t,self.ph_raw,self.ph_avg))
+                print("{}       ph: Current: {} Average: {}".format(t,self.ph_raw,"{:.2f}".format(self.ph_avg) if self.ph_avg is not None else None))
+        return True
+
+def robust_average(samples,method="mad",mad_threshold=3.5,trim_fraction=0.2):
+    '''
+    Average samples while rejecting outliers
+    samples: list of floats
+    method: str
+        "mad": Samples further than mad_threshold scaled median absolute deviations from the median are rejected,
+                the rest are averaged. The spread is the scaled median absolute deviation
+        "trimmed": The highest and lowest trim_fraction of the samples are removed and the rest are averaged.
+                The spread is the standard deviation of the remaining samples
+    Returns (average,spread)
+    '''
+    import numpy as np
+    samples = np.sort(np.asarray(samples,dtype=np.float64))
+    if method == "mad":
+        median = np.median(samples)
+        mad = 1.4826 * np.median(np.abs(samples - median)) # scaled to match the standard deviation of normal noise
+        if mad == 0.:
+            return float(median),0.
+        kept = samples[np.abs(samples - median) <= mad_threshold * mad]
+        return float(np.mean(kept)),float(mad)
+    elif method == "trimmed":
+        n_trim = int(len(samples) * trim_fraction)
+        kept = samples[n_trim:len(samples)-n_trim]
+        return float(np.mean(kept)),float(np.std(kept))
+    else:
+        raise ValueError("Invalid method {}. Expected 'mad' or 'trimmed'".format(method))
 
 if __name__ == "__main__":
     s_csv = Sensor_ph(output_file="tmp_output_files/ph_{:.0f}.csv".format(time.time()),
@@ -4,19 +4,25 @@ import os
 import sys
 import time
 import json
+import threading
+
+from .output_writer import append_to_file, format_output_row, output_file_header, STORAGE_EXTENSIONS
+from .output_rotation import get_default_output_rotation
+from .clock import get_default_clock
+from .csv_input import Csv_Input
+from .rollups import Rollup
+from .ema_filter import Ema_Filter, Ema_Filter_Bank
+from .calibration_store import Calibration_Store
+from . import hardware
 
-try:
-    import RPi.GPIO as GPIO
-except:
-    print("Sensor_ph: Unable to import raspberry pi specific modules" +\
-           "\tWill only be able to run in csv mode!")
-        
 class Sensor_volume:
     '''
     Defines a sensor for measuring the volume in the tank.
     Uses a ultrasonic distance device to measure the top of the water
     The depth is calibrated to the water volume
     '''
+    output_header = "time,datetime_timezone,pulse_duration_raw,pulse_duration_avg,volume_raw,volume_avg\n"
+    display_values = [("Volume","volume_raw","volume_avg")] # (name, current attribute, average attribute) shown in the UI
 
     def __init__(self,
                   output_file_path,
@@ -24,11 +30,21 @@ class Sensor_volume:
                   trigger_pin=None,
                   echo_pin=None,
                   iterations_per_reading=5,
+                  measurement_mode="poll",
+                  gpio=None,
+                  pulse_timer=None,
                   average_factor=0.9,
                   read_every=30.,
                   csv=None,
                   calibration_file=None,
                   calibrate_on_startup=True,
+                  average_time_constant=None,
+                  extra_averages=None,
+                  storage="csv",
+                  rollups=False,
+                  output_writer=None,
+                  output_rotation=None,
+                  clock=None,
                   verbose=False):
         '''
         Create the instance of the ph sensor
@@ -38,31 +54,71 @@ class Sensor_volume:
         trigger_pin: int - the pin to use to trigger the sensor
         echo_pin: int - the pin to recieve the echo on.
         iterations_per_reading: int, Take this many sensor readings and average them together to get the actual reading
+        measurement_mode: str, How the echo pulse is timed
+                "poll": spin on the echo pin until it changes, uses a full core while waiting
+                "edge": edge interrupts on the echo pin are timestamped with pulse_timer, the thread sleeps while waiting
+        gpio: None or object with the RPi.GPIO interface, ie Fake_GPIO for testing. If None RPi.GPIO is used
+        pulse_timer: None or function returning seconds that times the echo pulse. If None time.perf_counter is used.
+                    Only for testing, ie the monotonic of the Virtual_Clock a Fake_GPIO simulates the echo on.
+                    The trigger pulse is always held with time.sleep
         average_factor: float (0,1), the weighting factor for the exponential moving average calculation
         read_every: float > 0, Minimum number of seconds between each reading
         csv: None or path ot csv file to use as a mock input.
                 If csv is not None then it must be a valid file path. This is only for debugging
                     the csv file is a file with rows of a single float which is a time reading from the sensor
+                A list of paths is read one after the other, or pass an instance of Csv_Input to replay the
+                    pulse_duration_raw column of recorded output files or to loop or hold at the end of the input
                     it should be the time of the pulse duration from the echo response
         calibration_file: None or path to json file with calibration data. 
                             The file must contain keys for 'm' (slope) and 'b' (y-intercept)
                             volume = m*pulse_duration + b
+                            If None the newest calibration of the sensor in the Calibration_Store of output_file_path is used
         calibrate_on_startup: Boolean, As for calibration to be done when the object is created
+        average_time_constant: None or float > 0, seconds. If given the averages are weighted by the time between readings
+                            with this time constant and start at the first reading, instead of using average_factor, see Ema_Filter
+        extra_averages: None or dict of name -> time constant in seconds. Also keep these averages of the volume, available
+                            as self.extra_averages["volume_avg"][name] for the UI and controllers, see Ema_Filter_Bank
+        storage: str, format of the output files. "csv" for text files, "binary" for fixed width float64 records, see binary_storage
+        rollups: Boolean, Also keep 1 minute and 1 hour min/max/mean/count rollups of the readings in companion files, see Rollup
+        output_writer: None or instance of Output_Writer. If given the output rows are queued on it instead of written immediately
+        output_rotation: None or instance of Output_Rotation that manages the daily output files. If None the default shared one is used
+        clock: None or instance of Real_Clock or Virtual_Clock used for the read_every checks and timestamps. The echo pulse is timed with pulse_timer, not this clock. If None the default Real_Clock is used
         verbose: Boolean, Output the data to standard out
         '''
         self.verbose = verbose
+        self.output_writer = output_writer
         self.trigger_pin = trigger_pin
         self.echo_pin = echo_pin
         self.iterations_per_reading = iterations_per_reading
+        if measurement_mode not in ("poll","edge"):
+            raise ValueError("Invalid measurement_mode {}. Expected 'poll' or 'edge'".format(measurement_mode))
+        self.measurement_mode = measurement_mode
+        self.gpio = gpio
+        self.pulse_timer = pulse_timer if pulse_timer is not None else time.perf_counter
 
+        self.clock = clock if clock is not None else get_default_clock()
         self.output_file_path = output_file_path
         self.output_file_base = output_file_base
         os.makedirs(os.path.dirname(self.output_file_path),exist_ok=True)
+        self.output_rotation = output_rotation if output_rotation is not None else get_default_output_rotation()
+        self.storage = storage
+        self._output_file_key = self.output_rotation.register(self.output_file_path,
+                                                                self.output_file_base,
+                                                                output_file_header(self.output_header,self.storage),
+                                                                extension=STORAGE_EXTENSIONS[self.storage])
+        self.rollup = None
+        if rollups:
+            columns = [column.strip() for column in self.output_header.strip().split(",")[2:]]
+            self.rollup = Rollup(self.output_file_path,self.output_file_base,columns,
+                                    output_writer=self.output_writer,
+                                    output_rotation=self.output_rotation)
         self.update_output_file_path()     
+        self.calibration_store = Calibration_Store(self.output_file_path) # only read when no calibration_file is given
 
         # how much of the previous value to keep result = previous * average_factor + new * (1-average_factor)
         #   A larger value makes it slower to respond but is more noise resistant
         self.average_factor = average_factor
+        self.average_time_constant = average_time_constant
         self.read_every = read_every # seconds, minimum time between readings
 
         ####
@@ -82,55 +138,50 @@ class Sensor_volume:
         else:
             self._load_calibration_params(calibration_file)
 
-        self.last_reading = time.time() - self.read_every - 1 # make it so imediatly the data is out of date to force reading
+        self.last_reading = self.clock.time() - self.read_every - 1 # make it so imediatly the data is out of date to force reading
 
         self.pulse_duration_raw = None # initilize the value of the current pulse measurement
-        self.pulse_duration_avg = 0. # the average pulse time value, initalize to 0.0
         self.volume_raw = None # initialize the water volume value
-        self.volume_avg = 0.0 # the averaged water volume is set to 0.0
+        if self.average_time_constant is None: # the averages start at 0.0
+            self.pulse_duration_filter = Ema_Filter(factor=self.average_factor,initial=0.)
+            self.volume_filter = Ema_Filter(factor=self.average_factor,initial=0.)
+        else: # None until the first reading
+            self.pulse_duration_filter = Ema_Filter(time_constant=self.average_time_constant)
+            self.volume_filter = Ema_Filter(time_constant=self.average_time_constant)
+        self.pulse_duration_avg = self.pulse_duration_filter.value # the average pulse time value
+        self.volume_avg = self.volume_filter.value # the averaged water volume
+        self.extra_averages = {"volume_avg":Ema_Filter_Bank(extra_averages if extra_averages is not None else {})}
 
     def update_output_file_path(self):
         '''
-        Updates the property self.output_file
-        Checks to see if the file <self.output_file_path> + <self.output_file_base> + <date in YYYY-MM-DD format> .csv
-            If it does:
-                do nothing
-            If it does not exist:
-                create it and initialize the header
+        Updates the property self.output_file to the file for the current day
+            <self.output_file_path> + <self.output_file_base> + <date in YYYY-MM-DD format> .csv
+        The file is created and the header written by self.output_rotation when the day changes
         '''
-
-        date = datetime.date.today().isoformat()
-        self.output_file = os.path.join(self.output_file_path,"{}_{}.csv".format(self.output_file_base,date))
-        if not os.path.isfile(self.output_file):
-            with open(self.output_file,'a') as fp:
-                fp.write("time,datetime_timezone,pulse_duration_raw,pulse_duration_avg,volume_raw,volume_avg\n")
+        self.output_file = self.output_rotation.get_output_file(self._output_file_key)
 
     def _initialize_csv(self,csv):
         '''
-        Read in all the data from the csv file, set up self to read from csv instead of sensor
-        csv: path to valid csv file with mock readings
+        Set up self to read from csv instead of sensor. The rows are streamed from the file, see Csv_Input
+        csv: path or list of paths to valid csv files with mock readings, or an instance of Csv_Input or Replay_Source
         '''
-        with open(csv,'r') as fp:
-            data = fp.readlines()
-        data = [line.strip("\n") for line in data]
-        self.csv_data = [item if item=="None" else float(item) for item in data]
-        self.csv_current_position = 0
+        self.csv_input = csv if hasattr(csv,"read") else Csv_Input(csv)
         self._read = self._read_csv
     
     def _read_csv(self):
         '''
         Return the next value from a csv
         This lets us test without needing the sensor hooked up
+        Raises EOFError at the end of the input unless the Csv_Input loops or holds
         '''
         counts = 0
         sums = 0
         for _ in range(self.iterations_per_reading):
             try:
-                value = self.csv_data[self.csv_current_position]
-                self.csv_current_position += 1
+                value = self.csv_input.read()[0]
                 sums += value
                 counts += 1
-            except:
+            except TypeError: # a reading of None
                 continue
         if counts == 0:
             return None
@@ -140,14 +191,74 @@ class Sensor_volume:
         '''
         Initialize the sensor
         '''
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(self.trigger_pin,GPIO.OUT)
-        GPIO.setup(self.echo_pin,GPIO.IN)
+        if self.gpio is None:
+            self.gpio = hardware.gpio("Sensor_volume")
+        self.gpio.setmode(self.gpio.BCM)
+        self.gpio.setup(self.trigger_pin,self.gpio.OUT)
+        self.gpio.setup(self.echo_pin,self.gpio.IN)
 
         # Set low, then allow to settle
-        GPIO.output(self.trigger_pin,False)
+        self.gpio.output(self.trigger_pin,False)
+
+        if self.measurement_mode == "edge":
+            self._echo_start = None # pulse_timer() of the rising edge of the echo
+            self._echo_end = None # pulse_timer() of the falling edge of the echo
+            self._echo_complete = threading.Event()
+            self.gpio.add_event_detect(self.echo_pin,self.gpio.BOTH,callback=self._echo_edge)
+            self._read = self._read_sensor_edge
+        else:
+            self._read = self._read_sensor
 
-        self._read = self._read_sensor
+    def cleanup(self):
+        '''
+        Reset the GPIO
+        '''
+        if self.gpio is None:
+            return
+        if self.measurement_mode == "edge":
+            self.gpio.remove_event_detect(self.echo_pin)
+        self.gpio.cleanup([self.trigger_pin,self.echo_pin])
+
+    def _echo_edge(self,channel):
+        '''
+        Called from the GPIO interrupt thread on each edge of the echo pin
+        '''
+        edge_time = self.pulse_timer()
+        if self.gpio.input(channel):
+            self._echo_start = edge_time
+        elif self._echo_start is not None:
+            self._echo_end = edge_time
+            self._echo_complete.set()
+
+    def _read_sensor_edge(self):
+        '''
+        Read the sensor self.iterations_per_reading times and return the average value
+        Same as _read_sensor, but the edges of the echo are timed by interrupts instead of polling the pin
+        '''
+        counts = 0
+        sums = 0
+        for _ in range(self.iterations_per_reading):
+            self._echo_start = None
+            self._echo_end = None
+            self._echo_complete.clear()
+
+            # Send out signal
+            self.gpio.output(self.trigger_pin,True)
+            time.sleep(.00001)
+            trigger_time = self.pulse_timer()
+            self.gpio.output(self.trigger_pin,False)
+
+            # The echo must end within the timeout of the trigger, checked on pulse_timer as well for a simulated echo
+            if not self._echo_complete.wait(timeout=0.2) or self._echo_end - trigger_time > 0.2:
+                print("Exception thrown while reading SR04 Ultrasonic Distance Sensor:")
+                print("Timeout while waiting for the echo on volume sensor")
+                continue
+            sums += self._echo_end - self._echo_start
+            counts += 1
+        if counts == 0:
+            return None
+        else:
+            return sums/counts
     
     def _read_sensor(self):
         '''
@@ -164,20 +275,20 @@ class Sensor_volume:
         for _ in range(self.iterations_per_reading):
             try:
                 # Send out signal
-                GPIO.output(self.trigger_pin,True)
+                self.gpio.output(self.trigger_pin,True)
                 time.sleep(.00001)
-                GPIO.output(self.trigger_pin,False)
+                self.gpio.output(self.trigger_pin,False)
 
                 # Find the start of the response
-                error_timeout = time.time() + 0.1
-                while GPIO.input(self.echo_pin) == 0:
-                    pulse_start = time.time()
+                error_timeout = self.pulse_timer() + 0.1
+                while self.gpio.input(self.echo_pin) == 0:
+                    pulse_start = self.pulse_timer()
                     if pulse_start > error_timeout:
                         raise ValueError("Timeout while searching for pulse start on volume sensor")
                 # Find the end of the response
-                error_timeout = time.time() + 0.1
-                while GPIO.input(self.echo_pin) == 1:
-                    pulse_end = time.time()
+                error_timeout = self.pulse_timer() + 0.1
+                while self.gpio.input(self.echo_pin) == 1:
+                    pulse_end = self.pulse_timer()
                     if pulse_end > error_timeout:
                         raise ValueError("Timeout while searching for pulse end on volume sensor")
 
@@ -201,17 +312,14 @@ class Sensor_volume:
         If the file does not exist prompt to calibrate
         '''
         if calibration_file is None:
-            # no calibration data was was given, so try and find the file in the output directory
-            calibration_path = os.path.dirname(os.path.abspath(self.output_file))
-            print(calibration_path)
-            calibration_files = [fname for fname in os.listdir(calibration_path) if "{}_calibration_".format(self.__class__.__name__.lower()) in fname]
-            if len(calibration_files) == 0:
+            # no calibration data was was given, so use the newest one in the calibration store of the output directory
+            entry = self.calibration_store.latest(self.__class__.__name__,self.output_file_base)
+            if entry is None:
                 print("No calibration data found for class {}, please calibrate now".format(self.__class__.__name__))
                 self.calibrate()
                 self._load_calibration_params()
                 return
-            calibration_file = sorted(calibration_files)[-1]
-            calibration_file = os.path.join(calibration_path,calibration_file)
+            calibration_file = entry["path"]
 
         print("Loading calibration data from {}".format(calibration_file))
         with open(calibration_file,'r') as fp:
@@ -236,7 +344,7 @@ class Sensor_volume:
         Asks user to add in water, and record the volume that they added.
 
         It will record:
-            * Raw and calculated values to a file called 'sensor_volume_calibration_<timestamp>'
+            * Raw and calculated values to the calibration store, see Calibration_Store
         '''
         calibrate = input("Calibrate Volume Sensor? If no, will load most recent calibration data <y/n>\n")
         if calibrate.lower()[0] != "y":
@@ -276,48 +384,48 @@ class Sensor_volume:
     
     def _calibration_save_data(self,data):
         '''
-        Save the calibration data to disk
+        Save the calibration data to the calibration store, see Calibration_Store
         '''
-        calibration_filename = os.path.join(self.output_file_path,"{}_calibration_raw_{}.json".format(self.__class__.__name__.lower(),
-                                                                                                    datetime.datetime.now().isoformat()))
-        with open(calibration_filename,'w') as fp:
-            json.dump(data,fp,indent=2)
-        return calibration_filename
+        return self.calibration_store.save(self.__class__.__name__,self.output_file_base,data)
 
     def __call__(self):
         '''
         Get a reading from the sensor
+        Returns True if the sensor was read, False if it was not due yet
         '''
-        current_time = time.time()
+        current_time = self.clock.time()
         if current_time - self.read_every < self.last_reading:
             # not enough time has passed since last reading, just return
-            return
+            return False
 
         # Take the reading. If None is returned, just exit now. there is no need to update any values
         #    as nothing has changed
         self.pulse_duration_raw = self._read()
         
         if self.pulse_duration_raw is None:
-            return
+            return True
         self.last_reading = current_time
         self.update_output_file_path() # Starts a new output file every day
 
         self.volume_raw = self.convert_pulse_duration_to_volume(self.pulse_duration_raw)
-        self.pulse_duration_avg = self.pulse_duration_avg * self.average_factor + self.pulse_duration_raw * (1-self.average_factor)
-        self.volume_avg = self.volume_avg * self.average_factor + self.volume_raw * (1-self.average_factor)
+        self.pulse_duration_avg = self.pulse_duration_filter.update(self.pulse_duration_raw,current_time)
+        self.volume_avg = self.volume_filter.update(self.volume_raw,current_time)
+        self.extra_averages["volume_avg"].update(self.volume_raw,current_time)
         
         #fp.write("times,datetime_timezone,pulse_duration_raw,pulse_duration_avg,volume_raw,volume_avg\n")
-        output = "{},{},".format(time.time(),datetime.datetime.now().astimezone())
-        output += "{},{},{},{}\n".format(self.pulse_duration_raw,self.pulse_duration_avg,self.volume_raw,self.volume_avg)
-        with open(self.output_file,'a') as fp:
-            fp.write(output)
+        epoch = self.clock.time()
+        values = [self.pulse_duration_raw,self.pulse_duration_avg,self.volume_raw,self.volume_avg]
+        append_to_file(self.output_file,format_output_row(epoch,values,self.storage),self.output_writer)
+        if self.rollup is not None:
+            self.rollup.update(epoch,values)
 
         if self.verbose:
-            t = datetime.datetime.strftime(datetime.datetime.now(),"%m/%d %H:%M:%S")
+            t = datetime.datetime.strftime(datetime.datetime.fromtimestamp(self.clock.time()),"%m/%d %H:%M:%S")
             if type(self.volume_raw) is float:
                 print("{}       Volume: Current: {:.2f} Average: {:.2f}".format(t,self.volume_raw,self.volume_avg))
             else:
-                print("{}       Volume: Current: {} Average: {:.2f}".format(t,self.volume_raw,self.volume_avg))
+                print("{}       Volume: Current: {} Average: {}".format(t,self.volume_raw,"{:.2f}".format(self.volume_avg) if self.volume_avg is not None else None))
+        return True
 
 
 if __name__ == "__main__":
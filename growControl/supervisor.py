@@ -0,0 +1,377 @@
+'''
+Runs the bins of a config in worker processes so a blocking read in one bin does not delay the others
+
+The bins are split over the workers, keeping bins that refer to each other's devices together, each worker builds its bins with a Registry and runs them
+    with its own Scheduler and Output_Writer, the same as main.py does in a single process. After each
+    pass the worker sends the status of the devices that have new values, and the latency summaries of its
+    Scheduler every few seconds, to the parent over a pipe. The parent keeps the latest of each and restarts
+    a worker that has died, restart_delay seconds after it died, doubling the delay each time it dies again soon after
+    starting and giving up after max_restarts of those in a row.
+The workers have no terminal, so the sensors can not ask for a calibration there. The calibrations are checked
+    in the parent before any worker starts, see check_calibrations().
+'''
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import sys
+import threading
+import time
+
+from .registry import Registry, load_config
+
+def bin_groups(config):
+    '''
+    Group the bins of config that refer to each other's devices with "@<bin>/<name>", they must run in the same process
+    Returns a list of lists of bin indexes, in the order of the config
+    '''
+    bins = config.get("bins",[])
+    index = {bin_config["name"]:ii for ii,bin_config in enumerate(bins)}
+    group = list(range(len(bins))) # bin index -> index of a bin in its group, followed to the root
+
+    def root(ii):
+        while group[ii] != ii:
+            ii = group[ii]
+        return ii
+
+    for ii,bin_config in enumerate(bins):
+        for device_config in bin_config.get("devices",[]):
+            for value in device_config.get("params",{}).values():
+                if isinstance(value,str) and value.startswith("@") and "/" in value:
+                    other = value[1:].split("/")[0]
+                    if other not in index:
+                        raise ValueError("Unknown bin {} in {} of bin {}".format(other,value,bin_config["name"]))
+                    group[max(root(ii),root(index[other]))] = min(root(ii),root(index[other]))
+
+    groups = {}
+    for ii in range(len(bins)):
+        groups.setdefault(root(ii),[]).append(ii)
+    return list(groups.values())
+
+def shard_config(config,n_shards):
+    '''
+    Split the bins of config into n_shards configs, shards without a bin are left out
+    Bins that refer to each other are kept in the same shard, see bin_groups(). Each group goes to the shard with
+        the fewest bins so far, so bins without references are split round robin
+    Returns a list of configs, each a copy of config with some of the bins in the order of the config
+    '''
+    bins = config.get("bins",[])
+    assigned = [[] for ii in range(n_shards)] # bin indexes of each shard
+    for group in bin_groups(config):
+        min(assigned,key=len).extend(group)
+    shards = []
+    for indexes in assigned:
+        shard = dict(config)
+        shard["bins"] = [bins[ii] for ii in sorted(indexes)]
+        if len(shard["bins"]) > 0:
+            shards.append(shard)
+    return shards
+
+calibrated_types = ["Sensor_ph","Sensor_volume"] # device types that ask for a calibration when they have none
+
+def check_calibrations(config):
+    '''
+    Make sure no sensor of config would ask for a calibration in a worker, where there is no terminal to answer it
+    Looking the calibrations up here also indexes the legacy calibration files once, in the parent, instead of in
+        every worker at the same time, see Calibration_Store
+    Raises ValueError naming every sensor that would ask
+    '''
+    from .calibration_store import Calibration_Store
+
+    stores = {} # path -> Calibration_Store
+    problems = []
+    for bin_config in config.get("bins",[]):
+        for device_config in bin_config.get("devices",[]):
+            if device_config["type"] not in calibrated_types:
+                continue
+            params = device_config.get("params",{})
+            key = "{}/{}".format(bin_config["name"],device_config["name"])
+            if params.get("calibrate_on_startup",True):
+                problems.append("{} has calibrate_on_startup".format(key))
+                continue
+            if params.get("calibration_file") is not None:
+                continue
+            path = params.get("output_file_path",config.get("output_dir",""))
+            if path not in stores:
+                stores[path] = Calibration_Store(path)
+            sensor = params.get("output_file_base","{}_{}".format(device_config["name"],bin_config["name"]))
+            if stores[path].latest(device_config["type"],sensor) is None:
+                problems.append("{} has no calibration in {}".format(key,stores[path].directory))
+    if len(problems) > 0:
+        raise ValueError("The sensors can not be calibrated in the worker processes: {}. ".format(", ".join(problems)) +\
+                            "Calibrate them running in one process (without --workers), or set calibrate_on_startup to false and give a calibration_file")
+
+def run_worker(config,conn,late_tolerance=1.0,latency_every=5.0,poll_every=0.5):
+    '''
+    Run the devices of config until "stop" is received on conn, the target of the worker processes
+    config: dict, the config of the bins this worker runs
+    conn: multiprocessing Connection to the parent
+    late_tolerance: float >= 0, see Scheduler
+    latency_every: float > 0, seconds between sending the latency summaries
+    poll_every: float > 0, longest wait between checks for reads that completed on the executor
+    '''
+    from .scheduler import Scheduler
+
+    try:
+        registry = Registry(config)
+        updated = set() # keys of the devices with new values since the last send
+        scheduler = Scheduler(late_tolerance=late_tolerance)
+        registry.schedule(scheduler,wrap=lambda entry: Published_Key(entry,updated))
+        entries = {entry.key:entry for entry in registry.scheduled()}
+    except Exception:
+        e = sys.exc_info()
+        conn.send(("error","{}: {}".format(e[0].__name__,e[1])))
+        raise
+
+    last_latency = 0.
+    try:
+        while True:
+            scheduler.run_pending()
+
+            keys = list(updated)
+            updated.difference_update(keys)
+            if len(keys) > 0:
+                conn.send(("status",[entries[key].status() for key in keys]))
+            if time.monotonic() - last_latency >= latency_every:
+                conn.send(("latency",scheduler.latency_summary(),scheduler.missed_deadlines))
+                last_latency = time.monotonic()
+
+            if conn.poll(min(scheduler.time_until_next(),poll_every)):
+                if conn.recv() == "stop":
+                    break
+    except Exception:
+        e = sys.exc_info()
+        conn.send(("error","{}: {}".format(e[0].__name__,e[1])))
+        raise
+    finally:
+        registry.close()
+
+class Published_Key:
+    '''
+    Calls a device for the Scheduler of a worker and adds its key to updated when it has new values
+    A sensor that reads on an executor is added when the read completes
+    '''
+    def __init__(self,entry,updated):
+        self.device = entry.device
+        self.key = entry.key
+        self.updated = updated
+
+    def __call__(self):
+        did_work = self.device()
+        if did_work is not False:
+            pending_read = getattr(self.device,"pending_read",None)
+            if (pending_read is not None) and (not pending_read.done()):
+                pending_read.add_done_callback(lambda future: self.updated.add(self.key))
+            else:
+                self.updated.add(self.key)
+        return did_work
+
+class Worker:
+    '''
+    One worker process of the Supervisor and the config of the bins it runs
+    '''
+    def __init__(self,index,config):
+        self.index = index
+        self.config = config
+        self.process = None
+        self.conn = None # parent end of the pipe
+        self.restarts = 0
+        self.started = None # time.monotonic() the worker was last started
+        self.died = None # time.monotonic() the worker was found dead, None while it is running
+        self.failures = 0 # times in a row the worker died soon after starting
+        self.gave_up = False # True once the worker failed too many times in a row to be restarted
+        self.last_error = None # the last exception the worker reported, as a str
+
+class Supervisor:
+    '''
+    Shards the bins of a config across worker processes and collects the latest values of their devices
+    '''
+
+    def __init__(self,config,n_workers=None,restart_delay=5.,max_restart_delay=300.,stable_time=60.,max_restarts=10,
+                    late_tolerance=1.0,on_update=None,verbose=False):
+        '''
+        config: dict, or path to a .json or .toml config file, see Registry
+        n_workers: None or int > 0, number of worker processes. If None one per core, at most one per bin
+        restart_delay: float >= 0, seconds to wait before restarting a worker that died. Doubled each time it dies
+            again within stable_time of starting, up to max_restart_delay
+        max_restart_delay: float >= restart_delay, longest wait before a restart
+        stable_time: float, seconds a worker must run for its next death not to count as a failure in a row
+        max_restarts: None or int >= 0, failures in a row after which the worker is not restarted. None to always restart
+        late_tolerance: float >= 0, passed to the Scheduler of each worker
+        on_update: None or function(key) called from the monitor thread when a device of key has new values
+        verbose: Boolean, Output when workers die and are restarted
+        '''
+        if isinstance(config,str):
+            config = load_config(config)
+        check_calibrations(config)
+        self.config = config
+        self.output_dir = config.get("output_dir","")
+        n_bins = len(config.get("bins",[]))
+        if n_workers is None:
+            n_workers = min(os.cpu_count() or 1,n_bins)
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.stable_time = stable_time
+        self.max_restarts = max_restarts
+        self.late_tolerance = late_tolerance
+        self.on_update = on_update
+        self.verbose = verbose
+
+        self.workers = [Worker(index,shard) for index,shard in enumerate(shard_config(config,max(n_workers,1)))]
+        # keys of the scheduled devices in the order of the config, so the UI does not depend on the sharding
+        self.keys = []
+        for bin_config in config.get("bins",[]):
+            for device_config in bin_config.get("devices",[]):
+                self.keys.append("{}/{}".format(bin_config["name"],device_config["name"]))
+        self.status = {} # key -> latest status dict from Registered_Device.status()
+        self.latency = {} # device key -> latest latency summary
+        self.missed_deadlines = {} # worker index -> missed deadlines of its Scheduler
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._monitor = None
+        self._context = multiprocessing.get_context("spawn") # do not fork the threads of the parent
+
+    def start(self):
+        '''
+        Start the workers and the thread that receives from them
+        '''
+        for worker in self.workers:
+            self._spawn(worker)
+        self._monitor = threading.Thread(target=self._run_monitor,name="Supervisor",daemon=True)
+        self._monitor.start()
+
+    def stop(self,timeout=10.):
+        '''
+        Ask the workers to stop, waiting up to timeout seconds for each to close its devices before it is terminated
+        '''
+        self._stopped.set()
+        if self._monitor is not None:
+            self._monitor.join()
+        for worker in self.workers:
+            if worker.process is not None and worker.process.is_alive():
+                try:
+                    worker.conn.send("stop")
+                except (OSError,EOFError):
+                    pass
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()
+                worker.process.join()
+            worker.conn.close()
+
+    def statuses(self):
+        '''
+        Returns the latest status of every device that has sent one, in the order of the config
+        '''
+        with self._lock:
+            return [self.status[key] for key in self.keys if key in self.status]
+
+    def latency_summary(self):
+        '''
+        Returns a dict of device key -> latest latency summary from the workers
+        '''
+        with self._lock:
+            return dict(self.latency)
+
+    def restarts(self):
+        '''
+        Returns the total number of times workers have been restarted
+        '''
+        return sum(worker.restarts for worker in self.workers)
+
+    def dump_latency(self,path):
+        '''
+        Write the latest latency summaries of the workers to the json file at path
+        '''
+        with open(path,'w') as fp:
+            json.dump(self.latency_summary(),fp,indent=2)
+
+    def _spawn(self,worker):
+        '''
+        Start the process of worker
+        '''
+        parent_conn,child_conn = self._context.Pipe()
+        worker.conn = parent_conn
+        worker.process = self._context.Process(target=run_worker,
+                                                args=(worker.config,child_conn),
+                                                kwargs={"late_tolerance":self.late_tolerance},
+                                                name="growControl-worker-{}".format(worker.index),
+                                                daemon=True)
+        worker.process.start()
+        child_conn.close() # the parent only needs its end, so a dead worker reads as EOFError
+        worker.started = time.monotonic()
+        worker.died = None
+
+    def _run_monitor(self):
+        '''
+        Receive from the workers and restart the dead ones until stop()
+        '''
+        while not self._stopped.is_set():
+            conns = {worker.conn:worker for worker in self.workers if worker.died is None}
+            ready = multiprocessing.connection.wait(list(conns.keys()),timeout=0.2) if len(conns) > 0 else []
+            if len(conns) == 0:
+                time.sleep(0.2)
+            for conn in ready:
+                worker = conns[conn]
+                try:
+                    message = conn.recv()
+                except (EOFError,OSError):
+                    self._worker_died(worker)
+                    continue
+                self._handle(worker,message)
+
+            for worker in self.workers:
+                if worker.died is None and not worker.process.is_alive():
+                    self._worker_died(worker)
+                if worker.died is not None and not worker.gave_up and time.monotonic() - worker.died >= self._restart_delay(worker) and not self._stopped.is_set():
+                    worker.conn.close()
+                    worker.restarts += 1
+                    if self.verbose:
+                        print("Supervisor: restarting worker {} ({} restarts)".format(worker.index,worker.restarts))
+                    self._spawn(worker)
+
+    def _restart_delay(self,worker):
+        '''
+        Seconds to wait after worker died before restarting it
+        '''
+        return min(self.restart_delay * 2**max(worker.failures-1,0),max(self.max_restart_delay,self.restart_delay))
+
+    def _worker_died(self,worker):
+        '''
+        Note that worker has died so it is restarted after _restart_delay(), or given up on after max_restarts failures in a row
+        '''
+        if worker.died is not None:
+            return
+        worker.process.join(1.)
+        worker.died = time.monotonic()
+        if worker.died - worker.started < self.stable_time:
+            worker.failures += 1
+        else:
+            worker.failures = 1
+        if self.verbose:
+            print("Supervisor: worker {} died with exit code {}: {}".format(worker.index,worker.process.exitcode,worker.last_error))
+        if self.max_restarts is not None and worker.failures > self.max_restarts:
+            worker.gave_up = True
+            print("Supervisor: worker {} failed {} times in a row, it is not restarted. Last error: {}".format(worker.index,worker.failures,worker.last_error))
+
+    def _handle(self,worker,message):
+        '''
+        Keep the values from a message of worker
+        '''
+        kind = message[0]
+        if kind == "status":
+            with self._lock:
+                for status in message[1]:
+                    self.status[status["key"]] = status
+            if self.on_update is not None:
+                for status in message[1]:
+                    self.on_update(status["key"])
+        elif kind == "latency":
+            with self._lock:
+                self.latency.update(message[1])
+                self.missed_deadlines[worker.index] = message[2]
+        elif kind == "error":
+            worker.last_error = message[1]
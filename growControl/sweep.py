@@ -0,0 +1,281 @@
+'''
+Replays recorded pH data through Controller_ph_Pump for a grid of settings, one setting per process
+
+Every combination of ph_min, ph_max, dispense_volume, control_every and the average_factor of the sensor is
+    replayed with growControl.replay on a process pool using all of the cores, and scored on how the pH
+    would have been held:
+        time_in_band: fraction of the time the pH read by the sensor is between target_min and target_max,
+            each reading weighted by the time until the next one
+        dosed_ml, ph_up_ml, ph_down_ml: total volume dispensed
+        actions: number of control actions
+    The settings are ranked by time_in_band, then by the least dosed_ml, then by the fewest actions.
+
+    python -m growControl.sweep --data <data dir> --ph sensor_ph_bin1 --start 2021-01-01 --end 2021-03-01 \
+        --ph-min 5.8,5.9,6.0 --ph-max 6.1,6.2 --dispense-volume 1.5,3.0 --control-every 900,1800 --output sweep.csv
+
+The recorded readings do not respond to the doses of the replay, so a simple dose model is added to them: each
+    ml of ph down (up) shifts the readings by -ph_per_ml (+ph_per_ml), and the shift decays back to the recorded
+    pH with a time constant of recovery_time seconds as the nutrients and plants pull it back. The doses that were
+    given while the data was recorded are part of the recorded pH and are not removed, so the scores are for
+    comparing the settings with each other rather than a prediction of the pH.
+'''
+import argparse
+import concurrent.futures
+import datetime
+import functools
+import itertools
+import math
+import multiprocessing
+import os
+import tempfile
+import time
+
+from .replay import Replay, Replay_Source, replay_files
+
+class Dosed_Source:
+    '''
+    A Replay_Source of recorded voltages with the modeled effect of the replay's ph doses added, see the module docstring
+
+    Set volts_per_ph from the calibration of the sensor before the replay is run
+    '''
+
+    def __init__(self,source,actions,ph_per_ml=0.05,recovery_time=6*60*60):
+        '''
+        source: instance of Replay_Source of the voltage_raw column
+        actions: list the replay appends its control actions to, Replay.actions
+        ph_per_ml: float, pH change of the reservoir for each ml dosed
+        recovery_time: float, seconds for the shift of a dose to decay 63% of the way back to the recorded pH
+        '''
+        self.source = source
+        self.actions = actions
+        self.ph_per_ml = ph_per_ml
+        self.recovery_time = recovery_time
+        self.volts_per_ph = None
+        self.offset = 0. # pH shift of the doses at self.epoch
+        self.epoch = None # time of the current row
+        self._applied = 0 # number of actions folded in to offset
+
+    def advance(self):
+        '''
+        Move to the next recorded row, see Replay_Source.advance()
+        '''
+        epoch = self.source.advance()
+        if epoch is not None:
+            self._update_offset(epoch)
+        return epoch
+
+    def read(self):
+        '''
+        Return the recorded voltage of the current row shifted by the doses so far
+        '''
+        value = self.source.read()[0]
+        if value is None:
+            return [None]
+        return [value + self.offset * self.volts_per_ph]
+
+    def _decay_to(self,epoch):
+        if self.epoch is not None and epoch > self.epoch:
+            self.offset *= math.exp(-(epoch - self.epoch) / self.recovery_time)
+        self.epoch = epoch
+
+    def _update_offset(self,epoch):
+        '''
+        Fold the doses taken up to epoch in to the offset, and decay it to epoch
+        '''
+        while self._applied < len(self.actions) and self.actions[self._applied][0] <= epoch:
+            action_epoch,_,action,volume = self.actions[self._applied]
+            self._applied += 1
+            if action not in ("Adjust ph Up","Adjust ph Down"):
+                continue
+            self._decay_to(action_epoch)
+            self.offset += volume * self.ph_per_ml * (1. if action == "Adjust ph Up" else -1.)
+        self._decay_to(epoch)
+
+def grid(ph_min,ph_max,dispense_volume,control_every,average_factor=(0.9,)):
+    '''
+    Returns a list of dicts of every combination of the settings, leaving out the ones with ph_min >= ph_max
+    Each argument is a list of values of the Controller_ph_Pump (or Sensor_ph) parameter of the same name
+    '''
+    settings = []
+    for values in itertools.product(ph_min,ph_max,dispense_volume,control_every,average_factor):
+        setting = dict(zip(["ph_min","ph_max","dispense_volume","control_every","average_factor"],values))
+        if setting["ph_min"] < setting["ph_max"]:
+            settings.append(setting)
+    return settings
+
+def evaluate_setting(setting,data_path,sensor,start,end,calibration_file,
+                        target_min=5.8,target_max=6.2,ph_per_ml=0.05,recovery_time=6*60*60,warmup_time=10*60):
+    '''
+    Replay the recorded data of sensor with one setting of the controller
+    Returns a dict of the setting and its scores, see the module docstring
+    setting: dict of ph_min, ph_max, dispense_volume, control_every and average_factor, ie from grid()
+    data_path, sensor: directory of the recorded files and output_file_base of the recorded ph sensor
+    start, end: float epochs of the range to replay
+    calibration_file: path to the calibration json of the sensor
+    target_min, target_max: float, the pH band the time is scored in, the same for every setting
+    ph_per_ml, recovery_time: the dose model, see Dosed_Source
+    warmup_time: float, seconds after start before the controller can act
+    '''
+    import numpy as np
+
+    from .sensor_ph import Sensor_ph
+    from .controllable_pump import Controllable_Pump
+    from .control_ph_pump import Controller_ph_Pump
+    from .data_access import Data_Store
+
+    with tempfile.TemporaryDirectory(prefix="sweep_") as tmp_dir:
+        replay_path = os.path.join(tmp_dir,"")
+        replay = Replay(replay_path,start)
+        source = Dosed_Source(Replay_Source(replay_files(data_path,sensor,start,end),"voltage_raw",start=start,end=end),
+                                replay.actions,
+                                ph_per_ml=ph_per_ml,
+                                recovery_time=recovery_time)
+        sensor_ph = Sensor_ph(replay_path,sensor,
+                                average_factor=setting["average_factor"],
+                                read_every=0.,
+                                csv=source,
+                                calibration_file=calibration_file,
+                                calibrate_on_startup=False,
+                                **replay.device_kwargs())
+        source.volts_per_ph = 1. / sensor_ph.calibration_value_m
+        replay.add_sensor(sensor_ph,source)
+        replay.add_controller(Controller_ph_Pump(sensor_ph,
+                                                    Controllable_Pump(None,clock=replay.clock),
+                                                    Controllable_Pump(None,clock=replay.clock),
+                                                    replay_path,"controller_ph_pump",
+                                                    dispense_volume=setting["dispense_volume"],
+                                                    ph_min=setting["ph_min"],
+                                                    ph_max=setting["ph_max"],
+                                                    control_every=setting["control_every"],
+                                                    warmup_time=warmup_time,
+                                                    **replay.device_kwargs()))
+        try:
+            actions = replay.run()
+        finally:
+            replay.close()
+
+        df = Data_Store(replay_path).load(sensor,start,end)
+        times = df["time"].values
+        ph = df["ph_raw"].values
+        durations = np.diff(times,append=times[-1:] + np.median(np.diff(times))) if len(times) > 1 else np.ones(len(times))
+        valid = np.isfinite(ph)
+        in_band = valid & (ph >= target_min) & (ph <= target_max)
+        total = durations[valid].sum()
+
+    result = dict(setting)
+    result["time_in_band"] = float(durations[in_band].sum() / total) if total > 0 else float("nan")
+    result["ph_up_ml"] = sum(action[3] for action in actions if action[2] == "Adjust ph Up")
+    result["ph_down_ml"] = sum(action[3] for action in actions if action[2] == "Adjust ph Down")
+    result["dosed_ml"] = result["ph_up_ml"] + result["ph_down_ml"]
+    result["actions"] = len(actions)
+    return result
+
+def rank(results):
+    '''
+    Returns the results sorted best first: most time_in_band, then least dosed_ml, then fewest actions
+    A time_in_band of NaN (no readings to score) is ranked last
+    '''
+    def key(result):
+        unscored = math.isnan(result["time_in_band"])
+        return (unscored,0. if unscored else -result["time_in_band"],result["dosed_ml"],result["actions"])
+    return sorted(results,key=key)
+
+def sweep(settings,workers=None,verbose=False,**kwargs):
+    '''
+    Evaluate every setting on a process pool and return the ranked results
+    settings: list of dicts, ie from grid()
+    workers: None or int, processes to use. None for one per core, 1 to run in this process
+    verbose: Boolean, Output each result as it finishes
+    kwargs: passed to evaluate_setting()
+    '''
+    evaluate = functools.partial(evaluate_setting,**kwargs)
+    results = []
+    if workers == 1:
+        for setting in settings:
+            results.append(evaluate(setting))
+            if verbose:
+                print("Sweep: {} of {} {}".format(len(results),len(settings),results[-1]))
+        return rank(results)
+
+    context = multiprocessing.get_context("spawn") # do not fork the threads of the parent
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers,mp_context=context) as executor:
+        futures = [executor.submit(evaluate,setting) for setting in settings]
+        for future in concurrent.futures.as_completed(futures):
+            results.append(future.result())
+            if verbose:
+                print("Sweep: {} of {} {}".format(len(results),len(settings),results[-1]))
+    return rank(results)
+
+columns = ["ph_min","ph_max","dispense_volume","control_every","average_factor","time_in_band","dosed_ml","ph_up_ml","ph_down_ml","actions"]
+
+def format_table(results):
+    '''
+    Return the ranked results as a text table
+    '''
+    lines = ["{:>4} {:>6} {:>6} {:>8} {:>8} {:>7} {:>8} {:>9} {:>7}".format("rank","ph_min","ph_max","dose ml","every s","factor","in band","dosed ml","actions")]
+    for ii,result in enumerate(results):
+        lines.append("{:>4} {ph_min:>6.2f} {ph_max:>6.2f} {dispense_volume:>8.2f} {control_every:>8.0f} {average_factor:>7.3f} {time_in_band:>8.1%} {dosed_ml:>9.1f} {actions:>7}".format(ii+1,**result))
+    return "\n".join(lines)
+
+def write_table(results,path):
+    '''
+    Write the ranked results to a csv file at path
+    '''
+    with open(path,'w') as fp:
+        fp.write(",".join(["rank"] + columns) + "\n")
+        for ii,result in enumerate(results):
+            fp.write(",".join([str(ii+1)] + [str(result[column]) for column in columns]) + "\n")
+
+if __name__ == "__main__":
+    from .calibration_store import Calibration_Store
+
+    def floats(value):
+        return [float(item) for item in value.split(",")]
+
+    parser = argparse.ArgumentParser(description="Sweep the ph controller settings over recorded data")
+    parser.add_argument("--data",required=True,help="directory of the recorded daily csv files")
+    parser.add_argument("--ph",required=True,help="output_file_base of the recorded ph sensor, ie sensor_ph_bin1")
+    parser.add_argument("--ph-calibration",default=None,help="calibration json of the ph sensor. By default the one in effect at --start in the calibration store of --data")
+    parser.add_argument("--start",required=True,help="first day to replay, YYYY-MM-DD")
+    parser.add_argument("--end",required=True,help="last day to replay, YYYY-MM-DD")
+    parser.add_argument("--output",required=True,help="csv file to write the ranked table to")
+    parser.add_argument("--ph-min",type=floats,default=[5.8,5.9,6.0])
+    parser.add_argument("--ph-max",type=floats,default=[6.1,6.2,6.3])
+    parser.add_argument("--dispense-volume",type=floats,default=[1.5,3.0])
+    parser.add_argument("--control-every",type=floats,default=[15*60,30*60,60*60])
+    parser.add_argument("--average-factor",type=floats,default=[0.9,0.99])
+    parser.add_argument("--target-min",type=float,default=5.8,help="low end of the pH band the settings are scored in")
+    parser.add_argument("--target-max",type=float,default=6.2,help="high end of the pH band the settings are scored in")
+    parser.add_argument("--ph-per-ml",type=float,default=0.05,help="pH change of the reservoir per ml dosed")
+    parser.add_argument("--recovery-time",type=float,default=6*60*60,help="seconds for a dose to wear off 63%% of the way")
+    parser.add_argument("--warmup-time",type=float,default=10*60)
+    parser.add_argument("--workers",type=int,default=None,help="processes to run, default one per core")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    start = datetime.datetime.strptime(args.start,"%Y-%m-%d").timestamp()
+    end = (datetime.datetime.strptime(args.end,"%Y-%m-%d") + datetime.timedelta(days=1)).timestamp()
+    if args.ph_calibration is None:
+        entry = Calibration_Store(args.data).lookup("Sensor_ph",args.ph,start)
+        if entry is None:
+            raise ValueError("No calibration of {} before {} in {}, pass --ph-calibration".format(args.ph,args.start,args.data))
+        args.ph_calibration = entry["path"]
+
+    settings = grid(args.ph_min,args.ph_max,args.dispense_volume,args.control_every,args.average_factor)
+    print("Sweeping {} settings on {} processes".format(len(settings),args.workers or os.cpu_count()))
+    results = sweep(settings,
+                    workers=args.workers,
+                    verbose=True,
+                    data_path=args.data,
+                    sensor=args.ph,
+                    start=start,
+                    end=end,
+                    calibration_file=args.ph_calibration,
+                    target_min=args.target_min,
+                    target_max=args.target_max,
+                    ph_per_ml=args.ph_per_ml,
+                    recovery_time=args.recovery_time,
+                    warmup_time=args.warmup_time)
+    print(format_table(results))
+    write_table(results,args.output)
+    print("Saved the ranked table to {} after {:.1f} s".format(args.output,time.time()-start_time))
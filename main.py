@@ -1,35 +1,191 @@
 '''
 Simple grow controller
-All values are hardcoded in to the files
+The sensors, pumps and controllers of every bin are read from a config file, see growControl/registry.py
 
 Will read ph, temp, humidity and save values to individual files
 Will control ph using 2 pumps
+
+    python main.py --config grow_control.json
 '''
+import argparse
 import time
 import datetime
 import os
-from growControl import Sensor_ph, Controller_ph_Pump, Sensor_humidity_temp, Controllable_Pump,Sensor_volume
+import queue
+import threading
+from growControl import Scheduler
+from growControl.registry import Registry
+from growControl.supervisor import Supervisor
 
 from blessed import Terminal
 
+class Renderer():
+    '''
+    Draws the screen by writing only the lines that changed since the last frame
+
+    A frame is a dict of (left,top) -> (text,width). Each line is padded to its width so a shorter value
+        overwrites the old one, and is only written if it differs from the line drawn there last frame.
+        Lines that are no longer in the frame are blanked. The whole screen is cleared and redrawn when
+        the terminal is resized, or after invalidate() when something else has drawn on the screen.
+    '''
+    def __init__(self,term):
+        self.term = term
+        self.previous = {} # (left,top) -> padded text drawn there
+        self.size = None # (width,height) of the terminal the previous frame was drawn on
+
+    def invalidate(self):
+        '''
+        Force a full redraw on the next frame, ie after a menu item drew over the screen
+        '''
+        self.size = None
+
+    def render(self,frame):
+        '''
+        Write the changes between frame and the previous frame to the terminal
+        '''
+        output = ""
+        size = (self.term.width,self.term.height)
+        if size != self.size:
+            output += self.term.clear
+            self.previous = {}
+            self.size = size
+
+        current = {}
+        for position,(text,width) in frame.items():
+            text = self.term.ljust(text,width)
+            current[position] = text
+            if self.previous.get(position) != text:
+                output += self.term.move_xy(*position) + text
+        for position,text in self.previous.items():
+            if position not in current:
+                output += self.term.move_xy(*position) + " "*self.term.length(text)
+        self.previous = current
+
+        if len(output) > 0:
+            print(output,end="",flush=True)
+
 def sensor_box(top,left,width,name,current,average):
-    data = term.move_xy(left,top)
-    data += term.on_green(name + " "*(width-len(name)))
     current_value = "{:.3f}".format(current) if type(current) is float else "-"
     average_value = "{:.3f}".format(average) if type(average) is float else "-"
-    data += term.move_xy(left+2,top+1) + "Current Value: " + current_value
-    data += term.move_xy(left+2,top+2) + "Average Value: " + average_value
-    return data
+    return {(left,top):(term.on_green(name + " "*(width-len(name))),width),
+            (left+2,top+1):("Current Value: " + current_value,width-2),
+            (left+2,top+2):("Average Value: " + average_value,width-2)}
 
 def controller_box(top,left,width,name,action,action_time,loop_time):
-    data = term.move_xy(left,top)
-    data += term.on_green(name + " "*(width-len(name)))
     action_time_value = "{:.0f}".format(time.time() - action_time) if type(action_time) is float else "-"
     loop_time_value = "{:.0f}".format(time.time() - loop_time) if type(loop_time) is float else "-"
-    data += term.move_xy(left+2,top+1) + "Last Action: {}".format(action)
-    data += term.move_xy(left+2,top+2) + "Time since last action: " + action_time_value + " s"
-    data += term.move_xy(left+2,top+3) + "Time since last loop: " + loop_time_value + " s"
-    return data
+    return {(left,top):(term.on_green(name + " "*(width-len(name))),width),
+            (left+2,top+1):("Last Action: {}".format(action),width-2),
+            (left+2,top+2):("Time since last action: " + action_time_value + " s",width-2),
+            (left+2,top+3):("Time since last loop: " + loop_time_value + " s",width-2)}
+
+def diagnostics_box(top,left,width,name,latency,max_rows,labels=None):
+    '''
+    Show how long the calls to each device take
+    latency: dict of device key -> latency summary, from the Scheduler or the Supervisor
+    labels: None or dict of device key -> label shown in place of the key, also for the "<key> read" entries
+    If there are more devices than max_rows, the ones with the slowest p95 are shown
+    '''
+    def ms(seconds):
+        return "{:.1f}".format(seconds*1000.) if type(seconds) is float else "-"
+
+    summaries = list(latency.items())
+    if len(summaries) > max_rows:
+        summaries.sort(key=lambda item: item[1]["p95"] or 0.,reverse=True)
+        summaries = summaries[:max_rows]
+        name = "{} (slowest {} of {})".format(name,max_rows,len(latency))
+
+    lines = {(left,top):(term.on_green(name + " "*(width-len(name))),width),
+            (left+2,top+1):("{:<22}{:>8}{:>8}{:>9} {}".format("Device","p50 ms","p95 ms","max ms","work/calls"),width-2)}
+    for idx,(device_name,summary) in enumerate(summaries):
+        if labels is not None:
+            key,_,suffix = device_name.partition(" ")
+            device_name = (labels.get(key,key) + " " + suffix).strip()
+        lines[(left+2,top+2+idx)] = ("{:<22}{:>8}{:>8}{:>9} {}/{}".format(device_name[:21],
+                                                                        ms(summary["p50"]),
+                                                                        ms(summary["p95"]),
+                                                                        ms(summary["recent_max"]),
+                                                                        summary["work"],
+                                                                        summary["calls"]),width-2)
+    return lines
+
+def device_boxes(statuses):
+    '''
+    Returns a list of (box function, keyword arguments) for every value of every sensor and every controller
+    statuses: list of dict from Registered_Device.status(), in the order of the config
+    '''
+    boxes = []
+    for status in statuses:
+        if "values" in status:
+            for value_name,current,average in status["values"]:
+                name = status["label"] if len(status["values"]) == 1 else "{} {}".format(status["label"],value_name)
+                boxes.append((sensor_box,{"name":name,
+                                            "current":current,
+                                            "average":average}))
+        else:
+            boxes.append((controller_box,{"name":status["label"],
+                                            "action":status["last_action"],
+                                            "action_time":status["last_action_time"],
+                                            "loop_time":status["last_loop_time"]}))
+    return boxes
+
+class Input_Thread(threading.Thread):
+    '''
+    Reads the keyboard on its own thread and puts ("key",<key>) on the event queue
+    This way a key press is seen right away, even while the main loop is blocked in a device call
+    '''
+    def __init__(self,term,events):
+        super().__init__(name="Input",daemon=True)
+        self.term = term
+        self.events = events
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            val = self.term.inkey(timeout=0.1) # how often to check if the thread has been stopped
+            if val:
+                self.events.put(("key",val))
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+class Published_Device():
+    '''
+    Calls a device for the Scheduler and puts ("device",<name>) on the event queue when it has new values
+    A sensor that reads on an executor publishes when the read completes
+    '''
+    def __init__(self,device,name,events):
+        self.device = device
+        self.name = name
+        self.events = events
+
+    def __call__(self):
+        did_work = self.device()
+        if did_work is not False:
+            pending_read = getattr(self.device,"pending_read",None)
+            if (pending_read is not None) and (not pending_read.done()):
+                pending_read.add_done_callback(lambda future: self.events.put(("device",self.name)))
+            else:
+                self.events.put(("device",self.name))
+        return did_work
+
+def wait_for_key(timeout=None):
+    '''
+    Wait for the next key press from the input thread, device events that arrive while waiting are dropped
+    Returns the key, or "" if timeout seconds pass without one
+    '''
+    end_time = None if timeout is None else time.time() + timeout
+    while True:
+        remaining = None if end_time is None else end_time - time.time()
+        if remaining is not None and remaining <= 0:
+            return ""
+        try:
+            kind,value = events.get(timeout=remaining)
+        except queue.Empty:
+            return ""
+        if kind == "key":
+            return value
 
 class MenuItem():
     '''
@@ -60,7 +216,7 @@ def pause():
         text = "System Paused! Press 'p' to resume"
         screen = term.move_xy(0,3)+ term.center(term.white_on_firebrick3(text))
         print(screen)
-        val=term.inkey(timeout=None) # block until user presses a key
+        val = wait_for_key(timeout=None) # block until user presses a key
     return
 
 def quit():
@@ -74,7 +230,7 @@ def quit():
             raise KeyboardInterrupt()
         elif val == "n":
             break
-        val = term.inkey(timeout=None)
+        val = wait_for_key(timeout=None)
     return
 
 def ph_calibration():
@@ -92,7 +248,7 @@ def ph_calibration():
 
     while True:
         mode = "4ph"
-        val = term.inkey(timeout=.5) # how often to update the screen 
+        val = wait_for_key(timeout=.5) # how often to update the screen 
         screen = term.clear()
         screen += term.move_xy(0,5) + term.center("pH Calibration Screen")
         
@@ -108,7 +264,7 @@ def ph_calibration():
 
     while True:
         mode = "7ph"
-        val = term.inkey(timeout=.5) # how often to update the screen 
+        val = wait_for_key(timeout=.5) # how often to update the screen 
         screen = term.clear()
         screen += term.move_xy(0,5) + term.center("pH Calibration Screen")
         
@@ -125,7 +281,7 @@ def ph_calibration():
 
     while True:
         mode = "save"
-        val = term.inkey(timeout=.5) # how often to update the screen 
+        val = wait_for_key(timeout=.5) # how often to update the screen 
         screen = term.clear()
         screen += term.move_xy(0,5) + term.center("pH Calibration Screen")
         
@@ -169,186 +325,172 @@ class MenuItems():
             raise StopIteration
 
     def __str__(self):
+        s = ""
+        for (x,y),(text,width) in self.lines().items():
+            s += term.move_xy(x,y) + text
+        return s
+
+    def lines(self):
+        '''
+        Returns the menu as a frame for the Renderer, (left,top) -> (text,width)
+        '''
         n_cols = 3
         n_rows = len(self.items)//n_cols + 1
         col_width = term.width//n_cols
 
         title = "Commands"
-        s = term.move_xy(term.width//2-len(title)//2, term.height-n_rows-1) + term.on_darkolivegreen(title)
+        lines = {(term.width//2-len(title)//2, term.height-n_rows-1):(term.on_darkolivegreen(title),len(title))}
         for idx, item in enumerate(self.items):
             x = idx%n_cols * col_width
             y = term.height - n_rows + idx//n_cols
-            s += term.move_xy(x,y) + str(item)
-        return s
+            lines[(x,y)] = (str(item),col_width)
+        return lines
    
+def draw_screen():
+    '''
+    Draw the status of every device, the title, and the menu
+    The boxes fill as many columns as fit left of the diagnostics, in the order of the config
+    Only the lines that changed since the last call are written, see Renderer
+    '''
+    screen = {}
+
+    menu = menuItems.lines()
+    menu_top = min(y for (x,y) in menu.keys())
+    n_cols = max(1,(term.width - left - diagnostics_width) // (cols_per_device + col_padding))
+    n_rows = max(1,(menu_top - top) // rows_per_device)
+    if supervisor is None:
+        statuses = [entry.status() for entry in registry.scheduled()]
+        latency = scheduler.latency_summary()
+        missed_deadlines = scheduler.missed_deadlines
+    else: # the devices run in the worker processes
+        statuses = supervisor.statuses()
+        latency = supervisor.latency_summary()
+        missed_deadlines = sum(supervisor.missed_deadlines.values())
+    boxes = device_boxes(statuses)
+    for idx,(box,kwargs) in enumerate(boxes[:n_cols*n_rows]): # the rest do not fit on the terminal
+        screen.update(box(top=top + (idx//n_cols)*rows_per_device,
+                            left=left + (idx%n_cols)*(cols_per_device + col_padding),
+                            width=cols_per_device,
+                            **kwargs))
+
+    screen.update(diagnostics_box(top=top,
+                                left=left + n_cols*(cols_per_device + col_padding),
+                                width=diagnostics_width,
+                                name="Diagnostics",
+                                latency=latency,
+                                max_rows=max(1,menu_top - top - 3),
+                                labels={status["key"]:status["label"] for status in statuses}))
+
+    # Handle the titles and menu
+    uptime = datetime.datetime.now() - start_dt
+    uptime = str(uptime).split(".")[0] # get the delta, strip off decimal seconds
+    title = term.on_darkolivegreen("Grow Control")
+    screen[(0,1)] = (term.center(title),term.width)
+    title = "Started {} Uptime {} Missed deadlines {}".format(start_dt_string,uptime,missed_deadlines)
+    if supervisor is not None:
+        title += " Workers {} Restarts {}".format(len(supervisor.workers),supervisor.restarts())
+    if len(boxes) > n_cols*n_rows:
+        title += " Showing {} of {} devices".format(n_cols*n_rows,len(boxes))
+    screen[(0,2)] = (term.center(title),term.width)
+
+    screen.update(menu)
+    renderer.render(screen)
+
 if __name__ == "__main__":
 
+    parser = argparse.ArgumentParser(description="Read the sensors and run the controllers of the grow bins")
+    parser.add_argument("--config",default=os.path.join(os.path.dirname(os.path.abspath(__file__)),"grow_control.json"),
+                        help="json or toml file describing the devices of each bin")
+    parser.add_argument("--workers",type=int,default=None,
+                        help="run the bins in this many worker processes, 0 for one per core. By default everything runs in this process")
+    parser.add_argument("--verbose",action="store_true")
+    args = parser.parse_args()
+
     # settings for how the UI is layed out
     top = 5
     left = 2
     rows_per_device = 5
     cols_per_device = 35
     col_padding = 2
-
-
-    # Settings for the controller
-    # set to 6.0/6.4 from 5.7/6.0 on 20200422T2310 to conserve ph solution
-    ph_min = 6.0 # set to 5.0 from 5.7 on 20200329T1045 to see where the system wants to be
-    ph_max = 6.4
-    average_factor = 0.99
-    verbose = False
-    output_dir = "/home/pi/growControl_Data/"
-
-    sensor_ph = Sensor_ph(output_file_path=output_dir,
-                            output_file_base="sensor_ph_bin1",
-                            average_factor=average_factor,
-                            read_every=10.0,
-                            #csv="test/test_inputs/sensor_ph_sinewave01_voltage.csv",
-                            #calibrate_on_startup=True,
-                            #calibration_file="test/test_inputs/sensor_ph_calibration_mock.json",
-                            calibrate_on_startup=False,
-                            verbose=verbose)
-
-    pump_up = Controllable_Pump(27,verbose=verbose)
-    pump_down = Controllable_Pump(17,verbose=verbose)
-    controller = Controller_ph_Pump(sensor_ph,
-                                    pump_up,
-                                    pump_down,
-                                    ph_min=ph_min,
-                                    ph_max=ph_max,
-                                    output_file_path=output_dir,
-                                    output_file_base="controller_ph_pump",
-                                    ml_per_s=1.75, # ml/sec, measured 3.5ml in 2 seconds on 20200213
-                                    dispense_volume=3, # ml
-                                    control_every=30*60,
-                                    warmup_time=30.*60,
-                                    verbose=verbose)
-    
-    # factors for temp and humidity:
-    # read_every [sec] | Factor | Time to settle from 50 to 25 (<5% error) [minutes]
-    #       15                  .9              7.25
-    #       15                  .8              3.50
-    #       30                  .9              14.5
-    #       30                  .8              7.00
-    sensor_ht_ambient = Sensor_humidity_temp(output_file_path=output_dir,
-                                                output_file_base="humidity_temp_ambient",
-                                                gpio_pin=18,
-                                                read_every=30.0,
-                                                average_factor_temp=0.8,
-                                                average_factor_humidity=0.8,
-                                                #csv="test/test_inputs/sensor_humidity_temp_input.csv",
-                                                verbose=False)
-    
-    sensor_ht_grow = Sensor_humidity_temp(output_file_path=output_dir,
-                                                output_file_base="humidity_temp_grow",
-                                                gpio_pin=23,
-                                                #csv="test/test_inputs/sensor_humidity_temp_input.csv",
-                                                read_every=30.0,
-                                                average_factor_temp=0.8,
-                                                average_factor_humidity=0.8,
-                                                verbose=verbose)
-
-    sensor_volume = Sensor_volume(output_file_path=output_dir,
-                                    output_file_base="sensor_volume",
-                                    trigger_pin=20,
-                                    echo_pin=21,
-                                    iterations_per_reading=5,
-                                    average_factor=0.9,
-                                    read_every=30.,
-                                    calibration_file=None,
-                                    calibrate_on_startup=False,
-                                    verbose=False)
+    diagnostics_width = 62
+    clock_refresh_every = 5.0 # seconds, how often the uptime and time since last action are redrawn when nothing else changes
+
+    if args.workers is None:
+        # All of the devices share one Output_Writer, the rows are written to disk from a background thread
+        # The DHT reads retry for up to 1.5s, they run on the executor of the registry so the sensors are read at the same time
+        registry = Registry(args.config,verbose=args.verbose)
+        supervisor = None
+        output_dir = registry.output_dir
+
+        # The calibration screen calibrates the first ph sensor of the config
+        ph_sensors = registry.of_type("Sensor_ph")
+        sensor_ph = ph_sensors[0].device if len(ph_sensors) > 0 else None
+    else:
+        # Each worker process runs some of the bins so a blocking read only delays its own bins
+        # The sensors are in the workers, so they can not be calibrated from here
+        registry = None
+        supervisor = Supervisor(args.config,n_workers=args.workers or None,verbose=args.verbose)
+        output_dir = supervisor.output_dir
+        sensor_ph = None
 
     start_dt = datetime.datetime.now()
     start_dt_string = start_dt.strftime("%m-%d %H:%M")
 
     term = Terminal()
+    renderer = Renderer(term)
     with term.cbreak(), term.hidden_cursor(), term.fullscreen():
 
         menuItems = MenuItems()
         menuItems.addItem(MenuItem(name="Quit",key="q",function=quit))
         menuItems.addItem(MenuItem(name="Pause",key="p",function=pause))
-        menuItems.addItem(MenuItem(name="Calibrate pH",key="c",function=ph_calibration))
+        if sensor_ph is not None:
+            menuItems.addItem(MenuItem(name="Calibrate pH",key="c",function=ph_calibration))
+
+        # Key presses and devices with new values put events here, the screen is only redrawn when one arrives
+        events = queue.Queue()
+        input_thread = Input_Thread(term,events)
+        input_thread.start()
+
+        # Each device is called when it is due, the loop sleeps until the next one is due or an event arrives
+        scheduler = Scheduler(late_tolerance=1.0)
+        if supervisor is None:
+            registry.schedule(scheduler,wrap=lambda entry: Published_Device(entry.device,entry.label,events))
+        else:
+            supervisor.on_update = lambda key: events.put(("device",key))
+            supervisor.start()
+        scheduler.add(draw_screen,clock_refresh_every,name="Screen") # keep the uptime and time since last action current
 
         try:
+            draw_screen()
             while True:
-                sensor_ph()
-                sensor_ht_ambient()
-                sensor_ht_grow()
-                sensor_volume()
-                controller()
-
-                val = term.inkey(timeout=.5) # how often to update the screen 
-                
-                for item in menuItems:
-                    if val.lower() == item.key:
-                        item()
-
-                screen = term.clear
-
-                # ph sensor
-                sensor = sensor_box(top=top,
-                                    left=left,
-                                    width=cols_per_device,
-                                    name="pH Sensor",
-                                    current=sensor_ph.ph_raw,
-                                    average=sensor_ph.ph_avg)
-                screen += sensor
-                sensor = controller_box(top=top,
-                                        left=left + col_padding + cols_per_device,
-                                        width=cols_per_device,
-                                        name="pH Controller",
-                                        action=controller.last_action,
-                                        action_time=controller.last_action_time,
-                                        loop_time=controller.last_loop_time)
-                screen += sensor
-
-                sensor = sensor_box(top=top+rows_per_device,
-                                    left=left,
-                                    width=cols_per_device,
-                                    name="Ambient Temperature Sensor",
-                                    current=sensor_ht_ambient.temp_raw,
-                                    average=sensor_ht_ambient.temp_avg)
-                screen += sensor
-                sensor = sensor_box(top=top+rows_per_device,
-                                    left=left + col_padding + cols_per_device,
-                                    width=cols_per_device,
-                                    name="Ambient Humidity Sensor",
-                                    current=sensor_ht_ambient.humidity_raw,
-                                    average=sensor_ht_ambient.humidity_avg)
-                screen += sensor
-                
-                sensor = sensor_box(top=top+2*rows_per_device,
-                                    left=left,
-                                    width=cols_per_device,
-                                    name="Chamber Temperature Sensor",
-                                    current=sensor_ht_grow.temp_raw,
-                                    average=sensor_ht_grow.temp_avg)
-                screen += sensor
-                sensor = sensor_box(top=top+2*rows_per_device,
-                                    left=left + col_padding + cols_per_device,
-                                    width=cols_per_device,
-                                    name="Chamber Humidity Sensor",
-                                    current=sensor_ht_grow.humidity_raw,
-                                    average=sensor_ht_grow.humidity_avg)
-                screen += sensor
-                sensor = sensor_box(top=top+3*rows_per_device,
-                                    left=left,
-                                    width=cols_per_device,
-                                    name="Volume Sensor",
-                                    current=sensor_volume.volume_raw,
-                                    average=sensor_volume.volume_avg)
-                screen += sensor
-
-                # Handle the titles and menu
-                uptime = datetime.datetime.now() - start_dt
-                uptime = str(uptime).split(".")[0] # get the delta, strip off decimal seconds
-                title = term.on_darkolivegreen("Grow Control")
-                screen += term.move_xy(0,1) + term.center(title)
-                title = "Started {} Uptime {}".format(start_dt_string,uptime)
-                screen += term.move_xy(0,2) + term.center(title)
-
-                screen += str(menuItems)
-                print(screen)
+                scheduler.run_pending()
+
+                try:
+                    event = events.get(timeout=scheduler.time_until_next())
+                except queue.Empty:
+                    continue
+
+                # handle everything that has arrived, then draw once
+                while event is not None:
+                    kind,value = event
+                    if kind == "key":
+                        for item in menuItems:
+                            if value.lower() == item.key:
+                                item()
+                                renderer.invalidate() # the menu items draw over the screen
+                    try:
+                        event = events.get_nowait()
+                    except queue.Empty:
+                        event = None
+                draw_screen()
         except KeyboardInterrupt:
             pass
+        finally:
+            input_thread.stop()
+            latency_file = os.path.join(output_dir,"latency_{}.json".format(datetime.datetime.now().strftime("%Y%m%dT%H%M%S")))
+            if supervisor is None:
+                registry.close() # turns off the pumps, writes the partial rollups and everything queued
+                scheduler.dump_latency(latency_file)
+            else:
+                supervisor.stop() # each worker closes its registry
+                supervisor.dump_latency(latency_file)
\ No newline at end of file
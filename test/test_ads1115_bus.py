@@ -0,0 +1,96 @@
+from unittest import TestCase
+import tempfile
+import os
+import shutil
+
+from growControl import Sensor_ph, ADS1115_Bus_Manager, Fake_ADS1115, Virtual_Clock
+
+class test_ADS1115_Bus_Manager(TestCase):
+    '''
+    Test cases for the ADS1115_Bus_Manager class
+    '''
+
+    def test_bus_manager_passes(self):
+        '''
+        Verifies:
+            * Each chip is opened once and the same input registered twice is one channel
+            * A read converts every channel in one pass, the chips taking turns
+            * Reads within scan_max_age of the pass use its values, max_age=0 converts only that channel
+            * A failed conversion reads as None, a missing chip raises OSError when registered
+        '''
+        clock = Virtual_Clock(start=1600000000.)
+        fake = Fake_ADS1115(addresses=[0x48,0x49])
+        manager = ADS1115_Bus_Manager(backend=fake,scan_max_age=0.1,clock=clock)
+        channels = {}
+        for address,pin in [(0x48,0),(0x48,1),(0x49,0),(0x48,2)]:
+            fake.set_voltage(address,pin,address + pin/10.)
+            channels[(address,pin)] = manager.register(address,pin)
+        self.assertIs(manager.register(0x48,0),channels[(0x48,0)])
+        self.assertEqual(fake.opened,[0x48,0x49])
+        self.assertRaises(ValueError,manager.register,0x48,0,gain=1)
+        self.assertRaises(ValueError,manager.register,0x48,4)
+        self.assertRaises(OSError,manager.register,0x4a,0)
+
+        self.assertEqual(channels[(0x48,1)].read(),0x48 + 0.1)
+        self.assertEqual(fake.conversions,[(0x48,0),(0x49,0),(0x48,1),(0x48,2)])
+        self.assertEqual(channels[(0x49,0)].read(),0x49)
+        self.assertEqual(manager.passes,1)
+
+        clock.advance(0.2)
+        fake.set_voltage(0x48,2,None)
+        self.assertEqual(channels[(0x48,0)].read(),0x48)
+        self.assertEqual(manager.passes,2)
+        self.assertIsNone(channels[(0x48,2)].read())
+
+        fake.set_voltage(0x48,0,lambda: 0.5)
+        self.assertEqual(channels[(0x48,0)].read(max_age=0.),0.5)
+        self.assertEqual(manager.passes,2)
+        self.assertEqual(manager.conversions,9)
+
+    def test_sensor_ph_bus(self):
+        '''
+        Verifies:
+            * Several ph sensors on different chips and inputs share the bus, the first one due makes the pass
+            * A burst converts its own input for each sample
+        '''
+        clock = Virtual_Clock(start=1600000000.)
+        fake = Fake_ADS1115(addresses=[0x48,0x49])
+        manager = ADS1115_Bus_Manager(backend=fake,clock=clock)
+        tmp_dir = os.path.join(tempfile.mkdtemp(),"")
+        try:
+            sensors = []
+            for address,pin,voltage in [(0x48,0,0.057),(0x48,3,0.),(0x49,1,-0.057)]:
+                fake.set_voltage(address,pin,voltage)
+                sensors.append(Sensor_ph(tmp_dir,"sensor_ph_{:x}_{}".format(address,pin),
+                                        average_factor=0.,
+                                        read_every=10.,
+                                        calibration_file="test/test_inputs/sensor_ph_calibration_mock.json",
+                                        calibrate_on_startup=False,
+                                        bus_manager=manager,
+                                        ads1115_address=address,
+                                        ads1115_pin=pin,
+                                        clock=clock))
+            burst = Sensor_ph(tmp_dir,"sensor_ph_burst",
+                                read_every=10.,
+                                calibration_file="test/test_inputs/sensor_ph_calibration_mock.json",
+                                calibrate_on_startup=False,
+                                burst_samples=5,
+                                bus_manager=manager,
+                                ads1115_address=0x48,
+                                ads1115_pin=2,
+                                clock=clock)
+
+            for ii in range(3):
+                for sensor in sensors:
+                    self.assertTrue(sensor())
+                clock.advance(10.)
+            self.assertEqual(manager.passes,3)
+            self.assertEqual([sensor.voltage_raw for sensor in sensors],[0.057,0.,-0.057])
+            self.assertTrue(sensors[0].ph_raw < sensors[1].ph_raw < sensors[2].ph_raw)
+
+            n_conversions = len(fake.conversions)
+            burst()
+            self.assertEqual(fake.conversions[n_conversions:],[(0x48,2)]*5)
+            self.assertEqual(burst.voltage_raw,0.)
+        finally:
+            shutil.rmtree(tmp_dir)
@@ -0,0 +1,127 @@
+from unittest import TestCase
+import tempfile
+import datetime
+import math
+import os
+import shutil
+
+from growControl import Sensor_humidity_temp, Output_Writer, Output_Rotation, Virtual_Clock
+from growControl.binary_storage import binary_header, encode_record, read_header, load_binary, export_csv, repair_binary
+from growControl.output_writer import append_to_file
+
+class test_binary_storage(TestCase):
+    '''
+    Test cases for the binary storage format
+    '''
+
+    def assertFloatsClose(self,a,b,eps=1e-6):
+        '''
+        Asserts that a and b are within eps of eachother
+        '''
+        delta = abs(a-b)
+        self.assertTrue(delta < eps,msg="Floats {} and {} are not within {} of eachother.".format(a,b,eps))
+
+    def test_binary_storage_round_trip(self):
+        '''
+        Verifies:
+            * The header is read back with the records aligned to 8 bytes
+            * Records are loaded with and without memory mapping, None is loaded as NaN
+            * A partially written record is ignored
+            * The csv export matches the csv storage format
+        '''
+        tmp_dir = tempfile.mkdtemp()
+        path = os.path.join(tmp_dir,"binary_storage_test.bin")
+        csv_path = os.path.join(tmp_dir,"binary_storage_test.csv")
+        try:
+            with open(path,'wb') as fp:
+                fp.write(binary_header(["time","a","b"]))
+                fp.write(encode_record(100.5,[1.0,None]))
+                fp.write(encode_record(101.5,[2.0,3.0]))
+                fp.write(encode_record(102.5,[4.0,5.0])[:10]) # power failure part way through a record
+
+            columns,offset = read_header(path)
+            self.assertEqual(columns,["time","a","b"])
+            self.assertEqual(offset % 8,0)
+
+            for mmap in [True,False]:
+                data = load_binary(path,mmap=mmap)
+                self.assertEqual(len(data),2)
+                self.assertEqual(list(data["time"]),[100.5,101.5])
+                self.assertEqual(list(data["a"]),[1.0,2.0])
+                self.assertTrue(math.isnan(data["b"][0]))
+                del data
+
+            self.assertEqual(export_csv(path,csv_path),2)
+            with open(csv_path,'r') as fp:
+                lines = fp.readlines()
+            self.assertEqual(lines[0],"time,datetime_timezone,a,b\n")
+            t,_,a,b = lines[1].strip().split(",")
+            self.assertEqual((t,a,b),("100.5","1.0","None"))
+        finally:
+            for fname in os.listdir(tmp_dir):
+                os.remove(os.path.join(tmp_dir,fname))
+            os.rmdir(tmp_dir)
+
+    def test_binary_storage_repair(self):
+        '''
+        Verifies:
+            * A partially written record is removed before the file is appended to again, by the Output_Writer
+                and by the Output_Rotation for direct writes, so the records after it are not shifted
+        '''
+        tmp_dir = tempfile.mkdtemp()
+        clock = Virtual_Clock(start=1600000000.)
+        path = os.path.join(tmp_dir,"binary_repair_test_{}.bin".format(datetime.date.fromtimestamp(clock.time()).isoformat()))
+        try:
+            self.assertEqual(repair_binary(path),0)
+            for mode in ["writer","direct"]:
+                with open(path,'wb') as fp:
+                    fp.write(binary_header(["time","a"]))
+                    fp.write(encode_record(100.,[1.0]))
+                    fp.write(encode_record(101.,[2.0])[:5]) # the process died part way through a record
+
+                if mode == "writer":
+                    output_writer = Output_Writer()
+                    output_writer.write(path,encode_record(102.,[3.0]))
+                    output_writer.close()
+                else:
+                    rotation = Output_Rotation(clock=clock)
+                    key = rotation.register(tmp_dir,"binary_repair_test",binary_header(["time","a"]),extension=".bin")
+                    append_to_file(rotation.get_output_file(key),encode_record(102.,[3.0]))
+
+                data = load_binary(path,mmap=False)
+                self.assertEqual(list(data["time"]),[100.,102.],msg=mode)
+                self.assertEqual(list(data["a"]),[1.,3.],msg=mode)
+                self.assertEqual(repair_binary(path),0)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_binary_storage_sensor(self):
+        '''
+        Verifies:
+            * A sensor with storage="binary" writes a .bin file with its columns
+        '''
+        tmp_file = tempfile.gettempdir()
+        try:
+            th = Sensor_humidity_temp(output_file_path=tmp_file,
+                                        output_file_base="humidity_and_temp_binary",
+                                        gpio_pin=None,
+                                        read_every=0.,
+                                        average_factor_temp=0.9,
+                                        average_factor_humidity=0.8,
+                                        csv="test/test_inputs/sensor_humidity_temp_input.csv",
+                                        storage="binary",
+                                        verbose=False)
+            tmp_file = th.output_file
+            self.assertTrue(tmp_file.endswith(".bin"))
+            for ii in range(2):
+                th()
+
+            data = load_binary(tmp_file)
+            self.assertEqual(data.dtype.names,("time","relative_humidity_raw","relative_humidity_average","temperature_raw","temperature_average"))
+            self.assertEqual(len(data),2)
+            self.assertFloatsClose(data["relative_humidity_raw"][0],50.5)
+            self.assertTrue(math.isnan(data["relative_humidity_raw"][1]))
+            self.assertFloatsClose(data["temperature_average"][1],20.195)
+            del data
+        finally:
+            os.remove(tmp_file)
@@ -0,0 +1,83 @@
+from unittest import TestCase
+import tempfile
+import datetime
+import json
+import os
+import shutil
+
+from growControl import Sensor_ph, Calibration_Store, Virtual_Clock
+
+class test_Calibration_Store(TestCase):
+    '''
+    Test cases for the Calibration_Store class
+    '''
+
+    def test_calibration_store(self):
+        '''
+        Verifies:
+            * Legacy calibration files in the output directory are indexed once, the daily files are not
+            * The calibration in effect at a past time is found, a sensor's own calibration wins over the class wide one
+            * Saved calibrations are added to the index, which is shared by separate stores
+        '''
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            legacy_times = [datetime.datetime(2020,2,13,10),datetime.datetime(2020,4,22,23)]
+            for ii,t in enumerate(legacy_times):
+                with open(os.path.join(tmp_dir,"sensor_ph_calibration_raw_{}.json".format(t.isoformat())),'w') as fp:
+                    json.dump({"m":-17.+ii,"b":7.},fp)
+            with open(os.path.join(tmp_dir,"sensor_volume_calibration_raw_{}.json".format(legacy_times[0].isoformat())),'w') as fp:
+                json.dump({"m":2.,"b":1.},fp)
+            for day in range(30):
+                with open(os.path.join(tmp_dir,"sensor_ph_bin1_2020-03-{:02d}.csv".format(day+1)),'w') as fp:
+                    fp.write(Sensor_ph.output_header)
+
+            store = Calibration_Store(tmp_dir)
+            self.assertEqual(store.latest("Sensor_ph")["m"],-16.)
+            self.assertEqual(store.latest("Sensor_volume","sensor_volume")["m"],2.)
+            self.assertEqual(len(store.history("Sensor_ph","sensor_ph_bin1")),2)
+            self.assertEqual(store.lookup("Sensor_ph","sensor_ph_bin1",datetime.datetime(2020,3,1).timestamp())["m"],-17.)
+            self.assertIsNone(store.lookup("Sensor_ph",epoch=datetime.datetime(2020,1,1).timestamp()))
+            self.assertTrue(os.path.exists(store.latest("Sensor_ph")["path"]))
+
+            saved_at = datetime.datetime(2020,5,1).timestamp()
+            path = store.save("Sensor_ph","sensor_ph_bin2",{"m":-18.,"b":7.1,"4ph_raw":[0.1,0.2]},epoch=saved_at)
+            self.assertTrue(path.startswith(os.path.join(tmp_dir,"calibrations")))
+            with open(path,'r') as fp:
+                self.assertEqual(json.load(fp)["4ph_raw"],[0.1,0.2])
+
+            store = Calibration_Store(tmp_dir) # reads the index written by the first store
+            self.assertEqual(store.latest("Sensor_ph","sensor_ph_bin2")["m"],-18.)
+            self.assertEqual(store.latest("Sensor_ph","sensor_ph_bin1")["m"],-16.) # bin2's calibration is not bin1's
+            self.assertEqual(store.lookup("Sensor_ph","sensor_ph_bin2",saved_at-1.)["m"],-16.)
+            self.assertEqual(len(store.history("Sensor_ph")),3)
+
+            # The legacy files are not looked for again
+            os.remove(os.path.join(tmp_dir,"sensor_volume_calibration_raw_{}.json".format(legacy_times[0].isoformat())))
+            self.assertEqual(Calibration_Store(tmp_dir).latest("Sensor_volume")["m"],2.)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_sensor_ph_calibration_store(self):
+        '''
+        Verifies:
+            * A sensor without a calibration_file loads its newest calibration from the store
+            * A calibration saved by the sensor is used the next time it starts
+        '''
+        tmp_dir = os.path.join(tempfile.mkdtemp(),"")
+        try:
+            store = Calibration_Store(tmp_dir)
+            store.save("Sensor_ph","sensor_ph",{"m":-20.,"b":6.5})
+            s = Sensor_ph(tmp_dir,"sensor_ph",
+                            csv="test/test_inputs/sensor_ph_input.csv",
+                            calibrate_on_startup=False,
+                            clock=Virtual_Clock(start=1600000000.))
+            self.assertEqual((s.calibration_value_m,s.calibration_value_b),(-20.,6.5))
+
+            s._calibration_save_data({"m":-19.,"b":7.})
+            s = Sensor_ph(tmp_dir,"sensor_ph",
+                            csv="test/test_inputs/sensor_ph_input.csv",
+                            calibrate_on_startup=False,
+                            clock=Virtual_Clock(start=1600000000.))
+            self.assertEqual((s.calibration_value_m,s.calibration_value_b),(-19.,7.))
+        finally:
+            shutil.rmtree(tmp_dir)
@@ -0,0 +1,48 @@
+from unittest import TestCase
+import time
+
+from growControl import Real_Clock, Virtual_Clock
+
+class test_Clock(TestCase):
+    '''
+    Test cases for the Real_Clock and Virtual_Clock classes
+    '''
+
+    def test_virtual_clock(self):
+        '''
+        Verifies:
+            * Time only moves when advanced, and sleep() returns immediately
+            * Timers are called in order at their due time, and cancelled timers are not called
+        '''
+        clock = Virtual_Clock(start=100.)
+        self.assertEqual(clock.time(),100.)
+        self.assertEqual(clock.monotonic(),100.)
+
+        calls = []
+        clock.call_later(2.,lambda: calls.append(("b",clock.time())))
+        clock.call_later(1.,lambda: calls.append(("a",clock.time())))
+        cancelled = clock.call_later(1.5,lambda: calls.append(("cancelled",clock.time())))
+        cancelled.cancel()
+
+        start_time = time.time()
+        clock.sleep(1.)
+        self.assertEqual(calls,[("a",101.)])
+        clock.advance(5.)
+        self.assertTrue(time.time() - start_time < 0.1)
+        self.assertEqual(calls,[("a",101.),("b",102.)])
+        self.assertEqual(clock.time(),106.)
+
+        with self.assertRaises(ValueError):
+            clock.advance(-1.)
+
+    def test_real_clock(self):
+        '''
+        Verifies the real clock follows the system time and its timers fire
+        '''
+        clock = Real_Clock()
+        self.assertTrue(abs(clock.time() - time.time()) < 0.01)
+
+        calls = []
+        timer = clock.call_later(0.01,lambda: calls.append(1))
+        timer.join(1.)
+        self.assertEqual(calls,[1])
@@ -3,8 +3,9 @@ import tempfile
 import os
 import sys
 import time
+import shutil
 
-from growControl import Controller_ph_Pump, Sensor_ph, Controllable_Pump
+from growControl import Controller_ph_Pump, Sensor_ph, Controllable_Pump, Virtual_Clock
 
 class test_Controller_ph_Pump(TestCase):
     '''
@@ -28,6 +29,7 @@ class test_Controller_ph_Pump(TestCase):
             * warmup_time is obeyed
             * headers are correct
             '''
+        clock = Virtual_Clock(start=1600000000.)
         try:
             tmp_file_sensor_ph = tempfile.gettempdir()
             s = Sensor_ph(output_file_path=tmp_file_sensor_ph,
@@ -36,10 +38,11 @@ class test_Controller_ph_Pump(TestCase):
                             read_every=0.0, # read every chance it gets
                             csv="test/test_inputs/controller_ph_pump_test_ph_input_file.csv",
                             calibration_file="test/test_inputs/sensor_ph_calibration_mock.json",
-                            calibrate_on_startup=False)
+                            calibrate_on_startup=False,
+                            clock=clock)
             tmp_file_sensor_ph = s.output_file
-            pump_up = Controllable_Pump(gpio_pin=None)
-            pump_down = Controllable_Pump(gpio_pin=None)
+            pump_up = Controllable_Pump(gpio_pin=None,clock=clock)
+            pump_down = Controllable_Pump(gpio_pin=None,clock=clock)
 
             tmp_file_controller = tempfile.gettempdir()
             controller = Controller_ph_Pump(s,
@@ -52,22 +55,20 @@ class test_Controller_ph_Pump(TestCase):
                                             ml_per_s=5.0, # ml/sec
                                             dispense_volume=0.3, # ml
                                             control_every=0.15,
-                                            warmup_time=.25)
+                                            warmup_time=.25,
+                                            clock=clock)
             tmp_file_controller = controller.output_file
 
             self.assertFloatsClose(controller.dispense_time,0.06) # check dispense_time is correct
 
 
-            # To ensure this works across multiple computers, need to ensure
-            #   that the loop time is consistent. The spacings allow for 0.05s of error,
-            #   which should be plenty on any platform. 
+            # The virtual clock makes every loop take exactly expected_loop_time
             expected_loop_time = 0.1
-            start_time = time.time() # used to test the timings in the output file
+            start_time = clock.time() # used to test the timings in the output file
             for ii in range(10):
                 s()
                 controller()
-                loop_end = time.time()
-                time.sleep((start_time+(ii+1)*expected_loop_time) - loop_end) # force a loop to take a specific amount of time
+                clock.advance_to(start_time+(ii+1)*expected_loop_time)
 
             # Get the output file that was just made
             with open(tmp_file_controller,'r') as fp:
@@ -85,6 +86,7 @@ class test_Controller_ph_Pump(TestCase):
             
             # check that the headers are correct
             self.assertEqual(header,header_correct)
+            self.assertEqual(len(data),len(data_correct))
             
             for line, line_correct in zip(data,data_correct):
                 t, dt_tz, down_t, down_v, up_t, up_v = line
@@ -92,7 +94,7 @@ class test_Controller_ph_Pump(TestCase):
                  # make sure the times are saved correctly
                  # The looping logic ensures that a new loop is started every expected_loop_time
                  # t_c is relative to start of the run
-                self.assertFloatsClose(float(t),start_time+float(t_c),eps=.02)
+                self.assertFloatsClose(float(t),start_time+float(t_c),eps=1e-3)
 
                 self.assertFloatsClose(float(down_t),float(down_t_c))
                 self.assertFloatsClose(float(down_v),float(down_v_c))
@@ -106,3 +108,52 @@ class test_Controller_ph_Pump(TestCase):
             pump_up.cleanup()
             pump_down.cleanup()
 
+
+    def test_Controller_ph_Pump_pump_running(self):
+        '''
+        Verifies:
+            * No dispense is recorded while the pump is still running the last one
+            * The next control after the pump turned off dispenses again
+        '''
+        clock = Virtual_Clock(start=1600000000.)
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            s = Sensor_ph(output_file_path=os.path.join(tmp_dir,""),
+                            output_file_base="sensor_ph",
+                            read_every=0.0,
+                            csv="test/test_inputs/controller_ph_pump_test_ph_input_file.csv",
+                            calibration_file="test/test_inputs/sensor_ph_calibration_mock.json",
+                            calibrate_on_startup=False,
+                            clock=clock)
+            pump_up = Controllable_Pump(gpio_pin=None,clock=clock)
+            pump_down = Controllable_Pump(gpio_pin=None,clock=clock)
+            controller = Controller_ph_Pump(s,
+                                            pump_up,
+                                            pump_down,
+                                            output_file_path=os.path.join(tmp_dir,""),
+                                            output_file_base="controller_ph_pump",
+                                            ml_per_s=0.1,
+                                            dispense_volume=1.0, # 10 seconds of pumping
+                                            control_every=1.,
+                                            warmup_time=0.,
+                                            clock=clock)
+            s.ph_avg = 7.0
+            self.assertTrue(controller())
+            self.assertTrue(pump_down.is_running())
+            last_action_time = controller.last_action_time
+
+            clock.advance(5.)
+            self.assertTrue(controller())
+            self.assertEqual(controller.last_action_time,last_action_time)
+
+            clock.advance(5.)
+            self.assertFalse(pump_down.is_running())
+            self.assertTrue(controller())
+            self.assertEqual(controller.last_action_time,clock.time())
+
+            with open(controller.output_file,'r') as fp:
+                self.assertEqual(len(fp.readlines()),3) # header and the two dispenses
+        finally:
+            pump_up.cleanup()
+            pump_down.cleanup()
+            shutil.rmtree(tmp_dir)
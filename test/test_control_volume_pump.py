@@ -4,7 +4,7 @@ import os
 import sys
 import time
 
-from growControl import Controller_Volume_Pump, Sensor_volume, Controllable_Pump
+from growControl import Controller_Volume_Pump, Sensor_volume, Controllable_Pump, Virtual_Clock
 
 class test_Controller_Volume_Pump(TestCase):
     '''
@@ -28,6 +28,7 @@ class test_Controller_Volume_Pump(TestCase):
             * warmup_time is obeyed
             * headers are correct
             '''
+        clock = Virtual_Clock(start=1600000000.)
         try:
             tmp_file_sensor_volume = tempfile.gettempdir()
             s = Sensor_volume(output_file_path=tmp_file_sensor_volume,
@@ -38,9 +39,10 @@ class test_Controller_Volume_Pump(TestCase):
                             read_every=.099, # handle slight errors in loop time
                             average_factor=.8,
                             csv="test/test_inputs/controller_volume_pump_test_volume_input_file.csv",
+                            clock=clock,
                             verbose=False)
             tmp_file_sensor_volume = s.output_file
-            pump = Controllable_Pump(gpio_pin=None)
+            pump = Controllable_Pump(gpio_pin=None,clock=clock)
 
             tmp_file_controller = tempfile.gettempdir()
             controller = Controller_Volume_Pump(s,
@@ -51,23 +53,21 @@ class test_Controller_Volume_Pump(TestCase):
                                             ml_per_s=5.0, # ml/sec
                                             dispense_volume=0.3, # ml
                                             control_every=0.15,
-                                            warmup_time=.25)
+                                            warmup_time=.25,
+                                            clock=clock)
             tmp_file_controller = controller.output_file
 
             self.assertFloatsClose(controller.dispense_time,0.06) # check dispense_time is correct
 
 
-            # To ensure this works across multiple computers, need to ensure
-            #   that the loop time is consistent. The spacings allow for 0.05s of error,
-            #   which should be plenty on any platform. 
+            # The virtual clock makes every loop take exactly expected_loop_time
             expected_loop_time = 0.1
-            start_time = time.time() # used to test the timings in the output file
+            start_time = clock.time() # used to test the timings in the output file
             for ii in range(10):
                 s()
                 controller()
                 print("{:.2f}: average: {:.3f}".format(ii*.1,s.volume_avg))
-                loop_end = time.time()
-                time.sleep((start_time+(ii+1)*expected_loop_time) - loop_end) # force a loop to take a specific amount of time
+                clock.advance_to(start_time+(ii+1)*expected_loop_time)
 
             # Get the output file that was just made
             with open(tmp_file_controller,'r') as fp:
@@ -85,6 +85,7 @@ class test_Controller_Volume_Pump(TestCase):
 
             # check that the headers are correct
             self.assertEqual(header,header_correct)
+            self.assertEqual(len(data),len(data_correct))
             
             for line, line_correct in zip(data,data_correct):
                 t, dt_tz, dispense_time, dispense_volume = line
@@ -92,7 +93,7 @@ class test_Controller_Volume_Pump(TestCase):
                  # make sure the times are saved correctly
                  # The looping logic ensures that a new loop is started every expected_loop_time
                  # t_c is relative to start of the run
-                self.assertFloatsClose(float(t),start_time+float(t_c),eps=.02)
+                self.assertFloatsClose(float(t),start_time+float(t_c),eps=1e-3)
 
                 self.assertFloatsClose(float(dispense_time),float(dispense_time_c))
                 self.assertFloatsClose(float(dispense_volume),float(dispense_volume_c))
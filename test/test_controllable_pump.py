@@ -1,10 +1,9 @@
 from unittest import TestCase
-import tempfile
 import os
 import sys
 import time
 
-from growControl import Controllable_Pump
+from growControl import Controllable_Pump, Virtual_Clock
 
 class test_Controllable_Pump(TestCase):
     '''
@@ -21,14 +20,50 @@ class test_Controllable_Pump(TestCase):
     def test_Controllable_Pump(self):
         '''
         '''
-        cp = Controllable_Pump(gpio_pin=None)
+        clock = Virtual_Clock(start=0.)
+        cp = Controllable_Pump(gpio_pin=None,clock=clock)
 
         dts = [0.1,0.15,0.2]
         for dt in dts:
-            start_time = time.time()
+            start_time = clock.time()
             cp(dt)
-            end_time = time.time()
-            self.assertFloatsClose(start_time+dt,end_time,eps=dt/100.) # get within 1% 
+            end_time = clock.time()
+            self.assertFloatsClose(start_time+dt,end_time)
+
+    def test_controllable_pump_dispense(self):
+        '''
+        Verifies:
+            * dispense returns immediately and the pump runs in the background
+            * The Future and callback are completed when the pump turns off
+            * stop() turns the pump off early
+        '''
+        clock = Virtual_Clock(start=0.)
+        cp = Controllable_Pump(gpio_pin=None,clock=clock)
+        try:
+            completed = []
+            future = cp.dispense(0.2,callback=completed.append)
+            self.assertTrue(cp.is_running())
+            self.assertFloatsClose(cp.time_remaining(),0.2)
+
+            clock.advance(0.15)
+            self.assertFalse(future.done())
+            self.assertFloatsClose(cp.time_remaining(),0.05)
+
+            clock.advance(0.1)
+            self.assertTrue(future.done())
+            self.assertFloatsClose(future.result(),0.2)
+            self.assertEqual(completed,[future])
+            self.assertFalse(cp.is_running())
+            self.assertEqual(cp.time_remaining(),0.)
+
+            future = cp.dispense(10.)
+            clock.advance(1.)
+            cp.stop()
+            self.assertTrue(future.done())
+            self.assertFloatsClose(future.result(),1.)
+            self.assertFalse(cp.is_running())
+        finally:
+            cp.cleanup()
 
     def test_controllable_pump_real_output(self):
         '''
@@ -52,3 +87,26 @@ class test_Controllable_Pump(TestCase):
                 time.sleep(.05)
         finally:
             cp.cleanup()
+
+    def test_controllable_pump_released(self):
+        '''
+        Verifies:
+            * A pump that is no longer referenced is freed, the exit handler does not keep it alive
+            * The exit handler turns off the pumps that are still running
+        '''
+        import gc
+        import weakref
+        from growControl import controllable_pump
+
+        clock = Virtual_Clock(start=0.)
+        cp = Controllable_Pump(gpio_pin=None,clock=clock)
+        ref = weakref.ref(cp)
+        del cp
+        gc.collect()
+        self.assertIsNone(ref())
+
+        cp = Controllable_Pump(gpio_pin=None,clock=clock)
+        future = cp.dispense(10.)
+        controllable_pump._stop_pumps()
+        self.assertTrue(future.done())
+        self.assertFalse(cp.is_running())
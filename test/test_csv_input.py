@@ -0,0 +1,64 @@
+from unittest import TestCase
+import tempfile
+import os
+import shutil
+
+from growControl import Csv_Input
+
+class test_Csv_Input(TestCase):
+    '''
+    Test cases for the Csv_Input class
+    '''
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.mock_file = os.path.join(self.tmp_dir,"mock.csv")
+        with open(self.mock_file,'w') as fp:
+            fp.write("1.0,2.0\nNone,4.0\n\n5.0,\n")
+        self.output_files = [os.path.join(self.tmp_dir,"sensor_ph_{}.csv".format(ii)) for ii in range(2)]
+        for ii,output_file in enumerate(self.output_files):
+            with open(output_file,'w') as fp:
+                fp.write("time,datetime_timezone,voltage_raw,voltage_avg\n")
+                fp.write("{}.0,2021-01-01 00:00:00-05:00,0.{},0.5\n".format(ii,ii))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_stop(self):
+        '''
+        Verifies rows are parsed, blank rows skipped, and EOFError raised at the end
+        '''
+        for use_mmap in [False,True]:
+            csv_input = Csv_Input(self.mock_file,use_mmap=use_mmap)
+            self.assertEqual(csv_input.read(),[1.0,2.0])
+            self.assertEqual(csv_input.read(),[None,4.0])
+            self.assertEqual(csv_input.read(),[5.0,None])
+            with self.assertRaises(EOFError):
+                csv_input.read()
+            self.assertEqual(list(Csv_Input(self.mock_file,use_mmap=use_mmap)),[[1.0,2.0],[None,4.0],[5.0,None]])
+
+    def test_loop_and_hold(self):
+        '''
+        Verifies the input starts over when looping, and repeats the last row when holding
+        '''
+        csv_input = Csv_Input(self.mock_file,end_of_file="loop")
+        rows = [csv_input.read() for _ in range(5)]
+        self.assertEqual(rows,[[1.0,2.0],[None,4.0],[5.0,None],[1.0,2.0],[None,4.0]])
+
+        csv_input = Csv_Input(self.mock_file,end_of_file="hold")
+        rows = [csv_input.read() for _ in range(5)]
+        self.assertEqual(rows[2:],[[5.0,None],[5.0,None],[5.0,None]])
+        self.assertEqual(csv_input.rows_read,5)
+
+        with self.assertRaises(ValueError):
+            Csv_Input(self.mock_file,end_of_file="rewind")
+
+    def test_columns(self):
+        '''
+        Verifies columns are picked out of recorded output files, across several files
+        '''
+        csv_input = Csv_Input(self.output_files,columns=["voltage_raw","time"])
+        self.assertEqual(list(csv_input),[[0.0,0.0],[0.1,1.0]])
+
+        with self.assertRaises(ValueError):
+            Csv_Input(self.output_files,columns=["ph_raw"]).read()
@@ -0,0 +1,78 @@
+from unittest import TestCase
+import tempfile
+import datetime
+import os
+import shutil
+
+from growControl.data_access import Data_Store
+from growControl.binary_storage import binary_header, encode_record
+
+class test_Data_Store(TestCase):
+    '''
+    Test cases for the Data_Store class
+    '''
+
+    def setUp(self):
+        '''
+        Write a day of readings, 1 every 10 minutes, starting at midnight of today
+        '''
+        self.tmp_dir = tempfile.mkdtemp()
+        self.day = datetime.date.today()
+        self.midnight = datetime.datetime.combine(self.day,datetime.time()).timestamp()
+        self.csv_file = os.path.join(self.tmp_dir,"sensor_test_{}.csv".format(self.day.isoformat()))
+        with open(self.csv_file,'w') as fp:
+            fp.write("time,datetime_timezone,value_raw,value_avg\n")
+            for ii in range(144):
+                epoch = self.midnight + ii*600.
+                value = "None" if ii == 7 else float(ii)
+                fp.write("{},{},{},{}\n".format(epoch,datetime.datetime.fromtimestamp(epoch).astimezone(),value,ii*2.))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_data_store_csv(self):
+        '''
+        Verifies:
+            * The index has the row count, first and last epochs, and an offset for each hour
+            * Only the requested range is loaded, with every applied
+            * "None" is loaded as NaN
+            * Rows appended to the file are added to the index
+        '''
+        store = Data_Store(self.tmp_dir)
+        index = store.index(self.csv_file)
+        self.assertEqual(index["rows"],144)
+        self.assertEqual(index["first"],self.midnight)
+        self.assertEqual(index["last"],self.midnight + 143*600.)
+        self.assertEqual(len(index["hours"]),24)
+        self.assertEqual(index["size"],os.path.getsize(self.csv_file))
+
+        df = store.load("sensor_test",self.midnight + 3600.,self.midnight + 2*3600.)
+        self.assertEqual(list(df["value_raw"].iloc[[0,-1]]),[6.,12.])
+        self.assertEqual(len(df),7)
+        self.assertTrue(df["value_avg"].notna().all())
+        self.assertTrue(df["value_raw"].isna().iloc[1])
+        self.assertEqual(df["datetime_timezone"].iloc[0].timestamp(),self.midnight + 3600.)
+
+        df = store.load("sensor_test",self.midnight,self.midnight + 86400.,every=10)
+        self.assertEqual(list(df["value_avg"]),[ii*20. for ii in range(15)])
+
+        with open(self.csv_file,'a') as fp:
+            fp.write("{},_,{},{}\n".format(self.midnight + 144*600.,144.,288.))
+        index = Data_Store(self.tmp_dir).index(self.csv_file)
+        self.assertEqual(index["rows"],145)
+        self.assertEqual(index["last"],self.midnight + 144*600.)
+
+    def test_data_store_binary(self):
+        '''
+        Verifies:
+            * Ranges of binary files are loaded
+        '''
+        os.remove(self.csv_file)
+        binary_file = os.path.join(self.tmp_dir,"sensor_test_{}.bin".format(self.day.isoformat()))
+        with open(binary_file,'wb') as fp:
+            fp.write(binary_header(["time","value_raw"]))
+            for ii in range(144):
+                fp.write(encode_record(self.midnight + ii*600.,[float(ii)]))
+
+        df = Data_Store(self.tmp_dir).load("sensor_test",self.midnight + 3600.,self.midnight + 2*3600.)
+        self.assertEqual(list(df["value_raw"]),[6.,7.,8.,9.,10.,11.,12.])
@@ -0,0 +1,113 @@
+from unittest import TestCase
+import tempfile
+import math
+import os
+import shutil
+
+from growControl import Ema_Filter, Sensor_ph, Virtual_Clock
+from growControl.ema_filter import Ema_Filter_Bank, factor_to_time_constant
+
+class test_Ema_Filter(TestCase):
+    '''
+    Test cases for the Ema_Filter and Ema_Filter_Bank classes
+    '''
+
+    def assertFloatsClose(self,a,b,eps=1e-6):
+        '''
+        Asserts that a and b are within eps of eachother
+        '''
+        delta = abs(a-b)
+        self.assertTrue(delta < eps,msg="Floats {} and {} are not within {} of eachother.".format(a,b,eps))
+
+    def test_time_constant(self):
+        '''
+        Verifies:
+            * The average starts at the first reading and readings of None are ignored
+            * A step is followed the same amount after the same time, no matter how often it was read
+            * After one time constant the average has moved 63% of the way to the new reading
+        '''
+        self.assertRaises(ValueError,Ema_Filter)
+        self.assertRaises(ValueError,Ema_Filter,time_constant=0.)
+
+        regular = Ema_Filter(time_constant=60.)
+        irregular = Ema_Filter(time_constant=60.)
+        self.assertIsNone(regular.update(None,0.))
+        self.assertEqual(regular.update(7.,0.),7.)
+        self.assertEqual(irregular.update(7.,0.),7.)
+
+        for t in range(10,70,10):
+            regular.update(8.,float(t))
+        for t in [1.,2.,35.,36.,60.]: # skipped and late readings
+            irregular.update(8.,t)
+        self.assertFloatsClose(regular.value,irregular.value)
+        self.assertFloatsClose(regular.value,7.+(1.-math.exp(-1.)))
+        self.assertEqual(regular.update(None,80.),regular.value)
+
+    def test_factor(self):
+        '''
+        Verifies:
+            * Without a time constant the average is the per reading weighted average the sensors have always used
+            * factor_to_time_constant gives a time constant that averages the same at a fixed read rate
+        '''
+        readings = [7.1,6.9,None,7.4,7.0]
+        ema = Ema_Filter(factor=0.9,initial=7.)
+        expected = 7.
+        for ii,reading in enumerate(readings):
+            ema.update(reading,float(ii))
+            if reading is not None:
+                expected = expected*0.9 + reading*(1-0.9)
+            self.assertFloatsClose(ema.value,expected)
+
+        timed = Ema_Filter(time_constant=factor_to_time_constant(0.9,30.),initial=7.)
+        timed.last_update = 0.
+        factor = Ema_Filter(factor=0.9,initial=7.)
+        for ii in range(5):
+            timed.update(8.,(ii+1)*30.)
+            factor.update(8.)
+        self.assertFloatsClose(timed.value,factor.value)
+
+    def test_bank(self):
+        '''
+        Verifies:
+            * Each average of the bank follows at its own time constant
+        '''
+        bank = Ema_Filter_Bank({"fast":10.,"slow":600.})
+        self.assertEqual(bank.values(),{"fast":None,"slow":None})
+        bank.update(7.,0.)
+        bank.update(8.,30.)
+        self.assertGreater(bank["fast"],7.9)
+        self.assertLess(bank["slow"],7.1)
+
+    def test_sensor_ph_time_constant(self):
+        '''
+        Verifies:
+            * A Sensor_ph with average_time_constant starts its average at the first reading
+            * The extra averages are kept and shown in the registry status
+        '''
+        from growControl.registry import Registered_Device
+
+        tmp_dir = os.path.join(tempfile.mkdtemp(),"")
+        clock = Virtual_Clock(start=1600000000.)
+        try:
+            s = Sensor_ph(tmp_dir,"sensor_ph",
+                            read_every=1.,
+                            csv="test/test_inputs/sensor_ph_input.csv",
+                            calibration_file="test/test_inputs/sensor_ph_calibration_mock.json",
+                            calibrate_on_startup=False,
+                            average_time_constant=60.,
+                            extra_averages={"slow":1800.},
+                            clock=clock)
+            self.assertIsNone(s.ph_avg)
+            s()
+            self.assertEqual(s.ph_avg,s.ph_raw)
+            self.assertEqual(s.extra_averages["ph_avg"]["slow"],s.ph_raw)
+            for ii in range(5):
+                clock.advance(2.)
+                s()
+            self.assertIsNotNone(s.ph_avg)
+
+            status = Registered_Device("bin1","ph","Sensor_ph","pH",s).status()
+            self.assertEqual([value[0] for value in status["values"]],["pH","pH slow"])
+            self.assertEqual(status["values"][1][2],s.extra_averages["ph_avg"]["slow"])
+        finally:
+            shutil.rmtree(tmp_dir)
@@ -0,0 +1,53 @@
+from unittest import TestCase
+import importlib.util
+import tempfile
+import os
+import shutil
+import subprocess
+import sys
+
+import growControl
+from growControl import Controllable_Pump, Sensor_humidity_temp
+
+hardware_modules = ["RPi","Adafruit_DHT","board","busio","adafruit_ads1x15"]
+
+class test_Hardware(TestCase):
+    '''
+    Test cases for the lazy imports of the package and the hardware libraries
+    '''
+
+    def test_import_is_quiet(self):
+        '''
+        Verifies:
+            * Importing growControl and the devices prints nothing and imports no hardware library or numpy
+            * The classes are still available from the package
+        '''
+        code = "import sys; import growControl; from growControl import *; " +\
+                "print(sorted(name for name in {} + ['numpy'] if name in sys.modules))".format(hardware_modules)
+        result = subprocess.run([sys.executable,"-c",code],capture_output=True,text=True,check=True)
+        self.assertEqual(result.stdout,"[]\n")
+        self.assertEqual(result.stderr,"")
+
+        self.assertIn("Sensor_ph",dir(growControl))
+        self.assertEqual(growControl.Sensor_ph.__name__,"Sensor_ph")
+        self.assertRaises(AttributeError,getattr,growControl,"Sensor_nothing")
+
+    def test_missing_hardware(self):
+        '''
+        Verifies:
+            * A real device raises ImportError saying how to run without the hardware when its library is missing
+            * The mocked devices do not need the libraries
+        '''
+        Controllable_Pump(None).cleanup()
+        if importlib.util.find_spec("RPi") is None:
+            with self.assertRaises(ImportError) as context:
+                Controllable_Pump(27)
+            self.assertIn("gpio_pin=None",str(context.exception))
+        if importlib.util.find_spec("Adafruit_DHT") is None:
+            tmp_dir = os.path.join(tempfile.mkdtemp(),"")
+            try:
+                with self.assertRaises(ImportError) as context:
+                    Sensor_humidity_temp(18,tmp_dir,"humidity_temp")
+                self.assertIn("Sensor_humidity_temp",str(context.exception))
+            finally:
+                shutil.rmtree(tmp_dir)
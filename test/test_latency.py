@@ -0,0 +1,53 @@
+from unittest import TestCase
+import tempfile
+import json
+import os
+
+from growControl import Latency_Histogram
+
+class test_Latency_Histogram(TestCase):
+    '''
+    Test cases for the Latency_Histogram class
+    '''
+
+    def test_latency_histogram(self):
+        '''
+        Verifies:
+            * Percentiles are within one bucket of the recorded durations
+            * Calls that did no work are counted separately
+            * Old windows roll off
+        '''
+        histogram = Latency_Histogram(window=600.)
+        self.assertIsNone(histogram.percentile(50))
+
+        for _ in range(90):
+            histogram.record(0.001)
+        for _ in range(10):
+            histogram.record(0.5,did_work=False)
+
+        summary = histogram.summary()
+        self.assertEqual(summary["calls"],100)
+        self.assertEqual(summary["work"],90)
+        self.assertTrue(0.001 <= summary["p50"] < 0.001*1.2,msg="p50 {}".format(summary["p50"]))
+        self.assertTrue(0.5 <= summary["p95"] < 0.5*1.2,msg="p95 {}".format(summary["p95"]))
+        self.assertEqual(summary["max"],0.5)
+        self.assertEqual(summary["recent_max"],0.5)
+
+        # Two windows later the old calls are gone from the percentiles, but still in the totals
+        histogram._window_end -= 2*histogram.window
+        histogram.record(0.002)
+        summary = histogram.summary()
+        self.assertTrue(0.002 <= summary["p95"] < 0.002*1.2)
+        self.assertEqual(summary["recent_max"],0.002)
+        self.assertEqual(summary["max"],0.5)
+        self.assertEqual(summary["calls"],101)
+
+        tmp_file = os.path.join(tempfile.mkdtemp(),"latency.json")
+        try:
+            from growControl.latency import dump_latency
+            dump_latency(tmp_file,{"device":histogram})
+            with open(tmp_file,'r') as fp:
+                self.assertEqual(json.load(fp)["device"]["calls"],101)
+        finally:
+            os.remove(tmp_file)
+            os.rmdir(os.path.dirname(tmp_file))
@@ -0,0 +1,122 @@
+from unittest import TestCase
+import tempfile
+import datetime
+import os
+import shutil
+import threading
+import time
+
+from growControl import Output_Rotation, Virtual_Clock
+
+class test_Output_Rotation(TestCase):
+    '''
+    Test cases for the Output_Rotation class
+    '''
+
+    def test_output_rotation(self):
+        '''
+        Verifies:
+            * register creates the file for today with the header
+            * The cached path is served without checking the file system
+            * next_rollover is the next local midnight
+            * At rollover the file is created and the header written once
+        '''
+        tmp_dir = tempfile.gettempdir()
+        rotation = Output_Rotation()
+        key = rotation.register(tmp_dir,"output_rotation_test","a,b\n")
+        tmp_file = os.path.join(tmp_dir,"output_rotation_test_{}.csv".format(datetime.date.today().isoformat()))
+        try:
+            self.assertEqual(rotation.get_output_file(key),tmp_file)
+            with open(tmp_file,'r') as fp:
+                self.assertEqual(fp.read(),"a,b\n")
+
+            midnight = datetime.datetime.combine(datetime.date.today() + datetime.timedelta(days=1),datetime.time())
+            self.assertEqual(rotation.next_rollover,midnight.timestamp())
+
+            # Before the rollover the path is served from the cache, even if the file is gone
+            os.remove(tmp_file)
+            self.assertEqual(rotation.get_output_file(key),tmp_file)
+            self.assertFalse(os.path.isfile(tmp_file))
+
+            # Force a rollover, the file is created again with the header
+            rotation.next_rollover = time.time() - 1.
+            self.assertEqual(rotation.get_output_file(key),tmp_file)
+            with open(tmp_file,'a') as fp:
+                fp.write("1,2\n")
+            rotation.get_output_file(key)
+            with open(tmp_file,'r') as fp:
+                self.assertEqual(fp.read(),"a,b\n1,2\n")
+        finally:
+            if os.path.isfile(tmp_file):
+                os.remove(tmp_file)
+
+    def test_output_rotation_virtual_clock(self):
+        '''
+        Verifies the file changes when the clock passes midnight
+        '''
+        tmp_dir = tempfile.mkdtemp()
+        day = datetime.date(2021,3,1)
+        clock = Virtual_Clock(start=datetime.datetime.combine(day,datetime.time(23,59)).timestamp())
+        rotation = Output_Rotation(clock=clock)
+        key = rotation.register(tmp_dir,"output_rotation_test","a,b\n")
+        try:
+            self.assertEqual(rotation.get_output_file(key),os.path.join(tmp_dir,"output_rotation_test_2021-03-01.csv"))
+            clock.advance(120.)
+            next_file = os.path.join(tmp_dir,"output_rotation_test_2021-03-02.csv")
+            self.assertEqual(rotation.get_output_file(key),next_file)
+            with open(next_file,'r') as fp:
+                self.assertEqual(fp.read(),"a,b\n")
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_output_rotation_threads(self):
+        '''
+        Verifies:
+            * Threads that ask for the file at the same time after midnight roll over once, the header is written once
+        '''
+        tmp_dir = tempfile.mkdtemp()
+        day = datetime.date(2021,3,1)
+        clock = Virtual_Clock(start=datetime.datetime.combine(day,datetime.time(23,59)).timestamp())
+        rotation = Output_Rotation(clock=clock)
+        keys = [rotation.register(tmp_dir,"output_rotation_test_{}".format(ii),"a,b\n") for ii in range(4)]
+        try:
+            clock.advance(120.)
+            barrier = threading.Barrier(8)
+            def get_files():
+                barrier.wait()
+                for key in keys:
+                    rotation.get_output_file(key)
+            threads = [threading.Thread(target=get_files) for ii in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            for ii in range(4):
+                with open(os.path.join(tmp_dir,"output_rotation_test_{}_2021-03-02.csv".format(ii)),'r') as fp:
+                    self.assertEqual(fp.read(),"a,b\n")
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_output_rotation_header_changed(self):
+        '''
+        Verifies:
+            * An existing file for the day with a different header is moved aside and a new file is started
+            * A file with the same header is appended to
+        '''
+        tmp_dir = tempfile.mkdtemp()
+        clock = Virtual_Clock(start=datetime.datetime(2021,3,1,12).timestamp())
+        path = os.path.join(tmp_dir,"output_rotation_test_2021-03-01.csv")
+        try:
+            with open(path,'w') as fp:
+                fp.write("a,b\n1,2\n")
+            Output_Rotation(clock=clock).register(tmp_dir,"output_rotation_test","a,b\n")
+            with open(path,'r') as fp:
+                self.assertEqual(fp.read(),"a,b\n1,2\n")
+
+            Output_Rotation(clock=clock).register(tmp_dir,"output_rotation_test","a,b,c\n")
+            with open(path,'r') as fp:
+                self.assertEqual(fp.read(),"a,b,c\n")
+            with open(os.path.join(tmp_dir,"output_rotation_test_2021-03-01.1.csv"),'r') as fp:
+                self.assertEqual(fp.read(),"a,b\n1,2\n")
+        finally:
+            shutil.rmtree(tmp_dir)
@@ -0,0 +1,99 @@
+from unittest import TestCase
+import tempfile
+import os
+import time
+
+from growControl import Output_Writer, Sensor_ph
+
+def wait_for(condition,timeout=30.):
+    '''
+    Wait until condition() is True, returns False if timeout seconds pass first
+    '''
+    end_time = time.monotonic() + timeout
+    while time.monotonic() < end_time:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+def read_file(path):
+    '''
+    Returns the contents of path, an empty string if it does not exist yet
+    '''
+    if not os.path.isfile(path):
+        return ""
+    with open(path,'r') as fp:
+        return fp.read()
+
+class test_Output_Writer(TestCase):
+    '''
+    Test cases for the Output_Writer class
+    '''
+
+    def test_output_writer_batching(self):
+        '''
+        Verifies:
+            * Rows are not written until a batch is full
+            * A full batch is written without calling flush
+            * close() writes the remaining rows
+            * Text and binary data can be written
+        '''
+        tmp_dir = tempfile.mkdtemp()
+        text_file = os.path.join(tmp_dir,"output_writer_text.csv")
+        binary_file = os.path.join(tmp_dir,"output_writer_binary.bin")
+        writer = Output_Writer(batch_size=3,flush_every=60.)
+        try:
+            writer.write(text_file,"a\n")
+            writer.write(text_file,"b\n")
+            # flush_every is far off, so the rows can only reach the disk with a full batch
+            self.assertEqual(read_file(text_file),"",msg="Rows were flushed before the batch was full")
+
+            writer.write(text_file,"c\n")
+            self.assertTrue(wait_for(lambda: read_file(text_file) == "a\nb\nc\n"),msg="The full batch was not written")
+
+            writer.write(text_file,"d\n")
+            writer.write(binary_file,b"\x00\x01")
+            writer.close()
+            with open(text_file,'r') as fp:
+                self.assertEqual(fp.read(),"a\nb\nc\nd\n")
+            with open(binary_file,'rb') as fp:
+                self.assertEqual(fp.read(),b"\x00\x01")
+
+            with self.assertRaises(ValueError):
+                writer.write(text_file,"e\n")
+        finally:
+            writer.close()
+            for fname in os.listdir(tmp_dir):
+                os.remove(os.path.join(tmp_dir,fname))
+            os.rmdir(tmp_dir)
+
+    def test_output_writer_sensor(self):
+        '''
+        Verifies:
+            * A sensor can queue its rows on the writer
+            * flush() makes the rows visible on disk
+        '''
+        writer = Output_Writer(batch_size=100,flush_every=60.)
+        try:
+            tmp_file = tempfile.gettempdir()
+            s = Sensor_ph(output_file_path=tmp_file,
+                            output_file_base="sensor_ph_output_writer",
+                            average_factor=0.9,
+                            read_every=0.,
+                            csv="test/test_inputs/sensor_ph_input.csv",
+                            calibration_file="test/test_inputs/sensor_ph_calibration_mock.json",
+                            calibrate_on_startup=False,
+                            output_writer=writer,
+                            verbose=False)
+            tmp_file = s.output_file
+
+            for ii in range(3):
+                s()
+            writer.flush()
+
+            with open(tmp_file,'r') as fp:
+                data = fp.readlines()
+            self.assertEqual(len(data),4) # header + 3 readings
+        finally:
+            writer.close()
+            os.remove(tmp_file)
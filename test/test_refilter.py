@@ -0,0 +1,62 @@
+from unittest import TestCase
+import numpy as np
+
+from growControl.refilter import ema_grid, refilter_report, format_report
+
+try:
+    import scipy.signal
+    methods = ["scipy","numpy"]
+except ImportError:
+    methods = ["numpy"]
+
+class test_Refilter(TestCase):
+    '''
+    Test cases for the refilter functions
+    '''
+
+    def test_ema_grid(self):
+        '''
+        Verifies:
+            * The average matches what Sensor_ph recorded, including the readings of None
+            * scipy and numpy give the same averages for every factor, if scipy is installed
+            * Without an initial value the average starts at the first reading
+        '''
+        with open("test/test_inputs/sensor_ph_output_correct.csv",'r') as fp:
+            rows = [line.strip("\n").split(",") for line in fp.readlines()[1:]]
+        ph_raw = [None if row[4] == "None" else float(row[4]) for row in rows]
+        ph_avg = [float(row[5]) for row in rows]
+
+        for method in methods:
+            averages = ema_grid(ph_raw,[0.9],initial=7.0,method=method)
+            np.testing.assert_allclose(averages[0],ph_avg,atol=1e-9)
+
+        readings = np.random.RandomState(0).normal(6.,0.1,size=1000)
+        readings[[0,5,500]] = np.nan
+        factors = [0.,0.5,0.9,0.99,0.999]
+        averages = ema_grid(readings,factors,method="numpy")
+        for method in methods:
+            np.testing.assert_allclose(ema_grid(readings,factors,method=method),averages,atol=1e-9)
+        self.assertTrue(np.all(averages[:,:2] == readings[1]))
+        held = []
+        for reading in readings:
+            held.append(reading if not np.isnan(reading) else (held[-1] if len(held) > 0 else readings[1]))
+        np.testing.assert_allclose(averages[0],held) # a factor of 0 holds the last good reading
+        self.assertRaises(ValueError,ema_grid,readings,factors,method="fft")
+
+    def test_refilter_report(self):
+        '''
+        Verifies:
+            * A larger factor leaves less noise in the average and lags it more
+            * The report formats as a table with a row per factor
+        '''
+        times = 1600000000. + 30.*np.arange(20000)
+        readings = 6. + 0.2*np.sin(2*np.pi*times/86400.) + np.random.RandomState(1).normal(0.,0.1,size=len(times))
+        factors = [0.9,0.99,0.999]
+        report = refilter_report(times,readings,factors,window=3600.)
+        self.assertEqual([row["factor"] for row in report],factors)
+        self.assertAlmostEqual(report[0]["delay_s"],270.)
+        for slow,fast in zip(report[1:],report[:-1]):
+            self.assertLess(slow["noise"],fast["noise"])
+            self.assertLess(slow["swing"],fast["swing"])
+            self.assertGreater(slow["delay_s"],fast["delay_s"])
+        self.assertEqual(len(format_report(report).splitlines()),len(factors)+1)
@@ -0,0 +1,133 @@
+from unittest import TestCase
+import tempfile
+import json
+import os
+import shutil
+
+from growControl import Controller_ph_Pump, Scheduler, Virtual_Clock
+from growControl.registry import Registry, load_config
+
+def bin_config(name):
+    '''
+    A bin with a csv ph sensor, two mocked pumps and a ph controller
+    '''
+    return {"name":name,
+            "devices":[{"name":"ph","type":"Sensor_ph","label":"{} pH".format(name),
+                        "params":{"csv":"test/test_inputs/sensor_ph_input.csv",
+                                    "calibration_file":"test/test_inputs/sensor_ph_calibration_mock.json",
+                                    "calibrate_on_startup":False,
+                                    "read_every":10.0}},
+                        {"name":"pump_up","type":"Controllable_Pump","params":{"gpio_pin":None}},
+                        {"name":"pump_down","type":"Controllable_Pump","params":{"gpio_pin":None}},
+                        {"name":"ph_controller","type":"Controller_ph_Pump",
+                        "params":{"sensor_ph":"@ph","pump_ph_up":"@pump_up","pump_ph_down":"@pump_down",
+                                    "control_every":60.,"warmup_time":30.}}]}
+
+class test_Registry(TestCase):
+    '''
+    Test cases for the Registry class
+    '''
+
+    def test_registry_bins(self):
+        '''
+        Verifies:
+            * Every device of every bin is built, references resolve within the bin
+            * The shared clock and output writer are passed to the devices, output files default to <name>_<bin>
+            * Sensors and controllers are scheduled at read_every and control_every, after warmup_time
+            * The latency is kept by the key of the device, not its label, with the reads of the humidity sensor as "<key> read"
+        '''
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            config = {"output_dir":os.path.join(tmp_dir,""),
+                        "output_writer":{"batch_size":10,"flush_every":1.0},
+                        "bins":[bin_config("bin1"),
+                                bin_config("bin2"),
+                                {"name":"room",
+                                "devices":[{"name":"air","type":"Sensor_humidity_temp",
+                                            "params":{"gpio_pin":None,"csv":"test/test_inputs/sensor_humidity_temp_input.csv"}}]}]}
+            clock = Virtual_Clock(start=1600000000.)
+            registry = Registry(config,clock=clock)
+
+            self.assertEqual([entry.key for entry in registry.devices],
+                                ["bin1/ph","bin1/pump_up","bin1/pump_down","bin1/ph_controller",
+                                "bin2/ph","bin2/pump_up","bin2/pump_down","bin2/ph_controller",
+                                "room/air"])
+            controller = registry["bin2/ph_controller"]
+            self.assertIsInstance(controller,Controller_ph_Pump)
+            self.assertIs(controller.sensor_ph,registry["bin2/ph"])
+            self.assertIs(controller.pump_up,registry["bin2/pump_up"])
+            self.assertIs(registry["bin1/pump_up"].clock,clock)
+            self.assertIs(registry["room/air"].output_writer,registry.output_writer)
+            self.assertEqual(registry["bin1/ph"].output_file_base,"ph_bin1")
+            self.assertEqual([entry.key for entry in registry.of_type("Sensor_ph")],["bin1/ph","bin2/ph"])
+
+            scheduler = Scheduler(clock=clock)
+            registry.schedule(scheduler)
+            self.assertEqual([entry.name for entry in scheduler.devices],
+                                ["bin1/ph","bin1/ph_controller","bin2/ph","bin2/ph_controller","room/air"])
+            self.assertEqual(scheduler.devices[1].every,60.)
+            self.assertTrue(abs(scheduler.time_until_next()) < 1e-6)
+
+            for ii in range(6):
+                scheduler.run_pending()
+                clock.advance(10.)
+            self.assertEqual(registry["bin1/ph"].csv_input.rows_read,6)
+            self.assertEqual(set(scheduler.latency_summary().keys()),{"bin1/ph","bin1/ph_controller","bin2/ph","bin2/ph_controller","room/air","room/air read"})
+            self.assertIsNotNone(registry["bin1/ph_controller"].last_loop_time)
+            registry.close()
+            self.assertGreater(scheduler.latency_summary()["room/air read"]["calls"],0) # the reads on the executor are timed too, close() waits for them
+
+            for base in ["ph_bin1","ph_bin2","ph_controller_bin1","air_room"]:
+                self.assertTrue(any(f.startswith(base) for f in os.listdir(tmp_dir)),msg=base)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_registry_close(self):
+        '''
+        Verifies:
+            * close() calls cleanup() of every device that has one, the pins and edge detection of the volume sensor are released
+        '''
+        from growControl import Fake_GPIO
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            gpio = Fake_GPIO()
+            config = {"output_dir":os.path.join(tmp_dir,""),
+                        "output_writer":None,
+                        "bins":[{"name":"bin1",
+                                "devices":[{"name":"pump","type":"Controllable_Pump","params":{"gpio_pin":None}},
+                                            {"name":"volume","type":"Sensor_volume",
+                                            "params":{"trigger_pin":20,"echo_pin":21,"gpio":gpio,"measurement_mode":"edge",
+                                                        "calibration_file":"test/test_inputs/sensor_volume_calibration_mock.json",
+                                                        "calibrate_on_startup":False}}]}]}
+            registry = Registry(config,clock=Virtual_Clock(start=1600000000.))
+            self.assertIn(21,gpio._callbacks)
+            registry.close()
+            self.assertEqual(gpio._callbacks,{})
+            self.assertEqual(gpio.pin_directions,{})
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_registry_errors(self):
+        '''
+        Verifies:
+            * Unknown device types and references to devices not yet defined raise ValueError
+            * json and toml files load to the same config
+        '''
+        config = {"output_dir":"","output_writer":None,"bins":[{"name":"bin1","devices":[{"name":"x","type":"Sensor_nothing"}]}]}
+        self.assertRaises(ValueError,Registry,config)
+        config["bins"][0]["devices"] = [{"name":"pump","type":"Controller_Volume_Pump","params":{"sensor_volume":"@volume","pump":None}}]
+        self.assertRaises(ValueError,Registry,config)
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            config = {"output_dir":"data","bins":[{"name":"bin1","devices":[{"name":"pump","type":"Controllable_Pump","params":{"gpio_pin":27}}]}]}
+            with open(os.path.join(tmp_dir,"config.json"),'w') as fp:
+                json.dump(config,fp)
+            with open(os.path.join(tmp_dir,"config.toml"),'w') as fp:
+                fp.write('output_dir = "data"\n[[bins]]\nname = "bin1"\n[[bins.devices]]\nname = "pump"\ntype = "Controllable_Pump"\nparams = {gpio_pin = 27}\n')
+            self.assertEqual(load_config(os.path.join(tmp_dir,"config.json")),config)
+            self.assertEqual(load_config(os.path.join(tmp_dir,"config.toml")),config)
+            self.assertRaises(ValueError,load_config,os.path.join(tmp_dir,"config.yaml"))
+        finally:
+            shutil.rmtree(tmp_dir)
@@ -0,0 +1,71 @@
+from unittest import TestCase
+import tempfile
+import datetime
+import os
+import shutil
+
+from growControl import Sensor_ph, Controllable_Pump, Controller_ph_Pump
+from growControl.output_writer import format_output_row
+from growControl.replay import Replay, Replay_Source, replay_files
+
+class test_Replay(TestCase):
+    '''
+    Test cases for the Replay class
+    '''
+
+    def test_replay_ph(self):
+        '''
+        Verifies:
+            * Recorded voltages spread over several daily files are fed through the sensor in order
+            * The controller acts on the recorded time, obeying warmup_time and control_every
+            * The replay output files are dated by the recorded time
+        '''
+        data_dir = tempfile.mkdtemp()
+        replay_dir = os.path.join(tempfile.mkdtemp(),"")
+        try:
+            # Two days of readings every 30s, ph 6.0 on the first day and 7.0 on the second
+            days = [datetime.date(2021,3,1),datetime.date(2021,3,2)]
+            for day,voltage in zip(days,[0.057,0.]):
+                midnight = datetime.datetime.combine(day,datetime.time()).timestamp()
+                with open(os.path.join(data_dir,"sensor_ph_bin1_{}.csv".format(day.isoformat())),'w') as fp:
+                    fp.write(Sensor_ph.output_header)
+                    for ii in range(2880):
+                        fp.write(format_output_row(midnight + ii*30.,[voltage,voltage,None,None]))
+            start = datetime.datetime.combine(days[0],datetime.time()).timestamp()
+            end = start + 2*86400.
+
+            replay = Replay(replay_dir,start)
+            source = Replay_Source(replay_files(data_dir,"sensor_ph_bin1",start,end),"voltage_raw",start=start,end=end)
+            s = Sensor_ph(replay_dir,"sensor_ph_bin1",
+                            average_factor=0.,
+                            read_every=0.,
+                            csv=source,
+                            calibration_file="test/test_inputs/sensor_ph_calibration_mock.json",
+                            calibrate_on_startup=False,
+                            **replay.device_kwargs())
+            replay.add_sensor(s,source)
+            controller = Controller_ph_Pump(s,
+                                            Controllable_Pump(None,clock=replay.clock),
+                                            Controllable_Pump(None,clock=replay.clock),
+                                            replay_dir,"controller_ph_pump",
+                                            control_every=3600.,
+                                            warmup_time=600.,
+                                            **replay.device_kwargs())
+            replay.add_controller(controller)
+            actions = replay.run()
+            replay.close()
+
+            self.assertEqual(source.rows,2*2880)
+            # ph down once an hour for the whole second day
+            self.assertEqual(len(actions),24)
+            self.assertEqual(actions[0][0],start + 86400. + 600.)
+            self.assertEqual(set(action[2] for action in actions),set(["Adjust ph Down"]))
+            self.assertEqual(actions[1][0] - actions[0][0],3600.)
+
+            for day in days:
+                self.assertTrue(os.path.isfile(os.path.join(replay_dir,"sensor_ph_bin1_{}.csv".format(day.isoformat()))))
+            with open(os.path.join(replay_dir,"controller_ph_pump_{}.csv".format(days[1].isoformat())),'r') as fp:
+                self.assertEqual(len(fp.readlines()),25)
+        finally:
+            shutil.rmtree(data_dir)
+            shutil.rmtree(replay_dir)
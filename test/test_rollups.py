@@ -0,0 +1,99 @@
+from unittest import TestCase
+import tempfile
+import datetime
+import os
+import shutil
+
+from growControl import Output_Rotation
+from growControl.rollups import Rollup, rollup_label
+from growControl.data_access import Data_Store
+
+class test_Rollup(TestCase):
+    '''
+    Test cases for the Rollup class
+    '''
+
+    def test_rollup(self):
+        '''
+        Verifies:
+            * Each bucket is written when the first reading of the next bucket arrives
+            * min/max/mean/count are correct and readings of None are not counted
+            * close() writes the open buckets
+            * After a restart the partial bucket written by close() is merged into, not written again
+            * Data_Store.load_summary picks the finest resolution that fits in max_points
+            * Only the rows in the range are counted against max_points
+        '''
+        self.assertEqual(rollup_label(60),"1min")
+        self.assertEqual(rollup_label(3600),"1hour")
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            rotation = Output_Rotation()
+            rollup = Rollup(tmp_dir,"sensor_test",["value"],resolutions=(60,3600),output_rotation=rotation)
+            midnight = datetime.datetime.combine(datetime.date.today(),datetime.time()).timestamp()
+
+            # 3 readings every 20s for 3 minutes, and a reading of None
+            for ii in range(9):
+                rollup.update(midnight + ii*20.,[float(ii)])
+            rollup.update(midnight + 170.,[None])
+
+            minute_file = os.path.join(tmp_dir,"sensor_test_rollup_1min_{}.csv".format(datetime.date.today().isoformat()))
+            with open(minute_file,'r') as fp:
+                lines = fp.readlines()
+            self.assertEqual(lines[0],"time,value_min,value_max,value_mean,value_count\n")
+            self.assertEqual(len(lines),3) # the third minute is still open
+            row = lines[2].strip().split(",")
+            self.assertEqual(float(row[0]),midnight+60.)
+            self.assertEqual(row[1:],["3.0","5.0","4.0","3"])
+
+            rollup.close()
+            with open(minute_file,'r') as fp:
+                lines = fp.readlines()
+            self.assertEqual(len(lines),4)
+            self.assertEqual(lines[3].strip().split(",")[1:],["6.0","8.0","7.0","3"])
+
+            hour_file = os.path.join(tmp_dir,"sensor_test_rollup_1hour_{}.csv".format(datetime.date.today().isoformat()))
+            with open(hour_file,'r') as fp:
+                lines = fp.readlines()
+            self.assertEqual(lines[1].strip().split(",")[1:],["0.0","8.0","4.0","9"])
+
+            # restart in the middle of the third minute
+            rollup = Rollup(tmp_dir,"sensor_test",["value"],resolutions=(60,3600),output_rotation=rotation)
+            rollup.update(midnight + 175.,[12.])
+            rollup.close()
+            with open(minute_file,'r') as fp:
+                lines = fp.readlines()
+            self.assertEqual(len(lines),4)
+            self.assertEqual(lines[3].strip().split(",")[1:],["6.0","12.0","8.25","4"])
+            with open(hour_file,'r') as fp:
+                lines = fp.readlines()
+            self.assertEqual(len(lines),2)
+            self.assertEqual(lines[1].strip().split(",")[1:],["0.0","12.0","4.8","10"])
+
+            # raw data that does not fit in max_points
+            raw_file = os.path.join(tmp_dir,"sensor_test_{}.csv".format(datetime.date.today().isoformat()))
+            with open(raw_file,'w') as fp:
+                fp.write("time,datetime_timezone,value\n")
+                for ii in range(100):
+                    fp.write("{},None,{}\n".format(midnight + ii,float(ii)))
+                for ii in range(100): # the next hour
+                    fp.write("{},None,{}\n".format(midnight + 3601. + ii*10.,float(ii)))
+
+            store = Data_Store(tmp_dir)
+            self.assertEqual(store.count("sensor_test",midnight+10.,midnight+49.),40)
+            self.assertEqual(store.count("sensor_test",midnight+50.,midnight+7200.),150)
+            self.assertEqual(store.count("sensor_test",midnight,midnight+7200.),len(store.load("sensor_test",midnight,midnight+7200.)))
+            resolution,df = store.load_summary("sensor_test",midnight,midnight+50.,max_points=60)
+            self.assertIsNone(resolution)
+            self.assertEqual(len(df),51)
+            resolution,df = store.load_summary("sensor_test",midnight,midnight+3600.,max_points=100)
+            self.assertIsNone(resolution)
+            self.assertEqual(len(df),100)
+            resolution,df = store.load_summary("sensor_test",midnight,midnight+3600.,max_points=60)
+            self.assertEqual(resolution,60)
+            self.assertEqual(list(df["value_count"]),[3,3,4])
+            resolution,df = store.load_summary("sensor_test",midnight,midnight+3600.,max_points=10)
+            self.assertEqual(resolution,3600)
+            self.assertEqual(list(df["value_mean"]),[4.8])
+        finally:
+            shutil.rmtree(tmp_dir)
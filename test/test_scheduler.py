@@ -0,0 +1,106 @@
+from unittest import TestCase
+
+from growControl import Scheduler, Virtual_Clock
+
+class test_Scheduler(TestCase):
+    '''
+    Test cases for the Scheduler class
+    '''
+
+    def test_scheduler_order(self):
+        '''
+        Verifies:
+            * Devices are called when they are due, in order of their deadlines
+            * delay postpones the first call
+            * time_until_next is the time until the next deadline
+        '''
+        calls = []
+        clock = Virtual_Clock(start=0.)
+        scheduler = Scheduler(late_tolerance=0.05,clock=clock)
+        scheduler.add(lambda: calls.append("fast"),every=0.1,name="fast")
+        scheduler.add(lambda: calls.append("slow"),every=0.25,delay=0.15,name="slow")
+
+        self.assertEqual(scheduler.time_until_next(),0.)
+        while clock.time() < 0.48:
+            scheduler.run_pending()
+            clock.sleep(scheduler.time_until_next())
+
+        # fast at 0.0, 0.1, 0.2, 0.3, 0.4 and slow at 0.15, 0.40
+        self.assertEqual(calls.count("fast"),5)
+        self.assertEqual(calls.count("slow"),2)
+        self.assertEqual(calls[:3],["fast","fast","slow"])
+        self.assertEqual(scheduler.missed_deadlines,0)
+        self.assertTrue(scheduler.time_until_next() <= 0.1)
+
+        # every call is timed, the lambdas return None so they all count as work
+        summary = scheduler.latency_summary()
+        self.assertEqual(summary["fast"]["calls"],5)
+        self.assertEqual(summary["fast"]["work"],5)
+        self.assertEqual(summary["slow"]["calls"],2)
+
+    def test_scheduler_missed_deadlines(self):
+        '''
+        Verifies:
+            * A device that is called late counts as a missed deadline
+            * A device that raises is still rescheduled
+            * The next deadline follows from the last one, not from when the late call completed
+        '''
+        clock = Virtual_Clock(start=0.)
+        def blocking():
+            clock.sleep(0.1)
+        def failing():
+            raise RuntimeError("Device failed")
+
+        scheduler = Scheduler(late_tolerance=0.05,clock=clock)
+        blocking_entry = scheduler.add(blocking,every=1.0)
+        failing_entry = scheduler.add(failing,every=1.0)
+
+        with self.assertRaises(RuntimeError):
+            scheduler.run_pending()
+        self.assertEqual(blocking_entry.calls,1)
+        self.assertEqual(failing_entry.calls,1)
+        self.assertEqual(failing_entry.missed_deadlines,1)
+        self.assertEqual(scheduler.missed_deadlines,1)
+        self.assertEqual(failing_entry.next_due,1.0)
+        self.assertEqual(blocking_entry.next_due,1.0)
+
+    def test_scheduler_drift(self):
+        '''
+        Verifies:
+            * A device that takes time to run is still called on every deadline, without drifting later
+            * Deadlines that passed while a call ran over are skipped
+        '''
+        clock = Virtual_Clock(start=0.)
+        starts = []
+        def slow():
+            starts.append(clock.monotonic())
+            clock.sleep(2.5 if len(starts) == 3 else 0.3)
+
+        scheduler = Scheduler(late_tolerance=0.05,clock=clock)
+        scheduler.add(slow,every=1.0)
+        while clock.monotonic() < 6.5:
+            scheduler.run_pending()
+            clock.sleep(scheduler.time_until_next())
+        self.assertEqual(starts,[0.,1.,2.,5.,6.])
+        self.assertEqual(scheduler.missed_deadlines,0)
+
+    def test_scheduler_retry(self):
+        '''
+        Verifies:
+            * A device that returns False is called again retry_time later, without counting as late
+            * Once it reads it goes back to the deadlines of every
+        '''
+        clock = Virtual_Clock(start=0.)
+        starts = []
+        def not_ready():
+            starts.append(round(clock.monotonic(),6))
+            return clock.monotonic() >= 0.25 if len(starts) < 5 else True
+
+        scheduler = Scheduler(late_tolerance=0.05,retry_time=0.1,clock=clock)
+        entry = scheduler.add(not_ready,every=1.0)
+        while clock.monotonic() < 2.5:
+            scheduler.run_pending()
+            clock.sleep(scheduler.time_until_next())
+        self.assertEqual(starts,[0.,0.1,0.2,0.3,1.,2.])
+        self.assertEqual(entry.missed_deadlines,0)
+        self.assertEqual(entry.latency.summary()["work"],3)
@@ -3,8 +3,9 @@ import tempfile
 import os
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 
-from growControl import Sensor_humidity_temp
+from growControl import Sensor_humidity_temp, Virtual_Clock
 
 class test_Sensor_humidity_temp(TestCase):
     '''
@@ -26,6 +27,7 @@ class test_Sensor_humidity_temp(TestCase):
             * Verify that a None response in one of the items causes another attempt
                 on the next iteration (ie it doesn't update last_reading)
         '''
+        clock = Virtual_Clock(start=1600000000.)
         try:
             tmp_file = tempfile.gettempdir()
             th = Sensor_humidity_temp(output_file_path=tmp_file,
@@ -35,15 +37,15 @@ class test_Sensor_humidity_temp(TestCase):
                                         average_factor_temp=0.9,
                                         average_factor_humidity=0.8,
                                         csv="test/test_inputs/sensor_humidity_temp_input.csv",
+                                        clock=clock,
                                         verbose=False)
             tmp_file = th.output_file
 
             loop_time = .1
-            start_time = time.time()
+            start_time = clock.time()
             for ii in range(11):
                 th()
-                loop_end = time.time()
-                time.sleep(start_time+(ii+1)*loop_time - loop_end)
+                clock.advance_to(start_time+(ii+1)*loop_time)
             
             # verify the temperature data
             with open(tmp_file,'r') as fp:
@@ -55,7 +57,7 @@ class test_Sensor_humidity_temp(TestCase):
                 t, dt_tz, humidity_raw, humidity_avg, temp_raw, temp_avg = line.strip("\n").split(",")
                 t_c, _, humidity_raw_c, humidity_avg_c,temp_raw_c,temp_avg_c = line_correct.strip("\n").split(",")
 
-                self.assertFloatsClose(float(t),float(t_c)+start_time,eps=.02)
+                self.assertFloatsClose(float(t),float(t_c)+start_time,eps=1e-3)
                 if temp_raw_c == "None":
                     self.assertEqual(temp_raw,temp_raw_c)
                 else:
@@ -71,6 +73,87 @@ class test_Sensor_humidity_temp(TestCase):
         finally:
             os.remove(tmp_file)
 
+    def test_sensor_humidity_temp_executor(self):
+        '''
+        Verify that:
+            * The read is submitted to the executor and __call__ does not wait for it
+            * The result is folded into the averages and output file when the read completes
+            * Two sensors sharing an executor are read at the same time
+            * The time the read took on the executor is recorded in read_latency
+        '''
+        def slow_read():
+            time.sleep(0.2)
+            return (50.5,20.5)
+
+        executor = ThreadPoolExecutor(max_workers=2)
+        tmp_files = []
+        try:
+            sensors = []
+            for name in ["humidity_and_temp_executor_a","humidity_and_temp_executor_b"]:
+                th = Sensor_humidity_temp(output_file_path=tempfile.gettempdir(),
+                                            output_file_base=name,
+                                            gpio_pin=None,
+                                            read_every=10.,
+                                            average_factor_temp=0.9,
+                                            average_factor_humidity=0.8,
+                                            csv="test/test_inputs/sensor_humidity_temp_input.csv",
+                                            executor=executor,
+                                            verbose=False)
+                th._read = slow_read
+                tmp_files.append(th.output_file)
+                sensors.append(th)
+
+            start_time = time.time()
+            for th in sensors:
+                th()
+            self.assertTrue(time.time() - start_time < 0.1,msg="__call__ waited for the read")
+            self.assertIsNone(sensors[0].humidity_raw)
+
+            for th in sensors:
+                th.pending_read.result()
+            self.assertTrue(time.time() - start_time < 0.35,msg="Sensors were not read at the same time")
+
+            for th in sensors:
+                self.assertFloatsClose(th.humidity_raw,50.5)
+                self.assertFloatsClose(th.humidity_avg,50.1)
+                self.assertFloatsClose(th.temp_avg,20.05)
+                with open(th.output_file,'r') as fp:
+                    self.assertEqual(len(fp.readlines()),2)
+                self.assertEqual(th.read_latency.calls,1)
+                self.assertGreaterEqual(th.read_latency.max,0.2) # the read is timed on the executor, not the submit
+        finally:
+            executor.shutdown()
+            for tmp_file in tmp_files:
+                os.remove(tmp_file)
+
+    def test_sensor_humidity_temp_executor_error(self):
+        '''
+        Verify that an exception raised by a read on the executor is raised by the next call
+        '''
+        def failed_read():
+            raise EOFError("No more rows")
+
+        executor = ThreadPoolExecutor(max_workers=1)
+        th = Sensor_humidity_temp(output_file_path=tempfile.gettempdir(),
+                                    output_file_base="humidity_and_temp_executor_error",
+                                    gpio_pin=None,
+                                    read_every=10.,
+                                    average_factor_temp=0.9,
+                                    average_factor_humidity=0.8,
+                                    csv="test/test_inputs/sensor_humidity_temp_input.csv",
+                                    executor=executor,
+                                    verbose=False)
+        try:
+            th._read = failed_read
+            self.assertTrue(th())
+            th.pending_read.exception()
+            self.assertRaises(EOFError,th)
+            self.assertIsNone(th.pending_read)
+        finally:
+            executor.shutdown()
+            if os.path.exists(th.output_file):
+                os.remove(th.output_file)
+
     def test_sensor_humidity_temp_real_readings(self):
         '''
         Test that we can actually read from the sensor
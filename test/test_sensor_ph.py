@@ -4,7 +4,8 @@ import os
 import sys
 import time
 
-from growControl import Sensor_ph
+from growControl import Sensor_ph, Virtual_Clock
+from growControl.sensor_ph import robust_average
 
 class test_Sensor_ph(TestCase):
     '''
@@ -28,6 +29,7 @@ class test_Sensor_ph(TestCase):
             * read_every works properly
         '''
         
+        clock = Virtual_Clock(start=1600000000.)
         try:
             tmp_file = tempfile.gettempdir()
             s = Sensor_ph(output_file_path=tmp_file,
@@ -37,15 +39,15 @@ class test_Sensor_ph(TestCase):
                             csv="test/test_inputs/sensor_ph_input.csv",
                             calibration_file="test/test_inputs/sensor_ph_calibration_mock.json",
                             calibrate_on_startup=False,
+                            clock=clock,
                             verbose=False)
             tmp_file = s.output_file # update with the filename the object creates
 
             loop_time = 0.1
-            start_time = time.time()
+            start_time = clock.time()
             for ii in range(20):
                 s()
-                loop_end = time.time()
-                time.sleep(start_time+(ii+1)*loop_time - loop_end)
+                clock.advance_to(start_time+(ii+1)*loop_time)
 
             with open(tmp_file,'r') as fp:
                 data = fp.readlines()
@@ -59,7 +61,7 @@ class test_Sensor_ph(TestCase):
                 t,_,v_raw,v_avg,ph_raw,ph_avg = line.strip("\n").split(",")
                 t_c,_,v_raw_c,v_avg_c,ph_raw_c,ph_avg_c = line_correct.strip("\n").split(",")
 
-                self.assertFloatsClose(float(t),float(t_c)+start_time,eps=.02) # Not really possible to gaurentee timesteps on order of 1ms
+                self.assertFloatsClose(float(t),float(t_c)+start_time,eps=1e-3)
                 self.assertFloatsClose(float(v_avg),float(v_avg_c))
                 self.assertFloatsClose(float(ph_avg),float(ph_avg_c))
 
@@ -77,6 +79,50 @@ class test_Sensor_ph(TestCase):
         finally:
             os.remove(tmp_file)
 
+    def test_sensor_ph_burst(self):
+        '''
+        Verifies:
+            * robust_average rejects outliers with both methods
+            * In burst mode each reading uses burst_samples samples
+            * The spread is recorded in the output file
+        '''
+        samples = [0.010,0.011,0.009,0.500,0.010]
+        value,spread = robust_average(samples,method="mad")
+        self.assertFloatsClose(value,0.010)
+        self.assertFloatsClose(spread,1.4826*0.001)
+        value,spread = robust_average(samples,method="trimmed",trim_fraction=0.2)
+        self.assertFloatsClose(value,(0.010+0.010+0.011)/3.)
+
+        tmp_dir = tempfile.mkdtemp()
+        input_file = os.path.join(tmp_dir,"sensor_ph_burst_input.csv")
+        with open(input_file,'w') as fp:
+            fp.write("\n".join(str(v) for v in samples + [0.057,0.057,None,0.057,-1.0]) + "\n")
+        try:
+            s = Sensor_ph(output_file_path=tmp_dir,
+                            output_file_base="sensor_ph_burst",
+                            average_factor=0.,
+                            read_every=0.,
+                            csv=input_file,
+                            calibration_file="test/test_inputs/sensor_ph_calibration_mock.json",
+                            calibrate_on_startup=False,
+                            burst_samples=5,
+                            verbose=False)
+            s()
+            self.assertFloatsClose(s.voltage_raw,0.010)
+            s()
+            self.assertFloatsClose(s.voltage_raw,0.057)
+            self.assertFloatsClose(s.ph_raw,7.0-17.5438596491*0.057)
+
+            with open(s.output_file,'r') as fp:
+                data = fp.readlines()
+            self.assertEqual(data[0],"time,datetime_timezone,voltage_raw,voltage_avg,ph_raw,ph_avg,voltage_spread\n")
+            self.assertEqual(len(data),3)
+            self.assertFloatsClose(float(data[1].strip().split(",")[-1]),1.4826*0.001)
+        finally:
+            for fname in os.listdir(tmp_dir):
+                os.remove(os.path.join(tmp_dir,fname))
+            os.rmdir(tmp_dir)
+
     def test_sensor_ph_real_sensor(self):
         '''
         Verifies:
@@ -4,7 +4,7 @@ import os
 import sys
 import time
 
-from growControl import Sensor_volume
+from growControl import Sensor_volume, Fake_GPIO, Virtual_Clock
 
 class test_Sensor_volume(TestCase):
     '''
@@ -26,8 +26,10 @@ class test_Sensor_volume(TestCase):
             * A reading of None does not terminate the run
             * Moving average handles reading None
             * read_every works properly
+            * The end of the csv raises EOFError
         '''
         
+        clock = Virtual_Clock(start=1600000000.)
         try:
             tmp_file = tempfile.gettempdir()
             s = Sensor_volume(output_file_path=tmp_file,
@@ -40,15 +42,15 @@ class test_Sensor_volume(TestCase):
                             csv="test/test_inputs/sensor_volume_test_input.csv",
                             calibration_file="test/test_inputs/sensor_volume_calibration_mock.json",
                             calibrate_on_startup=False,
+                            clock=clock,
                             verbose=False)
             tmp_file = s.output_file # update with the filename the object creates
 
             loop_time = 0.1
-            start_time = time.time()
+            start_time = clock.time()
             for ii in range(10):
                 s()
-                loop_end = time.time()
-                time.sleep(start_time+(ii+1)*loop_time - loop_end)
+                clock.advance_to(start_time+(ii+1)*loop_time)
 
             with open(tmp_file,'r') as fp:
                 data = fp.readlines()
@@ -60,7 +62,7 @@ class test_Sensor_volume(TestCase):
                 t,_,time_raw,time_avg,volume_raw,volume_avg = line.strip("\n").split(",")
                 t_c,_,time_raw_c,time_avg_c,volume_raw_c,volume_avg_c = line_correct.strip("\n").split(",")
 
-                self.assertFloatsClose(float(t),float(t_c)+start_time,eps=.02) # Not really possible to gaurentee timesteps on order of 1ms
+                self.assertFloatsClose(float(t),float(t_c)+start_time,eps=1e-3)
                 self.assertFloatsClose(float(time_avg),float(time_avg_c))
                 self.assertFloatsClose(float(volume_avg),float(volume_avg_c),1e-4)
 
@@ -73,11 +75,56 @@ class test_Sensor_volume(TestCase):
                     self.assertEqual(volume_raw,volume_raw_c)
                 else:
                     self.assertFloatsClose(float(volume_raw),float(volume_raw_c),1e-3)
+
+            # The end of the input is raised, as Sensor_ph does
+            with self.assertRaises(EOFError):
+                for ii in range(20):
+                    clock.advance(1.)
+                    s()
         except:
             raise
         finally:
             os.remove(tmp_file)
 
+    def test_sensor_volume_fake_gpio(self):
+        '''
+        Verifies:
+            * The pulse duration is measured in both the "poll" and "edge" measurement modes
+            * A missing echo in "edge" mode times out and returns None
+        The echo is simulated and timed on a Virtual_Clock through pulse_timer, so only the poll time of the "poll" mode adds to the measurement
+        '''
+        for measurement_mode in ["poll","edge"]:
+            clock = Virtual_Clock(start=1600000000.)
+            gpio = Fake_GPIO(clock=clock)
+            gpio.attach_sr04(trigger_pin=20,echo_pin=21,pulse_duration=0.005)
+            try:
+                tmp_file = tempfile.gettempdir()
+                s = Sensor_volume(output_file_path=tmp_file,
+                                output_file_base="sensor_volume_fake_gpio",
+                                trigger_pin=20,
+                                echo_pin=21,
+                                iterations_per_reading=3,
+                                measurement_mode=measurement_mode,
+                                gpio=gpio,
+                                pulse_timer=clock.monotonic,
+                                average_factor=0.8,
+                                read_every=0.,
+                                calibration_file="test/test_inputs/sensor_volume_calibration_mock.json",
+                                calibrate_on_startup=False,
+                                clock=clock,
+                                verbose=False)
+                tmp_file = s.output_file
+
+                s()
+                self.assertFloatsClose(s.pulse_duration_raw,0.005,eps=1e-5)
+
+                if measurement_mode == "edge":
+                    gpio.set_pulse_duration(20,1.0) # longer than the timeout
+                    self.assertIsNone(s._read())
+                s.cleanup()
+            finally:
+                os.remove(tmp_file)
+
     def test_sensor_volume_real_sensor(self):
         '''
         Verifies:
@@ -0,0 +1,165 @@
+from unittest import TestCase
+import tempfile
+import os
+import shutil
+import time
+
+from growControl import Calibration_Store
+from growControl.supervisor import Supervisor, shard_config, check_calibrations
+
+def ph_bin(name,csv,read_every):
+    '''
+    A bin with a csv ph sensor
+    '''
+    return {"name":name,
+            "devices":[{"name":"ph","type":"Sensor_ph",
+                        "params":{"csv":csv,
+                                    "calibration_file":os.path.abspath("test/test_inputs/sensor_ph_calibration_mock.json"),
+                                    "calibrate_on_startup":False,
+                                    "read_every":read_every}}]}
+
+def wait_for(condition,timeout=30.):
+    '''
+    Wait until condition() is True, returns False if timeout seconds pass first
+    '''
+    end_time = time.monotonic() + timeout
+    while time.monotonic() < end_time:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+class test_Supervisor(TestCase):
+    '''
+    Test cases for the Supervisor class
+    '''
+
+    def test_shard_config(self):
+        '''
+        Verifies:
+            * The bins are split round robin and empty shards are left out
+            * Bins that refer to each other's devices are kept in the same shard, in the order of the config
+        '''
+        config = {"output_dir":"data","bins":[{"name":"bin{}".format(ii)} for ii in range(5)]}
+        shards = shard_config(config,2)
+        self.assertEqual([[b["name"] for b in shard["bins"]] for shard in shards],[["bin0","bin2","bin4"],["bin1","bin3"]])
+        self.assertEqual(shards[1]["output_dir"],"data")
+        self.assertEqual(len(shard_config(config,8)),5)
+
+        config["bins"][3]["devices"] = [{"name":"controller","params":{"sensor_ph":"@bin0/ph"}}]
+        config["bins"][4]["devices"] = [{"name":"controller","params":{"sensor_ph":"@bin3/ph","pump":"@pump"}}]
+        shards = shard_config(config,2)
+        self.assertEqual([[b["name"] for b in shard["bins"]] for shard in shards],[["bin0","bin3","bin4"],["bin1","bin2"]])
+        self.assertEqual(len(shard_config(config,8)),3)
+        config["bins"][4]["devices"][0]["params"]["sensor_ph"] = "@bin9/ph"
+        self.assertRaises(ValueError,shard_config,config,2)
+
+    def test_supervisor_cross_bin(self):
+        '''
+        Verifies:
+            * A controller that uses the sensor of another bin runs with 2 workers, its bin is in the sensor's worker
+        '''
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            tank = ph_bin("tank",os.path.abspath("test/test_inputs/sensor_ph_sinewave01_voltage.csv"),0.5)
+            dosing = {"name":"dosing",
+                        "devices":[{"name":"pump_up","type":"Controllable_Pump","params":{"gpio_pin":None}},
+                                    {"name":"pump_down","type":"Controllable_Pump","params":{"gpio_pin":None}},
+                                    {"name":"ph_controller","type":"Controller_ph_Pump",
+                                    "params":{"sensor_ph":"@tank/ph","pump_ph_up":"@pump_up","pump_ph_down":"@pump_down",
+                                                "control_every":0.5,"warmup_time":0.}}]}
+            other = ph_bin("other",os.path.abspath("test/test_inputs/sensor_ph_sinewave01_voltage.csv"),0.5)
+            config = {"output_dir":os.path.join(tmp_dir,""),"output_writer":None,"bins":[tank,other,dosing]}
+            supervisor = Supervisor(config,n_workers=2,restart_delay=0.1)
+            self.assertEqual([[b["name"] for b in worker.config["bins"]] for worker in supervisor.workers],[["tank","dosing"],["other"]])
+            supervisor.start()
+            try:
+                self.assertTrue(wait_for(lambda: len(supervisor.statuses()) == 3))
+                self.assertEqual([status["key"] for status in supervisor.statuses()],["tank/ph","other/ph","dosing/ph_controller"])
+                self.assertEqual(supervisor.restarts(),0)
+            finally:
+                supervisor.stop()
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_check_calibrations(self):
+        '''
+        Verifies:
+            * A sensor without a calibration, or that would calibrate on startup, stops the Supervisor before any worker starts
+            * A calibration in the store of the output directory is enough
+        '''
+        tmp_dir = os.path.join(tempfile.mkdtemp(),"")
+        try:
+            sensor = {"name":"ph","type":"Sensor_ph","params":{"calibrate_on_startup":False}}
+            config = {"output_dir":tmp_dir,"bins":[{"name":"bin1","devices":[sensor]}]}
+            with self.assertRaises(ValueError) as context:
+                Supervisor(config)
+            self.assertIn("bin1/ph has no calibration",str(context.exception))
+
+            Calibration_Store(tmp_dir).save("Sensor_ph","ph_bin1",{"m":-17.5,"b":7.})
+            check_calibrations(config)
+            sensor["params"]["calibrate_on_startup"] = True
+            self.assertRaises(ValueError,check_calibrations,config)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_supervisor(self):
+        '''
+        Verifies:
+            * Each worker runs its bins and the parent receives the values of all of them in config order
+            * A worker that crashes (here its csv input runs out) is restarted and the error is kept
+        '''
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            short_csv = os.path.join(tmp_dir,"short.csv")
+            with open(short_csv,'w') as fp:
+                fp.write("0.0\n0.057\n")
+            config = {"output_dir":os.path.join(tmp_dir,""),
+                        "output_writer":None,
+                        "bins":[ph_bin("bin1",os.path.abspath("test/test_inputs/sensor_ph_sinewave01_voltage.csv"),1.0),
+                                ph_bin("bin2",short_csv,0.05)]}
+            updated = []
+            supervisor = Supervisor(config,n_workers=2,restart_delay=0.1,on_update=updated.append)
+            self.assertEqual(len(supervisor.workers),2)
+            supervisor.start()
+            try:
+                self.assertTrue(wait_for(lambda: len(supervisor.statuses()) == 2))
+                self.assertEqual([status["key"] for status in supervisor.statuses()],["bin1/ph","bin2/ph"])
+                name,current,average = supervisor.statuses()[0]["values"][0]
+                self.assertEqual(name,"pH")
+                self.assertIn("bin1/ph",updated)
+
+                self.assertTrue(wait_for(lambda: supervisor.workers[1].restarts >= 1))
+                self.assertIn("EOFError",supervisor.workers[1].last_error)
+                self.assertEqual(supervisor.workers[0].restarts,0)
+                self.assertTrue(supervisor.workers[0].process.is_alive())
+            finally:
+                supervisor.stop()
+            self.assertFalse(supervisor.workers[0].process.is_alive())
+            self.assertEqual(supervisor.workers[0].process.exitcode,0)
+            self.assertTrue(any(f.startswith("ph_bin1") for f in os.listdir(tmp_dir)))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_supervisor_gives_up(self):
+        '''
+        Verifies:
+            * A worker that keeps dying right after it starts is restarted with a growing delay, then given up on
+        '''
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            short_csv = os.path.join(tmp_dir,"short.csv")
+            with open(short_csv,'w') as fp:
+                fp.write("0.0\n")
+            config = {"output_dir":os.path.join(tmp_dir,""),"output_writer":None,"bins":[ph_bin("bin1",short_csv,0.05)]}
+            supervisor = Supervisor(config,n_workers=1,restart_delay=0.05,max_restarts=2)
+            supervisor.start()
+            try:
+                self.assertTrue(wait_for(lambda: supervisor.workers[0].gave_up))
+                self.assertEqual(supervisor.restarts(),2)
+                self.assertEqual(supervisor._restart_delay(supervisor.workers[0]),0.2)
+                self.assertIn("EOFError",supervisor.workers[0].last_error)
+            finally:
+                supervisor.stop()
+        finally:
+            shutil.rmtree(tmp_dir)
@@ -0,0 +1,87 @@
+from unittest import TestCase
+import tempfile
+import datetime
+import math
+import os
+import shutil
+
+from growControl import Sensor_ph
+from growControl.output_writer import format_output_row
+from growControl.replay import Replay_Source, replay_files
+from growControl.sweep import Dosed_Source, grid, sweep, rank, format_table, write_table
+
+class test_Sweep(TestCase):
+    '''
+    Test cases for the controller settings sweep
+    '''
+
+    def setUp(self):
+        # One day of readings every 30s at ph 6.5 with the mock calibration
+        self.data_dir = tempfile.mkdtemp()
+        self.day = datetime.date(2021,3,1)
+        self.start = datetime.datetime.combine(self.day,datetime.time()).timestamp()
+        self.end = self.start + 86400.
+        self.calibration_file = "test/test_inputs/sensor_ph_calibration_mock.json"
+        voltage = (6.5 - 7.) / -17.5438596491
+        with open(os.path.join(self.data_dir,"sensor_ph_bin1_{}.csv".format(self.day.isoformat())),'w') as fp:
+            fp.write(Sensor_ph.output_header)
+            for ii in range(2880):
+                fp.write(format_output_row(self.start + ii*30.,[voltage,voltage,6.5,6.5]))
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_dosed_source(self):
+        '''
+        Verifies:
+            * The doses shift the recorded voltage by ph_per_ml for each ml, in the direction of the dose
+            * The shift decays with recovery_time
+        '''
+        actions = []
+        source = Dosed_Source(Replay_Source(replay_files(self.data_dir,"sensor_ph_bin1",self.start,self.end),"voltage_raw"),
+                                actions,
+                                ph_per_ml=0.1,
+                                recovery_time=3600.)
+        source.volts_per_ph = 1. / -17.5438596491
+        self.assertEqual(source.advance(),self.start)
+        recorded = source.read()[0]
+        actions.append((self.start,"controller_ph_pump","Adjust ph Down",2.))
+        actions.append((self.start,"controller_volume_pump","Add Water",2.))
+        for ii in range(120): # one hour later
+            source.advance()
+        self.assertAlmostEqual(source.offset,-0.2*math.exp(-1.))
+        self.assertAlmostEqual((source.read()[0]-recorded)*-17.5438596491,-0.2*math.exp(-1.))
+
+    def test_sweep(self):
+        '''
+        Verifies:
+            * The grid leaves out the settings with ph_min >= ph_max
+            * The settings are scored the same on the process pool as in process
+            * Larger doses bring the ph in to the band sooner, and rank first
+            * A setting without a score ranks last
+        '''
+        settings = grid([5.8,6.3],[6.2],[0.5,3.0],[1800.])
+        self.assertEqual(len(settings),2)
+        kwargs = {"data_path":self.data_dir,
+                    "sensor":"sensor_ph_bin1",
+                    "start":self.start,
+                    "end":self.end,
+                    "calibration_file":self.calibration_file,
+                    "ph_per_ml":0.05,
+                    "recovery_time":6*3600.}
+        results = sweep(settings,workers=2,**kwargs)
+        self.assertEqual(results,sweep(settings,workers=1,**kwargs))
+        self.assertEqual(results[0]["dispense_volume"],3.0)
+        self.assertGreater(results[0]["time_in_band"],results[1]["time_in_band"])
+        self.assertGreater(results[0]["actions"],0)
+        self.assertEqual(results[0]["dosed_ml"],results[0]["ph_down_ml"])
+        self.assertEqual(rank(list(reversed(results))),results)
+        unscored = dict(results[0],time_in_band=float("nan"))
+        for ii in range(len(results)+1):
+            self.assertIs(rank(results[:ii] + [unscored] + results[ii:])[-1],unscored)
+
+        self.assertEqual(len(format_table(results).splitlines()),3)
+        output_file = os.path.join(self.data_dir,"sweep.csv")
+        write_table(results,output_file)
+        with open(output_file,'r') as fp:
+            self.assertTrue(fp.readlines()[1].startswith("1,5.8,6.2,3.0,1800.0"))